@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urljoin, urlsplit
+
+import cv2
+import numpy as np
+
+from datasetShards import list_images
+from onnxTest import ImagePredictor, StageStats
+
+# 这些状态码视为临时故障，按退避策略重试；其他非200状态码直接判为失败
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+
+class FetchError(Exception):
+    def __init__(self, url, message, retryable=True):
+        super().__init__(f"{url}: {message}")
+        self.url = url
+        self.retryable = retryable
+
+
+class ActiveStageStats(StageStats):
+    """
+    另外记录阶段的活跃时间：至少有一个任务在处理该阶段的墙钟时间，即各任务忙碌区间的并集。
+    并发的任务忙碌时间相加会超过墙钟时间，活跃时间不会。只在事件循环线程中调用enter/leave。
+    """
+
+    def __init__(self, name, workers):
+        super().__init__(name, workers)
+        self.active = 0.0
+        self._running = 0
+        self._since = 0.0
+
+    def enter(self):
+        now = time.perf_counter()
+        if self._running == 0:
+            self._since = now
+        self._running += 1
+        return now
+
+    def leave(self):
+        now = time.perf_counter()
+        self._running -= 1
+        if self._running == 0:
+            self.active += now - self._since
+        return now
+
+    def __str__(self):
+        return f"{super().__str__()}, 活跃 {self.active:.2f}s"
+
+
+class FetchStats(ActiveStageStats):
+    """
+    下载阶段的统计，另外记录重试次数、失败数与下载字节数。忙碌时间是各请求耗时（含重试等待）之和。
+    """
+
+    def __init__(self, name, workers):
+        super().__init__(name, workers)
+        self.retries = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def __str__(self):
+        return (f"{super().__str__()}, 重试 {self.retries} 次, 失败 {self.failed} 张, "
+                f"下载 {self.bytes / (1 << 20):.1f} MB")
+
+
+def read_manifest(manifest_path):
+    """
+    读取清单：每行一个图像URL（http/https/file）或本地路径，忽略空行与#开头的注释行。
+    """
+    with open(manifest_path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+
+
+def write_manifest(image_dir, base_url, manifest_path):
+    """
+    为目录中的图像生成指向base_url的清单，配合start_image_server做本地测试。
+    """
+    image_dir = os.path.abspath(image_dir)
+    with open(manifest_path, 'w') as file:
+        for image_path in list_images(image_dir):
+            relative = os.path.relpath(image_path, image_dir).replace(os.sep, '/')
+            file.write(f"{base_url.rstrip('/')}/{quote(relative)}\n")
+
+
+async def _http_request(url, max_bytes):
+    """
+    发送一次HTTP/1.1 GET（Connection: close），返回(状态码, 响应头, 响应体)。非200响应不读取响应体。
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or (443 if https else 80),
+                                                   ssl=ssl.create_default_context() if https else None)
+    try:
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: {parts.netloc.rsplit('@', 1)[-1]}\r\n"
+                     f"User-Agent: manhole-ingest\r\nAccept-Encoding: identity\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+        status_line = (await reader.readline()).split(None, 2)
+        if len(status_line) < 2 or not status_line[0].startswith(b'HTTP/'):
+            raise FetchError(url, '无效的HTTP响应')
+        status = int(status_line[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if status != 200:
+            return status, headers, b''
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks, total = [], 0
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    break
+                total += size
+                if total > max_bytes:
+                    raise FetchError(url, f'响应超过 {max_bytes} 字节', retryable=False)
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > max_bytes:
+                raise FetchError(url, f'响应超过 {max_bytes} 字节', retryable=False)
+            body = await reader.readexactly(length)
+        else:
+            body = await reader.read()
+            if len(body) > max_bytes:
+                raise FetchError(url, f'响应超过 {max_bytes} 字节', retryable=False)
+        return status, headers, body
+    finally:
+        writer.close()
+
+
+async def fetch(url, timeout=30.0, max_bytes=64 << 20, max_redirects=5):
+    """
+    读取一个图像的字节：http/https用asyncio连接直接请求，file://与本地路径在线程中读取。
+    :param timeout: 单次请求（含读取响应体）的超时秒数
+    """
+    scheme = urlsplit(url).scheme
+    if scheme not in ('http', 'https'):
+        path = urllib.request.url2pathname(urlsplit(url).path) if scheme == 'file' else url
+        return await asyncio.wait_for(asyncio.to_thread(_read_file, path), timeout)
+
+    for _ in range(max_redirects + 1):
+        status, headers, body = await asyncio.wait_for(_http_request(url, max_bytes), timeout)
+        if status in REDIRECT_STATUSES and 'location' in headers:
+            url = urljoin(url, headers['location'])
+            continue
+        if status != 200:
+            raise FetchError(url, f'HTTP {status}', retryable=status in RETRY_STATUSES)
+        return body
+    raise FetchError(url, '重定向次数过多', retryable=False)
+
+
+def _read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+async def fetch_with_retry(url, stats, retries=3, timeout=30.0, backoff=0.5, max_bytes=64 << 20):
+    """
+    按指数退避（带随机抖动）重试临时故障：超时、连接错误、响应不完整与RETRY_STATUSES中的状态码。
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await fetch(url, timeout, max_bytes)
+        except FetchError as e:
+            if not e.retryable or attempt == retries:
+                raise
+        except (OSError, asyncio.IncompleteReadError):
+            # TimeoutError与各种连接错误都是OSError的子类
+            if attempt == retries:
+                raise
+        stats.retries += 1
+        await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def decode_image(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+async def _fetch_worker(pending, ready, stats, decode_pool, failures, retries, timeout, backoff, max_bytes):
+    """
+    从共享的待处理迭代器中逐个取URL：下载 -> 线程池解码 -> 放入有界队列。队列满时暂停下载（背压）。
+    """
+    loop = asyncio.get_running_loop()
+    for index, url in pending:
+        start = stats['fetch'].enter()
+        try:
+            data = await fetch_with_retry(url, stats['fetch'], retries, timeout, backoff, max_bytes)
+        except Exception as e:
+            stats['fetch'].leave()
+            stats['fetch'].failed += 1
+            failures.append((url, repr(e)))
+            continue
+        stats['fetch'].add(1, stats['fetch'].leave() - start)
+        stats['fetch'].bytes += len(data)
+
+        start = stats['decode'].enter()
+        image = await loop.run_in_executor(decode_pool, decode_image, data)
+        stats['decode'].add(1, stats['decode'].leave() - start)
+        del data
+        if image is None:
+            failures.append((url, '无法解码图像'))
+            continue
+        await ready.put((index, url, image))
+
+
+def _infer_batch(predictor, batch, images):
+    infos = [predictor.preprocess_image(image, out=batch[i])[1] for i, image in enumerate(images)]
+    return predictor.postprocess(predictor.predict_padded(batch, len(images)), infos)
+
+
+async def ingest(predictor, urls, output_path=None, batch_size=8, concurrency=32, decode_workers=4,
+                 max_in_flight=64, retries=3, timeout=30.0, backoff=0.5, max_wait=0.05, max_bytes=64 << 20):
+    """
+    异步批量推理远程图像：concurrency个协程并发下载，线程池解码，凑批后在单独的线程中推理，
+    下载、解码与推理相互重叠。每批结果推理完立即追加写入output_path。
+    :param urls: 图像URL（或本地路径）列表
+    :param output_path: 结果JSONL，每行 image/url/boxes/class_ids/confidences，可直接作为evaluate.py的运行缓存
+    :param batch_size: 推理批量大小；模型导出时固定了批量维度则以模型为准
+    :param concurrency: 同时进行的下载数上限
+    :param decode_workers: 解码线程数
+    :param max_in_flight: 已解码、等待推理的图像数上限，与concurrency、batch_size一起限定内存中的图像数
+    :param retries: 临时故障的重试次数
+    :param timeout: 单次请求的超时秒数
+    :param backoff: 第一次重试前的等待秒数，之后每次加倍
+    :param max_wait: 凑批时等待后续图像的最长秒数，超时后不满一批也立即推理
+    :param max_bytes: 单个图像的最大字节数
+    :return: (失败列表[(url, 错误)], 各阶段及total的统计字典)
+    """
+    if predictor.fixed_batch_size is not None:
+        batch_size = predictor.fixed_batch_size
+    loop = asyncio.get_running_loop()
+    concurrency = max(1, min(concurrency, len(urls)))
+    stats = {
+        'fetch': FetchStats('fetch', concurrency),
+        'decode': ActiveStageStats('decode', decode_workers),
+        'infer': ActiveStageStats('infer', 1),
+    }
+    failures = []
+    ready = asyncio.Queue(maxsize=max_in_flight)
+    pending = iter(enumerate(urls))
+    batch = predictor.batch_buffer(batch_size)
+    output = open(output_path, 'w') if output_path else None
+    wall_start = time.perf_counter()
+
+    with ThreadPoolExecutor(decode_workers) as decode_pool, ThreadPoolExecutor(1) as infer_pool:
+        workers = [asyncio.create_task(_fetch_worker(pending, ready, stats, decode_pool, failures, retries, timeout,
+                                                     backoff, max_bytes))
+                   for _ in range(concurrency)]
+
+        async def close_queue():
+            await asyncio.gather(*workers)
+            await ready.put(None)
+
+        closer = asyncio.create_task(close_queue())
+        finished = False
+        try:
+            while not finished:
+                item = await ready.get()
+                items = []
+                deadline = loop.time() + max_wait
+                while item is not None:
+                    items.append(item)
+                    if len(items) == batch_size:
+                        break
+                    try:
+                        item = await asyncio.wait_for(ready.get(), max(0.0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                finished = item is None
+                if not items:
+                    continue
+
+                start = stats['infer'].enter()
+                predictions = await loop.run_in_executor(infer_pool, _infer_batch, predictor, batch,
+                                                         [image for _, _, image in items])
+                stats['infer'].add(len(items), stats['infer'].leave() - start)
+                if output is not None:
+                    for (_, url, _), (boxes, class_ids, confidences) in zip(items, predictions):
+                        output.write(json.dumps({'image': os.path.basename(unquote(urlsplit(url).path)), 'url': url,
+                                                 'boxes': boxes, 'class_ids': class_ids,
+                                                 'confidences': confidences}) + '\n')
+                    output.flush()
+            await closer
+        finally:
+            for task in workers + [closer]:
+                task.cancel()
+            if output is not None:
+                output.close()
+
+    stats['total'] = StageStats('total', 1)
+    stats['total'].add(len(urls) - len(failures), time.perf_counter() - wall_start)
+    return failures, stats
+
+
+def run_ingest(predictor, urls, output_path=None, **kwargs):
+    return asyncio.run(ingest(predictor, urls, output_path, **kwargs))
+
+
+def format_overlap(stats):
+    """
+    各阶段统计与阶段间的重叠效率：串行耗时为下载、解码、推理三个阶段活跃时间（各自忙碌区间的并集）之和，
+    即三个阶段依次执行所需的时间，与墙钟时间的比值在1到3之间，越大说明阶段之间重叠越充分；
+    推理占用是推理线程忙碌时间占墙钟时间的比例，接近100%说明瓶颈在推理。
+    """
+    wall = stats['total'].busy
+    serial = sum(stats[name].active for name in ('fetch', 'decode', 'infer'))
+    lines = [str(stage) for stage in stats.values()]
+    if wall > 0:
+        lines.append(f"各阶段活跃时间之和 {serial:.2f}s / 墙钟 {wall:.2f}s，阶段重叠效率 {serial / wall:.2f}x，"
+                     f"推理占用 {stats['infer'].busy / wall:.0%}")
+    return '\n'.join(lines)
+
+
+class _ImageRequestHandler(SimpleHTTPRequestHandler):
+    """
+    本地替身对象存储：在返回文件前加入固定延迟，并按概率返回503，用于测试并发、重试与背压。
+    """
+    latency = 0.0
+    failure_rate = 0.0
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            failed = self.rng.random() < self.failure_rate
+        if failed:
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_image_server(directory, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=0):
+    """
+    在后台线程中启动本地图像服务器。
+    :param port: 0表示由系统分配空闲端口
+    :return: (server, 基础URL)，用server.shutdown()停止
+    """
+    handler = type('ImageRequestHandler', (_ImageRequestHandler,),
+                   {'latency': latency, 'failure_rate': failure_rate, 'rng': random.Random(seed),
+                    'lock': threading.Lock()})
+    server = ThreadingHTTPServer((host, port), partial(handler, directory=os.path.abspath(directory)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='从URL清单异步下载图像并批量推理，报告下载、解码与推理的重叠效率')
+    parser.add_argument('manifest', help='图像URL清单，每行一个；与--serve一起使用时写入该路径')
+    parser.add_argument('--model', default='best-sim.onnx')
+    parser.add_argument('--variant', default=None, help='模型变体，如 int8-static')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--output', default='ingest_results.jsonl', help='结果JSONL，可作为evaluate.py的运行缓存')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32, help='同时进行的下载数上限')
+    parser.add_argument('--decode-workers', type=int, default=4)
+    parser.add_argument('--max-in-flight', type=int, default=64, help='已解码、等待推理的图像数上限')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30.0, help='单次请求的超时秒数')
+    parser.add_argument('--backoff', type=float, default=0.5, help='第一次重试前的等待秒数')
+    parser.add_argument('--serve', default=None, metavar='DIR', help='用本地替身服务器提供该目录的图像，并生成清单')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='替身服务器每个请求的延迟秒数')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='替身服务器返回503的概率')
+    parser.add_argument('--serve-only', action='store_true', help='只启动替身服务器，不推理')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.serve:
+        server, base_url = start_image_server(args.serve, port=args.port, latency=args.latency,
+                                              failure_rate=args.failure_rate)
+        write_manifest(args.serve, base_url, args.manifest)
+        print(f"替身服务器: {base_url}，清单: {args.manifest}")
+        if args.serve_only:
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                server.shutdown()
+                return
+
+    try:
+        urls = read_manifest(args.manifest)
+        predictor = ImagePredictor(args.model, conf_threshold=args.conf, variant=args.variant)
+        failures, stats = run_ingest(predictor, urls, args.output, batch_size=args.batch_size,
+                                     concurrency=args.concurrency, decode_workers=args.decode_workers,
+                                     max_in_flight=args.max_in_flight, retries=args.retries, timeout=args.timeout,
+                                     backoff=args.backoff)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(format_overlap(stats))
+    for url, error in failures:
+        print(f"失败: {url}\t{error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import time
+
+import numpy as np
+
+from onnxTest import ImagePredictor
+
+
+def legacy_decode(output, conf_threshold):
+    """
+    原先postprocess中逐行解码的Python循环，仅作为对照基准保留。
+    """
+    boxes = []
+    confidences = []
+    class_ids = []
+    for detection in output:
+        objectness_score = detection[4]  # 对象存在概率
+        scores = detection[5:]  # 类别得分
+        class_id = np.argmax(scores)
+        confidence = scores[class_id] * objectness_score
+
+        if confidence > conf_threshold:
+            center_x, center_y, width, height = detection[0:4]
+            x_min = int(center_x - (width / 2))
+            y_min = int(center_y - (height / 2))
+            x_max = int(center_x + (width / 2))
+            y_max = int(center_y + (height / 2))
+
+            boxes.append([x_min, y_min, x_max, y_max])
+            confidences.append(float(confidence))
+            class_ids.append(int(class_id))
+    return boxes, class_ids, confidences
+
+
+def reference_nms(boxes, class_ids, confidences, nms_threshold, agnostic=False):
+    """
+    独立的贪心NMS参考实现：按置信度从高到低（稳定排序）依次保留，与已保留框IoU超过阈值的框被抑制。
+    不区分类别时任意已保留框都会抑制，否则只有同类别的已保留框会抑制。
+    :return: 保留下来的下标，按置信度从高到低排列
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    for i in np.argsort(-np.asarray(confidences, dtype=np.float64), kind='stable').tolist():
+        suppressed = False
+        for j in keep:
+            if not agnostic and class_ids[i] != class_ids[j]:
+                continue
+            width = min(boxes[i, 2], boxes[j, 2]) - max(boxes[i, 0], boxes[j, 0])
+            height = min(boxes[i, 3], boxes[j, 3]) - max(boxes[i, 1], boxes[j, 1])
+            inter = max(width, 0.0) * max(height, 0.0)
+            if inter / (areas[i] + areas[j] - inter) > nms_threshold:
+                suppressed = True
+                break
+        if not suppressed:
+            keep.append(i)
+    return keep
+
+
+def synthetic_output(rng, num_rows=25200, num_classes=5, input_size=640):
+    """
+    生成与YOLOv5输出形状一致的随机结果，对象概率偏低，使只有少量行超过阈值。
+    """
+    output = np.empty((num_rows, 5 + num_classes), dtype=np.float32)
+    output[:, 0:2] = rng.uniform(0, input_size, (num_rows, 2))
+    output[:, 2:4] = rng.uniform(8, input_size / 3, (num_rows, 2))
+    output[:, 4] = rng.random(num_rows) ** 64
+    output[:, 5:] = rng.random((num_rows, num_classes))
+    return output
+
+
+def make_predictor(conf_threshold, nms_threshold, agnostic_nms):
+    # 解码与NMS不依赖ONNX会话，这里跳过模型加载
+    predictor = ImagePredictor.__new__(ImagePredictor)
+    predictor.conf_threshold = conf_threshold
+    predictor.nms_threshold = nms_threshold
+    predictor.agnostic_nms = agnostic_nms
+    return predictor
+
+
+def check_parity(predictor, outputs):
+    """
+    逐张比较向量化解码与原循环解码的候选框，再用独立的reference_nms检查postprocess的最终结果。
+    decode保留小数坐标，截断取整后应与原循环的int()结果一致。
+    与原实现相比NMS有两处有意的语义变化，参考实现按新语义计算：
+    原实现把xyxy框当作(x, y, w, h)传给cv2.dnn.NMSBoxes，IoU计算有误，现在按xyxy计算IoU；
+    原实现不区分类别，现在默认按类别分别抑制，agnostic_nms=True时不区分类别。
+    """
+    for output in outputs:
+        boxes, class_ids, confidences = predictor.decode(output)
+        ref_boxes, ref_class_ids, ref_confidences = legacy_decode(output, predictor.conf_threshold)
+        assert boxes.astype(np.int32).tolist() == ref_boxes, '候选框不一致'
+        assert class_ids.tolist() == ref_class_ids, '类别不一致'
+        assert confidences.tolist() == ref_confidences, '置信度不一致'
+
+        keep = reference_nms(boxes, ref_class_ids, ref_confidences, predictor.nms_threshold,
+                             predictor.agnostic_nms)
+        expected = [([ref_boxes[i] for i in keep], [ref_class_ids[i] for i in keep],
+                     [ref_confidences[i] for i in keep])]
+        assert predictor.postprocess(output[None]) == expected, 'NMS后结果不一致'
+
+
+def time_per_image(fn, outputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for output in outputs:
+            fn(output)
+    return (time.perf_counter() - start) / (repeat * len(outputs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='postprocess向量化解码的一致性检查与微基准')
+    parser.add_argument('--images', type=int, default=20, help='随机输出的数量')
+    parser.add_argument('--repeat', type=int, default=5, help='向量化版本的重复次数')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--nms', type=float, default=0.45)
+    parser.add_argument('--agnostic', action='store_true', help='使用不区分类别的NMS')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    outputs = [synthetic_output(rng) for _ in range(args.images)]
+    predictor = make_predictor(args.conf, args.nms, args.agnostic)
+
+    check_parity(predictor, outputs)
+    print(f'一致性检查通过: {len(outputs)} 张图像')
+
+    legacy_time = time_per_image(lambda o: legacy_decode(o, args.conf), outputs, 1)
+    vector_time = time_per_image(predictor.decode, outputs, args.repeat)
+    total_time = time_per_image(lambda o: predictor.postprocess(o[None]), outputs, args.repeat)
+    print(f'循环解码:   {legacy_time * 1000:.3f} ms/张')
+    print(f'向量化解码: {vector_time * 1000:.3f} ms/张 (加速 {legacy_time / vector_time:.1f}x)')
+    print(f'解码 + NMS: {total_time * 1000:.3f} ms/张')
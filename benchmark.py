@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+CLASS_NAMES = ['good', 'broke', 'lose', 'uncovered', 'circle']
+CASES = ['preprocess', 'session', 'postprocess', 'directory', 'pipelined', 'augment', 'xml_convert', 'summary']
+# 比较模式下默认允许的相对退化
+DEFAULT_TOLERANCE = 0.1
+
+
+def build_model(path, input_size=640, num_classes=5, objectness_bias=-3.0, seed=0):
+    """
+    生成与YOLOv5输出形状一致（B, 25200, 5 + 类别数）的随机权重ONNX模型，批量维度为动态。
+    三个检测头各用一个与步长同尺寸的卷积代替，objectness_bias使每张图只有少量候选框超过阈值。
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+    channels = 5 + num_classes
+    nodes, initializers, heads = [], [], []
+    for i, stride in enumerate([8, 16, 32]):
+        grid = input_size // stride
+        weight = (rng.standard_normal((3 * channels, 3, stride, stride)) / stride).astype(np.float32)
+        initializers += [numpy_helper.from_array(weight, f'w{i}'),
+                         numpy_helper.from_array(np.array([0, 3, channels, grid * grid], np.int64), f'split{i}'),
+                         numpy_helper.from_array(np.array([0, 3 * grid * grid, channels], np.int64), f'rows{i}')]
+        nodes += [helper.make_node('Conv', ['images', f'w{i}'], [f'conv{i}'], strides=[stride, stride]),
+                  helper.make_node('Reshape', [f'conv{i}', f'split{i}'], [f'anchors{i}']),
+                  helper.make_node('Transpose', [f'anchors{i}'], [f'transposed{i}'], perm=[0, 1, 3, 2]),
+                  helper.make_node('Reshape', [f'transposed{i}', f'rows{i}'], [f'head{i}'])]
+        heads.append(f'head{i}')
+    bias = np.zeros(channels, np.float32)
+    bias[4] = objectness_bias
+    scale = np.array([input_size] * 4 + [1] * (channels - 4), np.float32)
+    initializers += [numpy_helper.from_array(bias, 'bias'), numpy_helper.from_array(scale, 'scale')]
+    nodes += [helper.make_node('Concat', heads, ['concat'], axis=1),
+              helper.make_node('Add', ['concat', 'bias'], ['logits']),
+              helper.make_node('Sigmoid', ['logits'], ['probabilities']),
+              helper.make_node('Mul', ['probabilities', 'scale'], ['output0'])]
+    graph = helper.make_graph(
+        nodes, 'benchmark',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['batch', 3, input_size, input_size])],
+        [helper.make_tensor_value_info('output0', TensorProto.FLOAT, ['batch', 25200, channels])], initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, str(path))
+    return Path(path)
+
+
+def synthetic_image(rng, width, height):
+    """
+    灰色路面背景上画几个椭圆井盖，返回(图像, [(类别id, xmin, ymin, xmax, ymax)])。
+    """
+    image = np.full((height, width, 3), 90, dtype=np.uint8)
+    image += rng.integers(0, 40, (height, width, 1), dtype=np.uint8)
+    objects = []
+    for _ in range(rng.integers(1, 4)):
+        radius = int(rng.integers(20, min(width, height) // 6))
+        cx, cy = int(rng.integers(radius, width - radius)), int(rng.integers(radius, height - radius))
+        class_id = int(rng.integers(len(CLASS_NAMES)))
+        cv2.ellipse(image, (cx, cy), (radius, int(radius * 0.7)), 0, 0, 360, (40 + 30 * class_id,) * 3, -1)
+        objects.append((class_id, cx - radius, cy - int(radius * 0.7), cx + radius, cy + int(radius * 0.7)))
+    return image, objects
+
+
+def voc_xml(filename, width, height, objects):
+    parts = [f"<annotation><filename>{filename}</filename>",
+             f"<size><width>{width}</width><height>{height}</height><depth>3</depth></size>"]
+    for class_id, xmin, ymin, xmax, ymax in objects:
+        parts.append(f"<object><name>{CLASS_NAMES[class_id]}</name><bndbox><xmin>{xmin}</xmin><ymin>{ymin}</ymin>"
+                     f"<xmax>{xmax}</xmax><ymax>{ymax}</ymax></bndbox></object>")
+    parts.append('</annotation>')
+    return ''.join(parts)
+
+
+def build_dataset(root: Path, num_images=64, width=1280, height=720, val_ratio=0.25, seed=0):
+    """
+    生成合成数据集：YOLO结构的images/labels（train、val），以及与data_preprocess.py结构一致的VOC XML目录。
+    """
+    rng = np.random.default_rng(seed)
+    for subdir in ['images/train', 'images/val', 'labels/train', 'labels/val', 'train_xmls', 'val_xmls']:
+        (root / subdir).mkdir(parents=True, exist_ok=True)
+    for i in range(num_images):
+        split = 'val' if i < num_images * val_ratio else 'train'
+        name = f"well{i % 5}_{i:04d}"
+        image, objects = synthetic_image(rng, width, height)
+        cv2.imwrite(str(root / 'images' / split / f"{name}.jpg"), image)
+        with open(root / 'labels' / split / f"{name}.txt", 'w') as file:
+            file.write('\n'.join(f"{class_id} {(xmin + xmax) / 2 / width} {(ymin + ymax) / 2 / height} "
+                                 f"{(xmax - xmin) / width} {(ymax - ymin) / height}"
+                                 for class_id, xmin, ymin, xmax, ymax in objects))
+        with open(root / f"{split}_xmls" / f"{name}.xml", 'w') as file:
+            file.write(voc_xml(f"{name}.jpg", width, height, objects))
+    return root
+
+
+def summarize(durations, items_per_iteration=1):
+    """
+    :param durations: 每次迭代的耗时（秒）
+    :param items_per_iteration: 每次迭代处理的条目数（图像数等），用于计算吞吐
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+    return {
+        'iterations': len(durations),
+        'items_per_iteration': items_per_iteration,
+        'mean_ms': float(durations.mean() * 1000),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'throughput': float(items_per_iteration * len(durations) / durations.sum()),
+    }
+
+
+def timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def peak_rss_mb():
+    # Linux下ru_maxrss的单位是KB；子进程（进程池）取其中最大的一个
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+
+def run_case(case, workdir, repeat, batch_size, workers):
+    """
+    在独立进程中运行一个基准，使峰值内存互不影响。
+    """
+    from onnxTest import ImagePredictor
+
+    workdir = Path(workdir)
+    dataset = workdir / 'dataset'
+    image_paths = sorted(str(p) for p in (dataset / 'images' / 'train').glob('*.jpg'))
+    sink = io.StringIO()
+
+    if case in ('preprocess', 'session', 'postprocess', 'directory', 'pipelined'):
+        predictor = ImagePredictor(str(workdir / 'model.onnx'))
+        images = [predictor.load_image(p) for p in image_paths[:batch_size]]
+        batch = predictor.batch_buffer(batch_size)
+        infos = [predictor.preprocess_image(image, out=batch[i])[1] for i, image in enumerate(images)]
+        outputs = predictor.predict(batch).copy()
+
+    if case == 'preprocess':
+        images = iter(images * (repeat + 1))
+        result = summarize(timed(lambda: predictor.preprocess_image(next(images), out=batch[0]),
+                                 repeat * batch_size))
+    elif case == 'session':
+        result = summarize(timed(lambda: predictor.predict(batch), repeat), batch_size)
+    elif case == 'postprocess':
+        result = summarize(timed(lambda: predictor.postprocess(outputs, infos), repeat), batch_size)
+    elif case == 'directory':
+        result = summarize(timed(lambda: predictor.predict_batch(image_paths, batch_size), repeat), len(image_paths))
+    elif case == 'pipelined':
+        result = summarize(timed(lambda: predictor.predict_pipelined(image_paths, batch_size=batch_size), repeat),
+                           len(image_paths))
+    elif case == 'augment':
+        from createAugmentedDataset import augmentation_list, create_augmented_dataset
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            result = summarize(timed(lambda: create_augmented_dataset(
+                dataset, workdir / 'augmented', augmentation_list, workers=workers, seed=0), repeat, warmup=0),
+                len(image_paths) * len(augmentation_list))
+    elif case == 'xml_convert':
+        from data_preprocess import batch_convert_xmls
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            result = summarize(timed(lambda: batch_convert_xmls(
+                str(dataset / 'train_xmls'), str(dataset / 'images' / 'train'), str(workdir / 'converted'),
+                workers=workers, force=True), repeat), len(image_paths))
+    elif case == 'summary':
+        from createDataSet import print_dataset_summary
+        from datasetIndex import INDEX_CACHE_NAME
+        cache_path = dataset / INDEX_CACHE_NAME
+
+        def summary_without_cache():
+            if cache_path.exists():
+                cache_path.unlink()
+            print_dataset_summary(dataset)
+
+        with contextlib.redirect_stdout(sink):
+            result = summarize(timed(summary_without_cache, repeat))
+            result['cached'] = summarize(timed(lambda: print_dataset_summary(dataset), repeat))
+    else:
+        raise ValueError(f"未知的基准: {case}")
+
+    result['peak_rss_mb'], result['children_peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_benchmarks(workdir: Path, cases, num_images=64, repeat=5, batch_size=8, workers=None, seed=0):
+    """
+    准备合成数据与随机模型后逐个运行基准，每个基准使用一个新的spawn进程。
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    if not (workdir / 'model.onnx').exists():
+        build_model(workdir / 'model.onnx', seed=seed)
+    if not (workdir / 'dataset').exists():
+        build_dataset(workdir / 'dataset', num_images, seed=seed)
+
+    results = {}
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results[case] = executor.submit(run_case, case, str(workdir), repeat, batch_size, workers).result()
+        print(format_result(case, results[case]))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'images': num_images,
+            'repeat': repeat,
+            'batch_size': batch_size,
+            'workers': workers,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def format_result(case, result):
+    return (f"{case:>12}: p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+            f"p99 {result['p99_ms']:9.2f} ms  吞吐 {result['throughput']:9.1f}/s  "
+            f"峰值内存 {result['peak_rss_mb']:.0f} MB (子进程 {result['children_peak_rss_mb']:.0f} MB)")
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    与基准结果比较：p50/p95延迟上升或吞吐下降超过tolerance（相对值）的条目视为退化。
+    :return: 退化条目列表，为空表示没有退化
+    """
+    regressions = []
+    for case, result in current['results'].items():
+        reference = baseline['results'].get(case)
+        if reference is None:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if result[key] > reference[key] * (1 + tolerance):
+                regressions.append(f"{case} {key} {result[key]:.2f} 比基准 {reference[key]:.2f} "
+                                   f"上升 {result[key] / reference[key] - 1:.1%}")
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f"{case} throughput {result['throughput']:.1f} 比基准 {reference['throughput']:.1f} "
+                               f"下降 {1 - result['throughput'] / reference['throughput']:.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='推理与数据集构建热点路径的基准测试，使用合成数据与随机权重模型')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--workdir', default='benchmark_data', help='合成数据与模型的目录，已存在时直接复用')
+    parser.add_argument('--images', type=int, default=64, help='合成图像数')
+    parser.add_argument('--repeat', type=int, default=5, help='每个基准的重复次数')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='增强与XML转换的进程数，默认等于CPU核数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='结果JSON的写入路径')
+    parser.add_argument('--baseline', default=None, help='基准结果JSON，与本次结果比较')
+    parser.add_argument('--compare', default=None, help='不运行基准，直接把这个结果JSON与--baseline比较')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='允许的相对退化')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            report = json.load(file)
+    else:
+        report = run_benchmarks(Path(args.workdir), args.cases, args.images, args.repeat, args.batch_size,
+                                args.workers, args.seed)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline_report = json.load(file)
+        regressions = compare(report, baseline_report, args.tolerance)
+        for regression in regressions:
+            print(f'退化: {regression}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
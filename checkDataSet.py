@@ -1,51 +1,230 @@
-import pathlib
+import argparse
+import multiprocessing
+import os
+from pathlib import Path
 
 import cv2
-import os
+import numpy as np
+from tqdm import tqdm
 
-from matplotlib import pyplot as plt
+from datasetShards import exists, imread, list_names, read_labels, resolve
 
-# 数据集的根目录路径
+# 数据集的根目录路径，也可以是打包后的分片
 dataset_path = 'EndDataSet'
 
 # 类别名称
 class_names = ['good', 'broke', 'lose', 'uncovered', 'circle']
 
-# 训练集图像相对路径
-train_images_path = os.path.join(dataset_path, 'images/train')
+# 标注可视化结果的输出目录
+artificialAnalysisPath = Path("artificialAnalysis")
+
+# 缩略图与拼图目录（位于输出目录下）
+THUMBNAIL_DIR = '.thumbnails'
+CONTACT_SHEET_DIR = 'contact_sheets'
+# 记录本工具写到输出目录中的结果文件名，增量运行时只清理其中的文件
+MANIFEST_FILE = '.rendered.txt'
+
+
+def source_mtime(path):
+    """
+    源文件的修改时间；分片中的文件取分片文件的修改时间，文件不存在时为0。
+    """
+    resolved = resolve(path)
+    if resolved is not None:
+        return max(os.stat(shard.path).st_mtime_ns for shard in resolved[0].shards)
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def is_fresh(output_paths, source_paths):
+    """
+    所有输出都存在且比所有源文件新时不需要重新绘制。
+    """
+    try:
+        oldest_output = min(os.stat(path).st_mtime_ns for path in output_paths)
+    except FileNotFoundError:
+        return False
+    return oldest_output > max(source_mtime(path) for path in source_paths)
 
-# 获取训练集图像文件列表
-image_files = [f for f in os.listdir(train_images_path) if f.endswith(('.jpg', '.png', '.jpeg'))]
 
-# 新建目录
-artificialAnalysisPath = pathlib.Path("artificialAnalysis")
-if artificialAnalysisPath.exists():
-    os.rmdir(artificialAnalysisPath)
-os.mkdir(artificialAnalysisPath)
+def rendered_names(output_dir: Path):
+    """
+    上次运行写出的结果文件名。没有清单（旧版本的输出）时，只认定输出目录与缩略图目录中同名存在的文件是本工具写的。
+    """
+    try:
+        return set((output_dir / MANIFEST_FILE).read_text(encoding='utf-8').splitlines())
+    except FileNotFoundError:
+        pass
+    thumbnail_dir = output_dir / THUMBNAIL_DIR
+    return {entry.name for entry in os.scandir(output_dir)
+            if entry.is_file() and (thumbnail_dir / entry.name).is_file()}
 
-for image_file in image_files:
-    image_path = os.path.join(train_images_path, image_file)
-    label_file = image_file.rsplit('.', 1)[0] + '.txt'
-    label_path = os.path.join(dataset_path, 'labels/train', label_file)
 
-    # 读取图像
-    image = cv2.imread(image_path)
-    if image is None:
-        continue
+def draw_labels(image, labels):
+    """
+    把一张图像的YOLO标注就地画在图像上，坐标换算一次性向量化完成。
+    """
     height, width = image.shape[:2]
+    cx, cy = labels['x_center'] * width, labels['y_center'] * height
+    w, h = labels['width'] * width, labels['height'] * height
+    corners = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1).astype(np.int32)
+    for (x_min, y_min, x_max, y_max), class_id in zip(corners.tolist(), labels['class_id'].tolist()):
+        cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
+        cv2.putText(image, class_names[class_id], (x_min, y_min - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9,
+                    (0, 255, 0), 2)
+    return image
+
+
+def make_thumbnail(image, size):
+    """
+    等比例缩放并居中放入size=(宽, 高)的黑底格子中。
+    """
+    cell_width, cell_height = size
+    height, width = image.shape[:2]
+    ratio = min(cell_width / width, cell_height / height)
+    new_width, new_height = max(1, int(width * ratio)), max(1, int(height * ratio))
+    thumbnail = np.zeros((cell_height, cell_width, 3), dtype=np.uint8)
+    x, y = (cell_width - new_width) // 2, (cell_height - new_height) // 2
+    thumbnail[y:y + new_height, x:x + new_width] = cv2.resize(image, (new_width, new_height),
+                                                             interpolation=cv2.INTER_AREA)
+    return thumbnail
+
+
+def _render_worker(task):
+    """
+    绘制一张图像的标注，保存原尺寸结果与缩略图；输出比图像和标注都新时跳过绘制。
+    :return: (图像文件名, 出现的类别id列表, 是否重新绘制, 错误信息)
+    """
+    image_path, label_path, output_path, thumbnail_path, thumbnail_size, force = task
+    try:
+        labels = read_labels(label_path) if exists(label_path) else None
+        class_ids = sorted(set(labels['class_id'].tolist())) if labels is not None else []
+        if not force and is_fresh([output_path, thumbnail_path], [image_path, label_path]):
+            return output_path.name, class_ids, False, None
+
+        image = imread(image_path)
+        if image is None:
+            return output_path.name, class_ids, False, f"无法读取图像: {image_path}"
+        if labels is not None:
+            draw_labels(image, labels)
+        cv2.imwrite(str(output_path), image)
+        cv2.imwrite(str(thumbnail_path), make_thumbnail(image, thumbnail_size))
+        return output_path.name, class_ids, True, None
+    except Exception as e:
+        return output_path.name, [], False, repr(e)
+
+
+def write_contact_sheets(output_dir: Path, members, thumbnail_size, grid=8):
+    """
+    每个类别把包含该类别的图像缩略图按grid x grid拼成若干页，没有标注的图像单独成组。
+    :param members: 组名 -> 图像文件名列表
+    :return: 写出的拼图数
+    """
+    sheet_dir = output_dir / CONTACT_SHEET_DIR
+    sheet_dir.mkdir(exist_ok=True)
+    for stale in sheet_dir.glob('*.jpg'):
+        stale.unlink()
+    cell_width, cell_height = thumbnail_size
+    per_sheet = grid * grid
+    count = 0
+    for group, image_files in members.items():
+        for page, start in enumerate(range(0, len(image_files), per_sheet)):
+            sheet = np.zeros((grid * cell_height, grid * cell_width, 3), dtype=np.uint8)
+            for slot, image_file in enumerate(image_files[start:start + per_sheet]):
+                thumbnail = cv2.imread(str(output_dir / THUMBNAIL_DIR / image_file))
+                if thumbnail is None or thumbnail.shape[:2] != (cell_height, cell_width):
+                    continue
+                row, column = divmod(slot, grid)
+                sheet[row * cell_height:(row + 1) * cell_height,
+                      column * cell_width:(column + 1) * cell_width] = thumbnail
+            cv2.imwrite(str(sheet_dir / f"{group}_{page:03d}.jpg"), sheet)
+            count += 1
+    return count
+
+
+def visualize_dataset(dataset_dir, output_dir: Path, split='train', workers=None, force=False,
+                      thumbnail_size=(160, 120), grid=8):
+    """
+    用进程池把一个划分的标注画到图像上，同时生成按类别分组的缩略图拼图。
+    输出比图像和标注都新的图像不重新绘制；之前写出、但源图像已不存在的结果会被删除，输出目录中的其他文件不受影响。
+    :param workers: 进程数，默认等于CPU核数；为1时在当前进程中串行处理
+    :param force: 为True时忽略已有输出，全部重新绘制
+    :param thumbnail_size: 拼图中每个缩略图的(宽, 高)
+    :return: (重新绘制数, 跳过数, 失败列表)
+    """
+    images_dir = os.path.join(dataset_dir, 'images', split)
+    labels_dir = os.path.join(dataset_dir, 'labels', split)
+    image_files = sorted(f for f in list_names(images_dir) if f.lower().endswith(('.jpg', '.png', '.jpeg')))
+
+    # 输出目录已存在时保留其中的结果用于增量绘制，只删除本工具之前写出、源图像已不存在的结果
+    thumbnail_dir = output_dir / THUMBNAIL_DIR
+    thumbnail_dir.mkdir(parents=True, exist_ok=True)
+    expected = set(image_files)
+    pruned = 0
+    for name in rendered_names(output_dir) - expected:
+        for directory in (output_dir, thumbnail_dir):
+            try:
+                os.remove(directory / name)
+                pruned += 1
+            except FileNotFoundError:
+                pass
+    # 先记下本次将写出的文件，中途失败时下次运行也能清理它们
+    (output_dir / MANIFEST_FILE).write_text(''.join(f"{name}\n" for name in image_files), encoding='utf-8')
+
+    tasks = [(os.path.join(images_dir, image_file),
+              os.path.join(labels_dir, f"{os.path.splitext(image_file)[0]}.txt"),
+              output_dir / image_file, thumbnail_dir / image_file, thumbnail_size, force)
+             for image_file in image_files]
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(tasks) <= 1:
+        results = map(_render_worker, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_render_worker, tasks, chunksize=max(1, len(tasks) // (workers * 16)))
+    rendered, skipped, failed = 0, 0, []
+    members = {}
+    try:
+        for image_file, class_ids, was_rendered, error in tqdm(results, total=len(tasks), desc=images_dir):
+            if error:
+                failed.append((image_file, error))
+                continue
+            rendered += was_rendered
+            skipped += not was_rendered
+            for group in [class_names[class_id] for class_id in class_ids] or ['unlabeled']:
+                members.setdefault(group, []).append(image_file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    sheet_dir = output_dir / CONTACT_SHEET_DIR
+    if rendered or pruned or not sheet_dir.exists():
+        write_contact_sheets(output_dir, {group: sorted(files) for group, files in sorted(members.items())},
+                             thumbnail_size, grid)
+    return rendered, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把数据集标注画到图像上，并生成按类别分组的缩略图拼图')
+    parser.add_argument('--dataset', default=dataset_path, help='数据集根目录，也可以是分片目录')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--output', default=str(artificialAnalysisPath), help='输出目录')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认等于CPU核数')
+    parser.add_argument('--force', action='store_true', help='忽略已有输出，全部重新绘制')
+    parser.add_argument('--grid', type=int, default=8, help='拼图每行/每列的缩略图数')
+    parser.add_argument('--thumbnail-size', type=int, nargs=2, default=(160, 120), metavar=('WIDTH', 'HEIGHT'))
+    args = parser.parse_args(argv)
+
+    rendered_count, skipped_count, failures = visualize_dataset(
+        args.dataset, Path(args.output), args.split, args.workers, args.force, tuple(args.thumbnail_size), args.grid)
+    print(f"绘制 {rendered_count} 张，跳过(已是最新) {skipped_count} 张，失败 {len(failures)} 张")
+    for image_file, error in failures:
+        print(f"  {image_file}\t{error}")
+
 
-    # 读取并绘制标注
-    if os.path.exists(label_path):
-        with open(label_path, 'r') as file:
-            for line in file:
-                # print(line + label_file)
-                class_id, x_center, y_center, w, h = [float(x) for x in line.split()]
-                x_center, y_center, w, h = x_center * width, y_center * height, w * width, h * height
-                x_min, y_min = int(x_center - w / 2), int(y_center - h / 2)
-                x_max, y_max = int(x_center + w / 2), int(y_center + h / 2)
-
-                cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
-                cv2.putText(image, class_names[int(class_id)], (x_min, y_min - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9,
-                            (0, 255, 0), 2)
-
-    cv2.imwrite(os.path.join(artificialAnalysisPath, image_file), image)
+if __name__ == '__main__':
+    main()
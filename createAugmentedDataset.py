@@ -1,8 +1,17 @@
 import albumentations as A
+import argparse
 import cv2
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+import random
 from pathlib import Path
-import shutil
-from createDataSet import initialize_dataset_structure, clear_directory, print_dataset_summary
+from tqdm import tqdm
+from createDataSet import initialize_dataset_structure, clear_directory, place_file, print_dataset_summary, shares_inode
+from datasetIndex import build_index
+from datasetShards import exists, export_file, file_digest, imread, read_labels, resolve
 
 
 def read_label_file(label_path):
@@ -11,11 +20,9 @@ def read_label_file(label_path):
     注意：已去除img_width和img_height参数，因为在读取YOLO格式标注时不需要它们。
     """
     boxes = []
-    with open(label_path, 'r') as file:
-        lines = file.readlines()
-        for line in lines:
-            class_id, x_center, y_center, width, height = map(float, line.strip().split())
-            boxes.append([x_center, y_center, width, height, class_id])
+    # 标注文件也可以位于打包后的分片中
+    for class_id, x_center, y_center, width, height in read_labels(label_path).tolist():
+        boxes.append([x_center, y_center, width, height, float(class_id)])
     return boxes
 
 
@@ -37,62 +44,208 @@ def write_label_file(augmented_label_path, augmented_boxes, augmented_class_labe
             f.write(f"{class_label} {box[0]} {box[1]} {box[2]} {box[3]}\n")
 
 
-def create_augmented_dataset(original_dir: Path, augmented_dir: Path, augmentation_list):
+def derive_seed(seed, *keys):
+    """
+    由全局种子和图像名、增强序号等派生出独立的32位种子，使结果与处理顺序和进程数无关。
+    """
+    digest = hashlib.sha256(':'.join(map(str, (seed,) + keys)).encode()).digest()
+    return int.from_bytes(digest[:4], 'little')
+
+
+def augment_one(image_path: Path, original_dir: Path, augmented_dir: Path, augmentation_list, seed=None,
+                variants=None):
+    """
+    处理一张训练图像：为每种增强策略生成增强图像与标注文件。
+    :param seed: 不为None时，每种增强前按(种子, 图像名, 增强序号)重置随机数，结果可复现
+    :param variants: 只生成这些增强序号（从1开始）的版本，None表示全部
+    """
+    image = imread(image_path)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # 转换为RGB格式
+    label_path = original_dir / 'labels' / 'train' / f"{image_path.stem}.txt"
+
+    boxes = read_label_file(label_path) if exists(label_path) else []
+    class_labels = [int(box[4]) for box in boxes]  # 提取类别ID
+    # 提取边界框，去除类别ID
+    boxes = [box[:4] for box in boxes]
+
+    # 为每种增强策略创建增强版本
+    for i, augmentation in enumerate(augmentation_list, start=1):
+        if variants is not None and i not in variants:
+            continue
+        if seed is not None:
+            # Albumentations使用random与np.random的全局状态
+            augmentation_seed = derive_seed(seed, image_path.name, i)
+            random.seed(augmentation_seed)
+            np.random.seed(augmentation_seed)
+        augmented_image, augmented_boxes, augmented_class_labels = (
+            augment_image_and_labels(image, boxes, class_labels, augmentation))
+        augmented_image = cv2.cvtColor(augmented_image, cv2.COLOR_RGB2BGR)  # 转换回BGR格式以保存
+        augmented_image_name = f"{image_path.stem}_augmented_{i}{image_path.suffix}"
+        augmented_image_path = augmented_dir / 'images' / 'train' / augmented_image_name
+        cv2.imwrite(str(augmented_image_path), augmented_image)
+
+        # 为增强版本创建对应的标注文件
+        augmented_label_name = f"{label_path.stem}_augmented_{i}.txt"
+        augmented_label_path = augmented_dir / 'labels' / 'train' / augmented_label_name
+        # 写入新的标注文件
+        write_label_file(augmented_label_path, augmented_boxes, augmented_class_labels)
+    return image_path
+
+
+# 工作进程中的增强参数，由进程池初始化函数设置一次，避免每个任务重复传输
+_worker_args = None
+
+
+def _init_worker(original_dir, augmented_dir, augmentation_list, seed):
+    global _worker_args
+    _worker_args = (original_dir, augmented_dir, augmentation_list, seed)
+    # 并行由进程池负责，OpenCV内部不再开线程，避免线程数超过核数
+    cv2.setNumThreads(1)
+
+
+def _augment_worker(task):
+    image_path, variants = task
+    original_dir, augmented_dir, augmentation_list, seed = _worker_args
+    return augment_one(image_path, original_dir, augmented_dir, augmentation_list, seed, variants)
+
+
+MANIFEST_NAME = '.augment_manifest.json'
+
+
+def pipeline_fingerprint(augmentation):
+    """
+    增强策略配置的指纹：A.Compose序列化后的摘要，参数有任何改动都会变化。
+    """
+    config = json.dumps(A.to_dict(augmentation), sort_keys=True, default=str)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def source_hash(path: Path, root: Path, cache: dict):
+    """
+    源文件内容的摘要。大小与修改时间和上次记录一致时直接使用缓存，避免重复读取未变化的文件。
+    分片中的文件直接使用打包时记录的摘要（同样是blake2b），与目录形式的源数据集摘要一致。
+    """
+    if resolve(path) is not None:
+        return file_digest(path) if exists(path) else None
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    key = path.relative_to(root).as_posix()
+    cached = cache.get(key)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+    cache[key] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def load_manifest(augmented_dir: Path):
+    manifest_path = augmented_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    return {'sources': {}, 'outputs': {}}
+
+
+def save_manifest(augmented_dir: Path, manifest):
+    # 先写临时文件再替换，中途中断也不会留下损坏的清单
+    temp_path = augmented_dir / f'{MANIFEST_NAME}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, augmented_dir / MANIFEST_NAME)
+
+
+def plan_outputs(original_dir: Path, augmentation_list, seed, source_cache):
+    """
+    计算副本数据集应有的全部输出文件及其输入摘要。
+    :return: 输出相对路径 -> (输入摘要, 源文件路径, 增强序号)；增强序号为None表示直接链接源文件
+    """
+    fingerprints = [pipeline_fingerprint(augmentation) for augmentation in augmentation_list]
+    index = build_index(original_dir)
+    plan = {}
+    for split in ['train', 'val', 'test']:
+        for image_name in index.images(split):
+            image_path = original_dir / 'images' / split / image_name
+            label_path = original_dir / 'labels' / split / f"{image_path.stem}.txt"
+            image_hash = source_hash(image_path, original_dir, source_cache)
+            label_hash = (source_hash(label_path, original_dir, source_cache)
+                          if index.has_label(split, image_name) else None)
+            plan[f'images/{split}/{image_path.name}'] = (image_hash, image_path, None)
+            if label_hash is not None:
+                plan[f'labels/{split}/{label_path.name}'] = (label_hash, label_path, None)
+            if split != 'train':
+                continue
+
+            for i, fingerprint in enumerate(fingerprints, start=1):
+                key = hashlib.sha256(f'{image_hash}:{label_hash}:{fingerprint}:{seed}'.encode()).hexdigest()
+                plan[f'images/train/{image_path.stem}_augmented_{i}{image_path.suffix}'] = (key, image_path, i)
+                plan[f'labels/train/{image_path.stem}_augmented_{i}.txt'] = (key, image_path, i)
+    return plan
+
+
+def create_augmented_dataset(original_dir: Path, augmented_dir: Path, augmentation_list, workers=None, seed=None,
+                             incremental=False):
     """
     对数据集中的Train部分进行增强并创建副本数据集，包含原始数据和使用不同增强策略的增强数据。
+    原始图像（含val、test）以硬链接放入副本，无法链接时复制；原始标注总是复制，不与源数据集共享。
+    original_dir也可以是datasetShards.py打包的分片，此时原始文件从分片中写出。
+    :param workers: 增强使用的进程数，默认等于CPU核数；为1时在当前进程中串行处理
+    :param seed: 随机种子；同一种子下串行与并行的输出完全相同
+    :param incremental: 增量构建。依据副本目录中的清单，只重新生成源图像、标注或增强配置变化了的输出，
+                        并删除不再需要的文件；为False时清空副本目录后全部重建
     """
-    clear_directory(augmented_dir)
+    if incremental:
+        manifest = load_manifest(augmented_dir)
+    else:
+        clear_directory(augmented_dir)
+        manifest = {'sources': {}, 'outputs': {}}
     initialize_dataset_structure(augmented_dir)
 
-    for image_path in original_dir.glob('images/train/*.*'):
-        image = cv2.imread(str(image_path))
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # 转换为RGB格式
-        label_path = original_dir / 'labels' / 'train' / f"{image_path.stem}.txt"
-
-        boxes = read_label_file(label_path)
-        class_labels = [int(box[4]) for box in boxes]  # 提取类别ID
-        # 提取边界框，去除类别ID
-        boxes = [box[:4] for box in boxes]
-
-        # 复制原始图像及其标注到副本数据集
-        result_path = shutil.copy(image_path, augmented_dir / 'images' / 'train' / image_path.name)
-        print(f'{image_path} --> {result_path}')
-        label_path = original_dir / 'labels' / 'train' / f"{image_path.stem}.txt"
-        if label_path.exists():
-            result_path = shutil.copy(label_path, augmented_dir / 'labels' / 'train' / label_path.name)
-            print(f'{label_path} --> {result_path}')
-
-        # 为每种增强策略创建增强版本
-        for i, augmentation in enumerate(augmentation_list, start=1):
-            augmented_image, augmented_boxes, augmented_class_labels = (
-                augment_image_and_labels(image, boxes, class_labels, augmentation))
-            augmented_image = cv2.cvtColor(augmented_image, cv2.COLOR_RGB2BGR)  # 转换回BGR格式以保存
-            augmented_image_name = f"{image_path.stem}_augmented_{i}{image_path.suffix}"
-            augmented_image_path = augmented_dir / 'images' / 'train' / augmented_image_name
-            cv2.imwrite(str(augmented_image_path), augmented_image)
-
-            # 为增强版本创建对应的标注文件
-            augmented_label_name = f"{label_path.stem}_augmented_{i}.txt"
-            augmented_label_path = augmented_dir / 'labels' / 'train' / augmented_label_name
-            # 写入新的标注文件
-            write_label_file(augmented_label_path, augmented_boxes, augmented_class_labels)
-
-    # 将val和test的数据也复制到新的数据集
-    for image_path in original_dir.glob('images/val/*.*'):
-        result_path = shutil.copy(image_path, augmented_dir / 'images' / 'val' / image_path.name)
-        print(f'{image_path} --> {result_path}')
-        label_path = original_dir / 'labels' / 'val' / f"{image_path.stem}.txt"
-        if label_path.exists():
-            result_path = shutil.copy(label_path, augmented_dir / 'labels' / 'val' / label_path.name)
-            print(f'{label_path} --> {result_path}')
-
-    for image_path in original_dir.glob('images/test/*.*'):
-        result_path = shutil.copy(image_path, augmented_dir / 'images' / 'test' / image_path.name)
-        print(f'{image_path} --> {result_path}')
-        label_path = original_dir / 'labels' / 'test' / f"{image_path.stem}.txt"
-        if label_path.exists():
-            result_path = shutil.copy(label_path, augmented_dir / 'labels' / 'test' / label_path.name)
-            print(f'{label_path} --> {result_path}')
+    plan = plan_outputs(original_dir, augmentation_list, seed, manifest['sources'])
+    previous = manifest['outputs']
+
+    # 删除副本中不属于本次计划的文件
+    for subdir in ['images/train', 'images/val', 'images/test', 'labels/train', 'labels/val', 'labels/test']:
+        for entry in os.scandir(augmented_dir / subdir):
+            rel_path = f'{subdir}/{entry.name}'
+            if rel_path not in plan:
+                os.remove(entry.path)
+                previous.pop(rel_path, None)
+
+    # 找出摘要变化或文件缺失的输出
+    stale_variants = {}
+    for rel_path, (key, source_path, variant) in plan.items():
+        output_path = augmented_dir / rel_path
+        if previous.get(rel_path) == key and output_path.exists() and not (
+                variant is None and rel_path.startswith('labels') and shares_inode(source_path, output_path)):
+            continue
+        if variant is None:
+            export_file(source_path, output_path, copy=place_file)
+        else:
+            stale_variants.setdefault(source_path, set()).add(variant)
+
+    tasks = sorted(stale_variants.items())
+    workers = workers or os.cpu_count()
+    with tqdm(total=len(tasks), desc='augment', unit='img') as progress:
+        if workers == 1 or len(tasks) <= 1:
+            for image_path, variants in tasks:
+                augment_one(image_path, original_dir, augmented_dir, augmentation_list, seed, variants)
+                progress.update()
+        else:
+            # 每个工作进程一次领取一段连续的图像
+            shard_size = max(1, len(tasks) // (workers * 4))
+            with multiprocessing.Pool(workers, initializer=_init_worker,
+                                      initargs=(original_dir, augmented_dir, augmentation_list, seed)) as pool:
+                for _ in pool.imap_unordered(_augment_worker, tasks, chunksize=shard_size):
+                    progress.update()
+
+    # 源图像被删除后不再保留其摘要缓存
+    source_keys = {path.relative_to(original_dir).as_posix() for _, path, _ in plan.values()}
+    manifest['sources'] = {key: value for key, value in manifest['sources'].items() if key in source_keys}
+    manifest['outputs'] = {rel_path: key for rel_path, (key, _, _) in plan.items()}
+    manifest['seed'] = seed
+    save_manifest(augmented_dir, manifest)
 
 
 # 定义增强策略列表
@@ -117,16 +270,29 @@ augmentation_list = [
     ], bbox_params=A.BboxParams(format="yolo", label_fields=["class_labels"])),
 ]
 
-if __name__ == '__main__':
-    # 示例使用路径
-    original_dataset_dir = Path("ReplicaSet")
-    augmented_dataset_dir = Path("DataSet")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='对副本数据集的训练集做离线增强，生成增强后的数据集')
+    parser.add_argument('--original', default='ReplicaSet', help='副本数据集根目录，也可以是分片目录')
+    parser.add_argument('--output', default='DataSet', help='增强后的数据集根目录')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认等于CPU核数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full', action='store_true', help='清空输出目录后全部重建，默认增量构建')
+    args = parser.parse_args(argv)
+
+    original_dataset_dir = Path(args.original)
+    augmented_dataset_dir = Path(args.output)
 
     # 创建增强后的数据集
-    create_augmented_dataset(original_dataset_dir, augmented_dataset_dir, augmentation_list)
+    create_augmented_dataset(original_dataset_dir, augmented_dataset_dir, augmentation_list, workers=args.workers,
+                             seed=args.seed, incremental=not args.full)
 
     # 打印数据集详细信息
     print("Replica Dataset Summary:")
     print_dataset_summary(original_dataset_dir)
     print("\nAugmented Dataset Summary:")
     print_dataset_summary(augmented_dataset_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,23 @@
 from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
 import shutil
 import random
 import re
 
+from datasetIndex import build_index
+from datasetShards import export_file, file_digest, read_labels, resolve
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# linux/fs.h中的FICLONE
+FICLONE = 0x40049409
+
 
 def initialize_dataset_structure(dataset_dir: Path):
     """
@@ -27,44 +42,216 @@ def clear_directory(directory: Path):
                 item.unlink()
 
 
-def create_replica_dataset(original_dir: Path, replica_dir: Path):
+def reflink(src: Path, dst: Path):
+    """
+    写时复制克隆（Linux FICLONE，btrfs/xfs等支持），不支持时抛出OSError。
+    """
+    if fcntl is None:
+        raise OSError('当前平台不支持reflink')
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            dst.unlink()
+            raise
+
+
+def link_or_copy(src: Path, dst: Path, hardlink=True):
+    """
+    用硬链接把文件放到目标位置，无法链接时依次尝试reflink与复制。目标已存在时先删除。
+    :param hardlink: 为False时不使用硬链接，只尝试reflink与复制，目标与源文件不共享inode
+    """
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    try:
+        reflink(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def place_file(src: Path, dst: Path):
+    """
+    把源数据集的文件放入派生数据集：图像以硬链接共享；标注文件会被data_preprocess.py等工具重写，
+    为避免重写一处时其他数据集跟着改变，只做reflink或复制。
+    """
+    link_or_copy(src, dst, hardlink=dst.parent.parent.name != 'labels')
+
+
+def shares_inode(src, dst):
+    """
+    dst是否与src是同一个文件（硬链接），分片中的源文件或文件不存在时为False。
+    """
+    try:
+        return os.path.samefile(src, dst)
+    except (OSError, ValueError):
+        return False
+
+
+SPLIT_MANIFEST_NAME = '.split_manifest.json'
+
+
+def file_stamp(path: Path):
+    """
+    判断源文件是否变化的标记：普通文件为(大小, 修改时间)，分片中的文件为打包时记录的摘要。
+    """
+    if resolve(path) is not None:
+        return file_digest(path)
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def class_signature(label_path: Path):
+    """
+    图像的类别多重集，如两个broke加一个lose为'1,1,2'；没有标注时为空字符串。
+    """
+    return ','.join(map(str, sorted(read_labels(label_path)['class_id'].tolist())))
+
+
+def stratified_split(signatures, ratios, seed=None):
     """
-    创建副本数据集，包括从原始数据集的训练集中随机抽取部分数据作为验证集和测试集
+    按每张图像的类别多重集分层，在内存中计算划分。
+    每层按比例取整分配名额，剩余名额按小数部分从大到小补给各层，使全局各划分的数量与比例一致。
+    :param signatures: 图像名 -> 类别多重集
+    :param ratios: 划分名 -> 比例，如 {'val': 0.3, 'test': 0.0}，其余图像归入train
+    :return: 图像名 -> 划分名
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for name in sorted(signatures):
+        strata.setdefault(signatures[name], []).append(name)
+
+    splits = [split for split, ratio in ratios.items() if ratio > 0]
+    allocation = {}
+    remainders = []
+    for key, names in sorted(strata.items()):
+        rng.shuffle(names)
+        for split in splits:
+            exact = len(names) * ratios[split]
+            allocation[(key, split)] = int(exact)
+            remainders.append((exact - int(exact), rng.random(), key, split))
+    remainders.sort(reverse=True)
+
+    for split in splits:
+        deficit = round(len(signatures) * ratios[split]) - sum(allocation[(key, split)] for key in strata)
+        for _, _, key, candidate_split in remainders:
+            if deficit <= 0:
+                break
+            if candidate_split != split:
+                continue
+            # 一层的名额总数不能超过该层图像数
+            if sum(allocation[(key, s)] for s in splits) < len(strata[key]):
+                allocation[(key, split)] += 1
+                deficit -= 1
+
+    assignment = {}
+    for key, names in strata.items():
+        start = 0
+        for split in splits:
+            for name in names[start:start + allocation[(key, split)]]:
+                assignment[name] = split
+            start += allocation[(key, split)]
+        for name in names[start:]:
+            assignment[name] = 'train'
+    return assignment
+
+
+def load_split_manifest(replica_dir: Path):
+    """
+    读取副本数据集的划分清单，其中assignment为 图像名 -> 划分名，可直接复用到其他构建。
+    """
+    manifest_path = replica_dir / SPLIT_MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    return {}
+
+
+def save_split_manifest(replica_dir: Path, manifest):
+    temp_path = replica_dir / f'{SPLIT_MANIFEST_NAME}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, replica_dir / SPLIT_MANIFEST_NAME)
+
+
+def materialize_split(original_dir: Path, replica_dir: Path, outputs, previous):
+    """
+    一次遍历把划分结果落到副本目录：删除多余或已变化的文件，只链接缺失或变化的文件。
+    :param outputs: 输出相对路径 -> (源文件路径, 源文件标记)
+    :param previous: 上次构建的 输出相对路径 -> 源文件标记
     """
-    clear_directory(replica_dir)
     initialize_dataset_structure(replica_dir)
+    present = set()
+    for subdir in ['images/train', 'images/val', 'images/test', 'labels/train', 'labels/val', 'labels/test']:
+        for entry in os.scandir(replica_dir / subdir):
+            rel_path = f'{subdir}/{entry.name}'
+            # 旧版本构建中以硬链接共享的标注文件需要重新放置为独立的副本
+            if (rel_path in outputs and previous.get(rel_path) == outputs[rel_path][1]
+                    and not (subdir.startswith('labels') and shares_inode(outputs[rel_path][0], entry.path))):
+                present.add(rel_path)
+            else:
+                os.remove(entry.path)
+    for rel_path, (source_path, _) in outputs.items():
+        if rel_path not in present:
+            export_file(source_path, replica_dir / rel_path, copy=place_file)
 
-    # 遍历原始数据集中的图像文件并复制
-    for image_path in original_dir.glob('images/train/*.*'):
-        category = re.match(r'(well[0-4])_', image_path.name)
-        if category:
-            # 直接复制图像和标注文件到副本的训练集
-            shutil.copy(image_path, replica_dir / 'images' / 'train' / image_path.name)
-            label_path = original_dir / 'labels' / 'train' / f"{image_path.stem}.txt"
-            if label_path.exists():
-                shutil.copy(label_path, replica_dir / 'labels' / 'train' / label_path.name)
-
-    # 对每个类别，从副本训练集中随机抽取20%的图像作为验证集
-    for category in range(5):
-        category_files = list(replica_dir.glob(f'images/train/well{category}_*.*'))
-        sampled_files = random.sample(category_files, k=max(1, round(len(category_files) * 0.30)))
-
-        for file in sampled_files:
-            shutil.move(file, replica_dir / 'images' / 'val' / file.name)
-            label_file = replica_dir / 'labels' / 'train' / f"{file.stem}.txt"
-            if label_file.exists():
-                shutil.move(label_file, replica_dir / 'labels' / 'val' / label_file.name)
-
-    # 再抽取20%作为测试集
-    # for category in range(5):
-    #     category_files = list(replica_dir.glob(f'images/train/well{category}_*.*'))
-    #     sampled_files = random.sample(category_files, k=max(1, len(category_files) // 20))
-    #
-    #     for file in sampled_files:
-    #         shutil.move(file, replica_dir / 'images' / 'test' / file.name)
-    #         label_file = replica_dir / 'labels' / 'train' / f"{file.stem}.txt"
-    #         if label_file.exists():
-    #             shutil.move(label_file, replica_dir / 'labels' / 'test' / label_file.name)
+
+def create_replica_dataset(original_dir: Path, replica_dir: Path, val_ratio=0.3, test_ratio=0.0, seed=None):
+    """
+    创建副本数据集：按标注内容分层，把原始数据集训练集中的图像划分为训练集、验证集和测试集。
+    划分先在内存中计算，再把图像以硬链接（或reflink、复制）、标注以复制一次落盘，并写入划分清单。
+    源文件、比例与种子都没有变化时直接返回，不读写任何副本文件。
+    :param seed: 随机种子，相同种子与相同源数据得到相同划分
+    """
+    ratios = {'val': val_ratio, 'test': test_ratio}
+    source = build_index(original_dir)
+    image_names = [name for name in source.images('train') if re.match(r'(well[0-4])_', name)]
+
+    stamps = {}
+    for image_name in image_names:
+        label_name = f"{Path(image_name).stem}.txt"
+        has_label = source.has_label('train', image_name)
+        stamps[image_name] = (file_stamp(original_dir / 'images' / 'train' / image_name),
+                              file_stamp(original_dir / 'labels' / 'train' / label_name) if has_label else None)
+    # 'labels-copied'区分标注以硬链接放置的旧版本构建，使其重新放置一次标注
+    fingerprint = hashlib.sha256(json.dumps([str(original_dir), ratios, seed, sorted(stamps.items()), 'labels-copied'],
+                                            default=list).encode()).hexdigest()
+
+    manifest = load_split_manifest(replica_dir)
+    if manifest.get('fingerprint') == fingerprint:
+        return manifest['assignment']
+
+    # 按实际标注内容分层，而不是文件名前缀
+    signatures = {}
+    for image_name in image_names:
+        label_path = original_dir / 'labels' / 'train' / f"{Path(image_name).stem}.txt"
+        signatures[image_name] = class_signature(label_path) if stamps[image_name][1] is not None else ''
+    assignment = stratified_split(signatures, ratios, seed)
+
+    outputs = {}
+    for image_name, split in assignment.items():
+        image_stamp, label_stamp = stamps[image_name]
+        outputs[f'images/{split}/{image_name}'] = (original_dir / 'images' / 'train' / image_name, image_stamp)
+        if label_stamp is not None:
+            label_name = f"{Path(image_name).stem}.txt"
+            outputs[f'labels/{split}/{label_name}'] = (original_dir / 'labels' / 'train' / label_name, label_stamp)
+    materialize_split(original_dir, replica_dir, outputs, manifest.get('outputs', {}))
+
+    save_split_manifest(replica_dir, {
+        'fingerprint': fingerprint,
+        'source': str(original_dir),
+        'seed': seed,
+        'ratios': ratios,
+        'assignment': assignment,
+        'outputs': {rel_path: stamp for rel_path, (_, stamp) in outputs.items()},
+    })
+    return assignment
 
 
 def print_dataset_summary(dataset_dir: Path):
@@ -77,14 +264,12 @@ def print_dataset_summary(dataset_dir: Path):
         'val_images': 0, 'val_labels': 0,
         'test_images': 0, 'test_labels': 0} for category in categories}
 
-    # 收集计数信息
-    for category in categories:
-        counts[category]['train_images'] = len(list((dataset_dir / 'images/train').glob(f'{category}_*.*')))
-        counts[category]['train_labels'] = len(list((dataset_dir / 'labels/train').glob(f'{category}_*.txt')))
-        counts[category]['val_images'] = len(list((dataset_dir / 'images/val').glob(f'{category}_*.*')))
-        counts[category]['val_labels'] = len(list((dataset_dir / 'labels/val').glob(f'{category}_*.txt')))
-        counts[category]['test_images'] = len(list((dataset_dir / 'images/test').glob(f'{category}_*.*')))
-        counts[category]['test_labels'] = len(list((dataset_dir / 'labels/test').glob(f'{category}_*.txt')))
+    # 收集计数信息：由单次扫描建立的索引查询，数据集目录也可以是打包后的分片
+    index = build_index(dataset_dir)
+    for split in ['train', 'val', 'test']:
+        for category in categories:
+            counts[category][f'{split}_images'] = index.count('images', split, category)
+            counts[category][f'{split}_labels'] = index.count('labels', split, category)
 
     # 打印汇总信息
     print(f"\nDataset Summary for {dataset_dir}:")
@@ -97,16 +282,27 @@ def print_dataset_summary(dataset_dir: Path):
               f"{cat_counts['train_labels']} | {cat_counts['val_labels']} | {cat_counts['test_labels']}")
 
 
-if __name__ == '__main__':
-    # 示例使用
-    original_dataset_dir = Path("EndDataSet")
-    replica_dataset_dir = Path("ReplicaSet")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='按标注内容分层划分原始数据集，生成副本数据集')
+    parser.add_argument('--original', default='EndDataSet', help='原始数据集根目录，也可以是分片目录')
+    parser.add_argument('--replica', default='ReplicaSet', help='副本数据集根目录')
+    parser.add_argument('--val-ratio', type=float, default=0.3)
+    parser.add_argument('--test-ratio', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，固定种子使划分可复现')
+    args = parser.parse_args(argv)
+
+    original_dataset_dir = Path(args.original)
+    replica_dataset_dir = Path(args.replica)
 
-    # 创建副本数据集
-    create_replica_dataset(original_dataset_dir, replica_dataset_dir)
+    # 创建副本数据集，固定种子使划分可复现，未变化时重复运行不触碰磁盘
+    create_replica_dataset(original_dataset_dir, replica_dataset_dir, args.val_ratio, args.test_ratio, args.seed)
 
     # 打印数据集详细信息
     print("Orininal Dataset Summary:")
     print_dataset_summary(original_dataset_dir)
     print("\nReplica Dataset Summary:")
     print_dataset_summary(replica_dataset_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,79 @@
+import argparse
+import multiprocessing
 import os
 import xml.etree.ElementTree as ET
+from collections import Counter
 from PIL import Image
+from tqdm import tqdm
 
 # 类别映射
 class_mapping = {'good': 0, 'broke': 1, 'lose': 2, 'uncovered': 3, 'circle': 4}
 
 
+def probe_image_size(img_path):
+    """
+    只读取图像文件头获取宽高，不解码像素。
+    """
+    with Image.open(img_path) as image:
+        return image.size
+
+
+def xml_image_size(root):
+    """
+    读取VOC XML中的<size>，缺失或为0时返回None。
+    """
+    size = root.find('size')
+    if size is None:
+        return None
+    try:
+        width, height = int(float(size.find('width').text)), int(float(size.find('height').text))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+
+def label_filename(image_filename):
+    """
+    XML中<filename>对应的YOLO标注文件名。
+    """
+    return f"{os.path.splitext(image_filename)[0]}.txt"
+
+
 def convert_xml_to_yolo(xml_file_path, img_dir, output_dir):
+    """
+    把一个VOC XML标注转换为YOLO格式的.txt。
+    未知类别与宽高不为正的退化框不写入，记录在返回值中。
+    :return: (未知类别名列表, 退化框列表[(类别名, xmin, ymin, xmax, ymax)])
+    """
     tree = ET.parse(xml_file_path)
     root = tree.getroot()
 
     # 提取文件名，用于生成相同名称的.txt文件
     filename = root.find('filename').text
     img_path = os.path.join(img_dir, filename)
-    base_filename = os.path.splitext(filename)[0]
-    txt_filename = f"{base_filename}.txt"
+    txt_filename = label_filename(filename)
 
-    # 如果图像尺寸信息在XML中不可用，使用Pillow读取图像尺寸
-    img_width, img_height = Image.open(img_path).size
+    # 优先使用XML中的图像尺寸，不可用时只读取图像文件头
+    img_width, img_height = xml_image_size(root) or probe_image_size(img_path)
 
     output_lines = []
+    unknown_classes = []
+    degenerate_boxes = []
     for obj in root.findall('object'):
         class_name = obj.find('name').text
+        if class_name not in class_mapping:
+            unknown_classes.append(class_name)
+            continue
         class_id = class_mapping[class_name]
 
         xmlbox = obj.find('bndbox')
-        xmin = int(xmlbox.find('xmin').text)
-        ymin = int(xmlbox.find('ymin').text)
-        xmax = int(xmlbox.find('xmax').text)
-        ymax = int(xmlbox.find('ymax').text)
+        xmin = int(float(xmlbox.find('xmin').text))
+        ymin = int(float(xmlbox.find('ymin').text))
+        xmax = int(float(xmlbox.find('xmax').text))
+        ymax = int(float(xmlbox.find('ymax').text))
+        if xmax <= xmin or ymax <= ymin:
+            degenerate_boxes.append((class_name, xmin, ymin, xmax, ymax))
+            continue
 
         # 转换为YOLO格式
         x_center = ((xmin + xmax) / 2) / img_width
@@ -38,21 +83,97 @@ def convert_xml_to_yolo(xml_file_path, img_dir, output_dir):
 
         output_lines.append(f"{class_id} {x_center} {y_center} {width} {height}")
 
-    # 写入标注文件
+    # 先写临时文件再替换：输出目录中的文件可能与其他数据集共享inode（硬链接），就地写入会同时改掉它们
     output_path = os.path.join(output_dir, txt_filename)
-    with open(output_path, 'w') as file:
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
         file.write('\n'.join(output_lines))
-
-
-def batch_convert_xmls(xml_dir, img_dir, output_dir):
+    os.replace(temp_path, output_path)
+    return unknown_classes, degenerate_boxes
+
+
+def is_up_to_date(xml_file_path, output_dir):
+    """
+    转换输出的.txt（按XML中的<filename>命名，与convert_xml_to_yolo一致）已存在且比XML新时认为无需重新转换。
+    """
+    try:
+        xml_mtime = os.stat(xml_file_path).st_mtime_ns
+        # 只解析到<filename>为止，不读取整个XML
+        for _, element in ET.iterparse(xml_file_path):
+            if element.tag == 'filename':
+                return os.stat(os.path.join(output_dir, label_filename(element.text))).st_mtime_ns >= xml_mtime
+    except (FileNotFoundError, ET.ParseError):
+        pass
+    # 没有<filename>或无法解析时交给转换流程，由它记录失败
+    return False
+
+
+def _convert_worker(task):
+    xml_file_path, img_dir, output_dir = task
+    try:
+        return (xml_file_path,) + convert_xml_to_yolo(xml_file_path, img_dir, output_dir) + (None,)
+    except Exception as e:
+        return xml_file_path, [], [], repr(e)
+
+
+def batch_convert_xmls(xml_dir, img_dir, output_dir, workers=None, force=False, report_path=None):
+    """
+    用进程池批量转换目录下的XML标注。
+    :param workers: 进程数，默认等于CPU核数；为1时在当前进程中串行处理
+    :param force: 为True时忽略已有的输出，全部重新转换
+    :param report_path: 转换汇总（未知类别、退化框、失败文件）的写入路径，None时只打印
+    :return: 汇总字典
+    """
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
 
-    for xml_file in os.listdir(xml_dir):
-        if xml_file.endswith('.xml'):
-            xml_file_path = os.path.join(xml_dir, xml_file)
-            convert_xml_to_yolo(xml_file_path, img_dir, output_dir)
-            print(f"Processed {xml_file}")
+    xml_files = sorted(entry.path for entry in os.scandir(xml_dir) if entry.name.endswith('.xml'))
+    tasks = [(path, img_dir, output_dir) for path in xml_files if force or not is_up_to_date(path, output_dir)]
+    summary = {'total': len(xml_files), 'skipped': len(xml_files) - len(tasks), 'converted': 0,
+               'unknown_classes': Counter(), 'degenerate_boxes': [], 'failed': []}
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(tasks) <= 1:
+        results = map(_convert_worker, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_convert_worker, tasks, chunksize=max(1, len(tasks) // (workers * 16)))
+    try:
+        for xml_file_path, unknown_classes, degenerate_boxes, error in tqdm(results, total=len(tasks), desc=xml_dir):
+            if error:
+                summary['failed'].append((xml_file_path, error))
+                continue
+            summary['converted'] += 1
+            summary['unknown_classes'].update(unknown_classes)
+            summary['degenerate_boxes'].extend((xml_file_path,) + box for box in degenerate_boxes)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    report = format_summary(xml_dir, summary)
+    print(report)
+    if report_path:
+        with open(report_path, 'w') as file:
+            file.write(report)
+    return summary
+
+
+def format_summary(xml_dir, summary):
+    lines = [f"{xml_dir}: 共 {summary['total']} 个XML，转换 {summary['converted']}，"
+             f"跳过(已是最新) {summary['skipped']}，失败 {len(summary['failed'])}"]
+    if summary['unknown_classes']:
+        lines.append('未知类别（未写入标注）:')
+        lines += [f"  {name}: {count}" for name, count in summary['unknown_classes'].most_common()]
+    if summary['degenerate_boxes']:
+        lines.append(f"退化框（宽或高不为正，未写入标注）: {len(summary['degenerate_boxes'])}")
+        lines += [f"  {path}\t{name}\t{xmin} {ymin} {xmax} {ymax}"
+                  for path, name, xmin, ymin, xmax, ymax in summary['degenerate_boxes']]
+    if summary['failed']:
+        lines.append('转换失败:')
+        lines += [f"  {path}\t{error}" for path, error in summary['failed']]
+    return '\n'.join(lines) + '\n'
 
 
 # 配置路径
@@ -70,8 +191,22 @@ label_dirs = {
     "val": "labels/val",
 }
 
-for key in ["train", "val"]:
-    xml_dir = os.path.join(base_dir, xml_dirs[key])
-    img_dir = os.path.join(base_dir, img_dirs[key])
-    output_dir = os.path.join(base_dir, label_dirs[key])
-    batch_convert_xmls(xml_dir, img_dir, output_dir)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把VOC XML标注批量转换为YOLO格式')
+    parser.add_argument('--base-dir', default=base_dir, help='数据集根目录')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认等于CPU核数')
+    parser.add_argument('--force', action='store_true', help='忽略已有输出，全部重新转换')
+    args = parser.parse_args(argv)
+
+    for key in ["train", "val"]:
+        xml_dir = os.path.join(args.base_dir, xml_dirs[key])
+        img_dir = os.path.join(args.base_dir, img_dirs[key])
+        output_dir = os.path.join(args.base_dir, label_dirs[key])
+        report_path = os.path.join(args.base_dir, f"{key}_conversion_report.txt")
+        batch_convert_xmls(xml_dir, img_dir, output_dir, workers=args.workers, force=args.force,
+                           report_path=report_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from datasetShards import IMAGE_SUFFIXES, SPLITS, list_names, open_shards
+
+INDEX_CACHE_NAME = '.dataset_index.json'
+# 缓存格式版本，条目结构变化时递增，旧缓存整体失效
+INDEX_VERSION = 2
+SUBDIRS = [f'{kind}/{split}' for kind in ('images', 'labels') for split in SPLITS]
+CATEGORY_PATTERN = re.compile(r'([^_]+)_')
+# 修改时间在这个时间窗内的目录不写入缓存：同一时间戳内的后续改动无法由修改时间区分
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def category_of(name):
+    """
+    文件名的类别前缀，如 well1_0002.jpg -> well1；没有前缀时返回None。
+    """
+    match = CATEGORY_PATTERN.match(name)
+    return match.group(1) if match else None
+
+
+def directory_entry(subdir, file_names):
+    """
+    目录的索引条目：排序后的文件名（图像目录只保留图像后缀，标注目录只保留.txt）与各类别前缀的文件数。
+    计数沿用原先print_dataset_summary的口径：标注目录统计.txt，图像目录统计所有 类别_*.* 文件，
+    因此图像目录中的非图像文件（如.xml）会计入计数，但不会出现在names中。
+    """
+    suffixes = subdir_suffixes(subdir)
+    counted = file_names if subdir.startswith('images') else [
+        name for name in file_names if os.path.splitext(name)[1].lower() in suffixes]
+    counts = {}
+    for name in counted:
+        if '.' in name:
+            category = category_of(name) or ''
+            counts[category] = counts.get(category, 0) + 1
+    names = sorted(name for name in file_names if os.path.splitext(name)[1].lower() in suffixes)
+    return {'names': names, 'counts': counts}
+
+
+def subdir_suffixes(subdir):
+    return IMAGE_SUFFIXES if subdir.startswith('images') else ('.txt',)
+
+
+def scan_directory(directory):
+    """
+    一次os.scandir列出目录下的全部文件名，目录不存在时返回空列表。
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+def directory_mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class DatasetIndex:
+    """
+    YOLO结构数据集的文件索引：每个划分的图像与标注文件名、类别前缀，以及图像与标注的对应关系。
+    汇总、划分与增强都从这里查询，不再对同一目录反复glob。
+    各类别的文件数在扫描时统计好，文件名的分组与主干名集合在第一次查询时才建立。
+    """
+
+    def __init__(self, root, directories):
+        """
+        :param directories: 'images/train'等子目录 -> {'names': 文件名列表, 'counts': 类别前缀 -> 文件数}
+        """
+        self.root = Path(root)
+        self.directories = directories
+        self._groups = {}
+        self._stems = {}
+
+    def names(self, kind, split):
+        return self.directories[f'{kind}/{split}']['names']
+
+    def groups(self, kind, split):
+        key = f'{kind}/{split}'
+        if key not in self._groups:
+            groups = {}
+            for name in self.directories[key]['names']:
+                groups.setdefault(category_of(name), []).append(name)
+            self._groups[key] = groups
+        return self._groups[key]
+
+    def stems(self, kind, split):
+        key = f'{kind}/{split}'
+        if key not in self._stems:
+            self._stems[key] = {os.path.splitext(name)[0] for name in self.directories[key]['names']}
+        return self._stems[key]
+
+    def images(self, split, category=None):
+        """
+        某个划分的图像文件名（已排序），可按类别前缀过滤。
+        """
+        if category is None:
+            return self.names('images', split)
+        return self.groups('images', split).get(category, [])
+
+    def labels(self, split, category=None):
+        if category is None:
+            return self.names('labels', split)
+        return self.groups('labels', split).get(category, [])
+
+    def count(self, kind, split, category=None):
+        entry = self.directories[f'{kind}/{split}']
+        return len(entry['names']) if category is None else entry['counts'].get(category, 0)
+
+    def has_label(self, split, image_name):
+        return os.path.splitext(image_name)[0] in self.stems('labels', split)
+
+    def has_image(self, split, label_name):
+        return os.path.splitext(label_name)[0] in self.stems('images', split)
+
+    def unlabeled_images(self, split):
+        return [name for name in self.names('images', split) if not self.has_label(split, name)]
+
+    def orphan_labels(self, split):
+        return [name for name in self.names('labels', split) if not self.has_image(split, name)]
+
+    def categories(self):
+        return sorted({category for split in SPLITS for category in self.directories[f'images/{split}']['counts']
+                       if category})
+
+
+def load_cache(root: Path):
+    try:
+        with open(root / INDEX_CACHE_NAME, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_cache(root: Path, cache):
+    # 数据集目录只读（如训练平台的输入目录）时不写缓存
+    temp_path = root / f'{INDEX_CACHE_NAME}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'w') as file:
+            json.dump(cache, file)
+        os.replace(temp_path, root / INDEX_CACHE_NAME)
+    except OSError:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def build_index(dataset_dir, use_cache=True):
+    """
+    为数据集建立索引，每个子目录只做一次os.scandir。
+    use_cache为True时把目录列表缓存在数据集根目录下，以各子目录的修改时间为键，
+    只有增删过文件的子目录才重新扫描。dataset_dir也可以是打包后的分片。
+    """
+    root = Path(dataset_dir)
+    if open_shards(root) is not None:
+        return DatasetIndex(root, {subdir: directory_entry(subdir, list_names(root / subdir)) for subdir in SUBDIRS})
+
+    cache = load_cache(root) if use_cache else {}
+    cached = cache.get('directories', {}) if cache.get('version') == INDEX_VERSION else {}
+    directories = {}
+    changed = False
+    for subdir in SUBDIRS:
+        mtime = directory_mtime(root / subdir)
+        entry = cached.get(subdir)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, **directory_entry(subdir, scan_directory(root / subdir))}
+            changed = True
+        directories[subdir] = entry
+    if use_cache and changed and root.is_dir():
+        racy = time.time_ns() - RACY_WINDOW_NS
+        save_cache(root, {'version': INDEX_VERSION, 'directories': {
+            subdir: entry if entry['mtime'] is None or entry['mtime'] < racy else {**entry, 'mtime': -1}
+            for subdir, entry in directories.items()}})
+    return DatasetIndex(root, directories)
@@ -0,0 +1,505 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 分片文件布局：
+#   [0, 8)              MAGIC
+#   [8, 16)             头部JSON长度（小端uint64）
+#   [16, HEADER_SIZE)   头部JSON：各段的偏移、条目数与dtype描述
+#   data段              所有编码后图像字节首尾相连
+#   index段             每张图像一条的结构化数组（见index_dtype）
+#   labels段            所有标注行的结构化数组（LABEL_DTYPE），每张图像占连续的label_count行
+# 各段按SECTION_ALIGN对齐，读取时整个文件只做一次内存映射，图像字节与标注数组都是映射上的视图。
+MAGIC = b'MHSHARD1'
+HEADER_SIZE = 4096
+SECTION_ALIGN = 64
+SHARD_SUFFIX = '.shard'
+SPLITS = ('train', 'val', 'test')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+LABEL_DTYPE = np.dtype([('class_id', '<i4'), ('x_center', '<f8'), ('y_center', '<f8'),
+                        ('width', '<f8'), ('height', '<f8')])
+
+
+def index_dtype(name_length, num_classes):
+    """
+    分片索引的结构化dtype：图像名、所属划分、图像字节位置、标注行位置、内容摘要与类别直方图。
+    """
+    return np.dtype([
+        ('name', f'S{name_length}'),
+        ('split', 'u1'),
+        ('has_label', 'u1'),
+        ('offset', '<u8'),
+        ('length', '<u8'),
+        ('label_start', '<u8'),
+        ('label_count', '<u4'),
+        ('image_digest', 'S32'),
+        ('label_digest', 'S32'),
+        ('class_histogram', '<u4', (num_classes,)),
+    ])
+
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def align(offset):
+    return (offset + SECTION_ALIGN - 1) // SECTION_ALIGN * SECTION_ALIGN
+
+
+def parse_label_text(text):
+    """
+    YOLO标注文本 -> LABEL_DTYPE数组。整段文本一次转换为浮点数组，不逐行逐个字段转换。
+    """
+    values = np.array(text.split(), dtype=np.float64)
+    rows = sum(1 for line in text.splitlines() if line.strip())
+    if values.size != rows * 5:
+        raise ValueError(f"YOLO标注每行应为5列: {text[:80]!r}")
+    values = values.reshape(rows, 5)
+    labels = np.zeros(rows, dtype=LABEL_DTYPE)
+    labels['class_id'] = values[:, 0]
+    for column, field in enumerate(('x_center', 'y_center', 'width', 'height'), start=1):
+        labels[field] = values[:, column]
+    return labels
+
+
+def format_label_rows(labels):
+    return ''.join(f"{class_id} {x_center!r} {y_center!r} {width!r} {height!r}\n"
+                   for class_id, x_center, y_center, width, height in labels.tolist())
+
+
+def collect_entries(dataset_dir: Path, splits=SPLITS):
+    """
+    扫描YOLO结构的数据集目录，返回按(划分, 图像名)排序的条目列表。
+    同一划分中主文件名相同的图像（如x.jpg与x.png）共用一个标注文件，按主文件名查找时无法区分，直接报错。
+    """
+    entries = []
+    for split_id, split in enumerate(SPLITS):
+        if split not in splits:
+            continue
+        image_dir = dataset_dir / 'images' / split
+        if not image_dir.is_dir():
+            continue
+        stems = {}
+        for image_path in sorted(image_dir.iterdir()):
+            if image_path.suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            if image_path.stem in stems:
+                raise ValueError(f'{split}划分中的图像主文件名重复: {stems[image_path.stem]}, {image_path.name}')
+            stems[image_path.stem] = image_path.name
+            label_path = dataset_dir / 'labels' / split / f"{image_path.stem}.txt"
+            label_text = label_path.read_bytes() if label_path.exists() else None
+            entries.append({
+                'name': image_path.name,
+                'split': split_id,
+                'image_path': image_path,
+                'size': image_path.stat().st_size,
+                'label_text': label_text,
+                'labels': parse_label_text(label_text.decode()) if label_text is not None else
+                np.zeros(0, dtype=LABEL_DTYPE),
+            })
+    return entries
+
+
+def write_shard(shard_path: Path, entries, num_classes):
+    """
+    把一组条目写成一个分片文件。先占位写头部，流式写入图像字节，最后回填索引与头部。
+    """
+    name_length = max(len(entry['name'].encode()) for entry in entries)
+    index = np.zeros(len(entries), dtype=index_dtype(name_length, num_classes))
+    labels = np.concatenate([entry['labels'] for entry in entries])
+
+    temp_path = shard_path.with_name(f"{shard_path.name}.tmp")
+    with open(temp_path, 'wb') as file:
+        data_offset = HEADER_SIZE
+        file.seek(data_offset)
+        offset = data_offset
+        label_start = 0
+        for i, entry in enumerate(entries):
+            data = entry['image_path'].read_bytes()
+            file.write(data)
+            row = index[i]
+            row['name'] = entry['name'].encode()
+            row['split'] = entry['split']
+            row['has_label'] = entry['label_text'] is not None
+            row['offset'] = offset - data_offset
+            row['length'] = len(data)
+            row['label_start'] = label_start
+            row['label_count'] = len(entry['labels'])
+            row['image_digest'] = content_digest(data).encode()
+            if entry['label_text'] is not None:
+                row['label_digest'] = content_digest(entry['label_text']).encode()
+            row['class_histogram'] = np.bincount(entry['labels']['class_id'], minlength=num_classes)[:num_classes]
+            offset += len(data)
+            label_start += len(entry['labels'])
+
+        index_offset = align(offset)
+        file.seek(index_offset)
+        file.write(index.tobytes())
+        labels_offset = align(index_offset + index.nbytes)
+        file.seek(labels_offset)
+        file.write(labels.tobytes())
+
+        header = json.dumps({
+            'version': 1,
+            'splits': list(SPLITS),
+            'num_classes': num_classes,
+            'data': {'offset': data_offset, 'length': offset - data_offset},
+            'index': {'offset': index_offset, 'count': len(index),
+                      'descr': np.lib.format.dtype_to_descr(index.dtype)},
+            'labels': {'offset': labels_offset, 'count': len(labels),
+                       'descr': np.lib.format.dtype_to_descr(LABEL_DTYPE)},
+        }).encode()
+        if len(header) > HEADER_SIZE - 16:
+            raise ValueError('分片头部超出预留空间')
+        file.seek(0)
+        file.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+    os.replace(temp_path, shard_path)
+
+
+def pack_dataset(dataset_dir: Path, output_dir: Path, shard_bytes=1 << 30, num_classes=None, splits=SPLITS):
+    """
+    把YOLO结构的数据集（images/{split}, labels/{split}）打包为若干分片文件。
+    :param shard_bytes: 单个分片中图像字节的目标上限，超过后开始新的分片
+    :param num_classes: 类别直方图的长度，默认取标注中出现的最大类别号+1
+    :return: 生成的分片路径列表
+    """
+    dataset_dir, output_dir = Path(dataset_dir), Path(output_dir)
+    entries = collect_entries(dataset_dir, splits)
+    if not entries:
+        raise FileNotFoundError(f'数据集中没有图像: {dataset_dir}')
+    if num_classes is None:
+        num_classes = max((int(entry['labels']['class_id'].max()) + 1
+                           for entry in entries if len(entry['labels'])), default=0)
+
+    groups, current, current_bytes = [], [], 0
+    for entry in entries:
+        if current and current_bytes + entry['size'] > shard_bytes:
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(entry)
+        current_bytes += entry['size']
+    groups.append(current)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for old_shard in output_dir.glob(f'*{SHARD_SUFFIX}'):
+        old_shard.unlink()
+    shard_paths = []
+    for i, group in enumerate(groups):
+        shard_path = output_dir / f"shard-{i:05d}{SHARD_SUFFIX}"
+        write_shard(shard_path, group, num_classes)
+        shard_paths.append(shard_path)
+    # 本进程中已打开的旧分片不再有效
+    invalidate(output_dir)
+    return shard_paths
+
+
+class Shard:
+    """
+    一个内存映射的分片文件。index与labels是映射上的结构化数组视图。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.buffer = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if bytes(self.buffer[:8]) != MAGIC:
+            raise ValueError(f'不是数据集分片文件: {self.path}')
+        header_length = int.from_bytes(bytes(self.buffer[8:16]), 'little')
+        self.header = json.loads(bytes(self.buffer[16:16 + header_length]))
+        self.index = self.section('index')
+        self.labels = self.section('labels')
+        data = self.header['data']
+        self.data = self.buffer[data['offset']:data['offset'] + data['length']]
+
+    def section(self, key):
+        meta = self.header[key]
+        dtype = np.lib.format.descr_to_dtype(meta['descr'])
+        start = meta['offset']
+        return self.buffer[start:start + meta['count'] * dtype.itemsize].view(dtype)
+
+
+class ShardReader:
+    """
+    读取单个分片文件或分片目录，按(划分, 图像名)提供零拷贝的图像字节与标注数组。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        shard_paths = [self.path] if self.path.is_file() else sorted(self.path.glob(f'*{SHARD_SUFFIX}'))
+        self.shards = [Shard(shard_path) for shard_path in shard_paths]
+        self.lookup = {}
+        self.stems = {}
+        self.split_names = {split: [] for split in SPLITS}
+        for shard_id, shard in enumerate(self.shards):
+            splits = shard.header['splits']
+            for row, (name, split_id) in enumerate(zip(shard.index['name'].tolist(), shard.index['split'].tolist())):
+                key = (splits[split_id], name.decode())
+                self.lookup[key] = (shard_id, row)
+                stem_key = (key[0], Path(key[1]).stem)
+                if stem_key in self.stems:
+                    raise ValueError(f'{self.path}: {key[0]}划分中的图像主文件名重复: {self.stems[stem_key]}, {key[1]}')
+                self.stems[stem_key] = key[1]
+                self.split_names[key[0]].append(key[1])
+        for names in self.split_names.values():
+            names.sort()
+
+    def names(self, split):
+        return self.split_names.get(split, [])
+
+    def __contains__(self, key):
+        return key in self.lookup
+
+    def entry(self, split, name):
+        shard_id, row = self.lookup[(split, name)]
+        shard = self.shards[shard_id]
+        return shard, shard.index[row]
+
+    def image_bytes(self, split, name):
+        """
+        编码后图像字节，是内存映射上的uint8视图。
+        """
+        shard, row = self.entry(split, name)
+        return shard.data[row['offset']:row['offset'] + row['length']]
+
+    def labels(self, split, name):
+        """
+        该图像的标注行（LABEL_DTYPE结构化数组），是内存映射上的视图。
+        """
+        shard, row = self.entry(split, name)
+        return shard.labels[row['label_start']:row['label_start'] + row['label_count']]
+
+    def has_labels(self, split, name):
+        return bool(self.entry(split, name)[1]['has_label'])
+
+    def image_digest(self, split, name):
+        return self.entry(split, name)[1]['image_digest'].decode()
+
+    def label_digest(self, split, name):
+        row = self.entry(split, name)[1]
+        return row['label_digest'].decode() if row['has_label'] else None
+
+    def read_image(self, split, name, flags=cv2.IMREAD_COLOR):
+        return cv2.imdecode(self.image_bytes(split, name), flags)
+
+    def class_histogram(self, split):
+        """
+        某个划分中各类别的标注框数量，直接由索引累加，不读取标注。
+        """
+        split_id = SPLITS.index(split)
+        histograms = [shard.index['class_histogram'][shard.index['split'] == split_id].sum(axis=0)
+                      for shard in self.shards]
+        return np.sum(histograms, axis=0) if histograms else np.zeros(0, dtype=np.int64)
+
+
+def is_shard_path(path):
+    """
+    是否为分片文件，或只包含分片文件的目录（没有images子目录）。
+    """
+    path = Path(path)
+    if path.is_file():
+        return path.suffix == SHARD_SUFFIX
+    return path.is_dir() and not (path / 'images').is_dir() and any(path.glob(f'*{SHARD_SUFFIX}'))
+
+
+# 绝对路径 -> (路径签名, ShardReader或None)
+_readers = {}
+
+
+def _path_signature(path):
+    """
+    路径的(inode, 大小, 修改时间)，不存在时为None。
+    分片目录中增删或替换（os.replace）分片文件都会改变目录的修改时间，签名随之改变。
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def open_shards(path):
+    """
+    打开分片数据集，同一进程内同一路径只映射一次；不是分片路径时返回None。
+    路径的签名变化（重新打包、新建分片）后重新打开。
+    """
+    path = os.path.abspath(path)
+    signature = _path_signature(path)
+    cached = _readers.get(path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, ShardReader(path) if signature is not None and is_shard_path(path) else None)
+        _readers[path] = cached
+    return cached[1]
+
+
+def invalidate(path=None):
+    """
+    丢弃已打开的分片，path为None时丢弃全部。打包写出分片后调用，修改时间精度较粗的文件系统上也不会读到旧分片。
+    """
+    if path is None:
+        _readers.clear()
+    else:
+        _readers.pop(os.path.abspath(path), None)
+
+
+def resolve(path):
+    """
+    把“分片路径/images|labels/划分[/文件名]”形式的虚拟路径解析为(reader, 类别目录, 划分, 文件名)。
+    分片数据集可以像目录一样用这种路径访问，其余脚本因此只需把文件读取换成本模块的函数。
+    不是分片内的路径时返回None。
+    """
+    parts = Path(path).parts
+    for depth in (3, 2):
+        if len(parts) <= depth or parts[-depth] not in ('images', 'labels'):
+            continue
+        reader = open_shards(Path(*parts[:-depth]))
+        if reader is not None:
+            name = parts[-1] if depth == 3 else None
+            return reader, parts[-depth], parts[-depth + 1], name
+    return None
+
+
+def list_images(image_dir):
+    """
+    列出图像目录（或分片中的“images/划分”）下的图像路径，按文件名排序。
+    """
+    resolved = resolve(image_dir)
+    if resolved is not None:
+        reader, _, split, _ = resolved
+        return [Path(image_dir) / name for name in reader.names(split)]
+    if not os.path.isdir(image_dir):
+        return []
+    return sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def list_names(directory):
+    """
+    列出目录下的文件名；分片中的labels目录只列出有标注文件的图像对应的txt名。
+    """
+    resolved = resolve(directory)
+    if resolved is None:
+        return os.listdir(directory) if os.path.isdir(directory) else []
+    reader, kind, split, _ = resolved
+    if kind == 'images':
+        return list(reader.names(split))
+    return [f"{Path(name).stem}.txt" for name in reader.names(split) if reader.has_labels(split, name)]
+
+
+def _resolve_file(path):
+    resolved = resolve(path)
+    if resolved is None or resolved[3] is None:
+        return None
+    reader, kind, split, name = resolved
+    if kind == 'labels':
+        name = reader.stems.get((split, Path(name).stem))
+        if name is None or not reader.has_labels(split, name):
+            return reader, kind, split, None
+    elif (split, name) not in reader:
+        return reader, kind, split, None
+    return reader, kind, split, name
+
+
+def exists(path):
+    resolved = _resolve_file(path)
+    if resolved is None:
+        return os.path.exists(path)
+    return resolved[3] is not None
+
+
+def imread(path, flags=cv2.IMREAD_COLOR):
+    """
+    cv2.imread的替代，也能读取分片中的图像。读取失败时与cv2.imread一样返回None。
+    """
+    resolved = _resolve_file(path)
+    if resolved is None:
+        return cv2.imread(str(path), flags)
+    reader, _, split, name = resolved
+    return reader.read_image(split, name, flags) if name is not None else None
+
+
+def image_size(path):
+    """
+    只读取图像文件头得到(宽, 高)，也能读取分片中的图像。
+    """
+    resolved = _resolve_file(path)
+    if resolved is None:
+        source = path
+    else:
+        reader, _, split, name = resolved
+        if name is None:
+            raise FileNotFoundError(path)
+        source = io.BytesIO(reader.image_bytes(split, name))
+    with Image.open(source) as image:
+        return image.size
+
+
+def read_labels(label_path):
+    """
+    读取YOLO标注，返回LABEL_DTYPE数组；分片中的标注为零拷贝视图。
+    """
+    resolved = _resolve_file(label_path)
+    if resolved is None:
+        with open(label_path, 'r') as file:
+            return parse_label_text(file.read())
+    reader, _, split, name = resolved
+    if name is None:
+        raise FileNotFoundError(label_path)
+    return reader.labels(split, name)
+
+
+def file_digest(path):
+    """
+    文件内容摘要；分片中的文件直接使用打包时记录的摘要。
+    """
+    resolved = _resolve_file(path)
+    if resolved is None:
+        return content_digest(Path(path).read_bytes())
+    reader, kind, split, name = resolved
+    if name is None:
+        raise FileNotFoundError(path)
+    return reader.image_digest(split, name) if kind == 'images' else reader.label_digest(split, name)
+
+
+def export_file(src, dst: Path, copy=shutil.copy):
+    """
+    把文件放到目标位置：普通文件用copy（默认shutil.copy），分片中的图像写出原始字节、标注写出文本。
+    """
+    resolved = _resolve_file(src)
+    if resolved is None:
+        copy(src, dst)
+        return
+    reader, kind, split, name = resolved
+    if name is None:
+        raise FileNotFoundError(src)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    if kind == 'images':
+        with open(dst, 'wb') as file:
+            file.write(reader.image_bytes(split, name))
+    else:
+        with open(dst, 'w') as file:
+            file.write(format_label_rows(reader.labels(split, name)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='把YOLO结构的数据集打包为内存映射分片，或查看分片内容')
+    parser.add_argument('dataset', help='数据集目录（打包）或分片路径（查看）')
+    parser.add_argument('--output', default=None, help='分片输出目录，默认为 <数据集>.shards')
+    parser.add_argument('--shard-mb', type=int, default=1024, help='单个分片的图像字节上限（MB）')
+    parser.add_argument('--num-classes', type=int, default=None)
+    args = parser.parse_args()
+
+    if is_shard_path(args.dataset):
+        reader = ShardReader(args.dataset)
+        for split in SPLITS:
+            print(f"{split}: {len(reader.names(split))} 张图像, 类别框数 {reader.class_histogram(split).tolist()}")
+    else:
+        output = args.output or f"{Path(args.dataset).as_posix().rstrip('/')}.shards"
+        paths = pack_dataset(Path(args.dataset), Path(output), args.shard_mb << 20, args.num_classes)
+        print(f'已写入 {len(paths)} 个分片到 {output}')
@@ -0,0 +1,330 @@
+import argparse
+import multiprocessing
+import os
+import re
+from pathlib import Path
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from createDataSet import file_stamp
+from datasetIndex import build_index
+from datasetShards import SPLITS, imread, open_shards
+
+DEDUP_INDEX_NAME = '.dedup_index.npz'
+AUGMENTED_PATTERN = re.compile(r'_augmented_\d+$')
+# 跨划分重复时保留优先级高的划分中的图像：训练集 > 验证集 > 测试集
+SPLIT_PRIORITY = {split: i for i, split in enumerate(SPLITS)}
+
+
+def pack_bits(bits):
+    return np.packbits(bits.ravel()).view('>u8')[0].astype(np.uint64)
+
+
+def dhash(gray):
+    """
+    64位差异哈希：缩放到9x8后比较水平相邻像素的明暗。
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return pack_bits(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray):
+    """
+    64位感知哈希：缩放到32x32做DCT，取左上角8x8低频系数与其中位数（不含直流分量）比较。
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return pack_bits(low > np.median(low.ravel()[1:]))
+
+
+def image_hashes(image_path):
+    """
+    计算一张图像的(dHash, pHash)。JPEG按1/4分辨率解码灰度图，哈希只需要低频信息。
+    """
+    gray = imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        raise ValueError(f"无法读取图像: {image_path}")
+    return dhash(gray), phash(gray)
+
+
+def _hash_worker(task):
+    i, image_path = task
+    try:
+        return (i,) + image_hashes(image_path) + (None,)
+    except Exception as e:
+        return i, 0, 0, repr(e)
+
+
+def popcount(x):
+    """
+    64位整数数组中每个元素的1的个数（SWAR位运算，全部是向量化的整数运算）。
+    """
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int32)
+
+
+def hamming(a, b):
+    """
+    两组64位哈希按广播逐对计算汉明距离。
+    """
+    return popcount(np.bitwise_xor(a, b))
+
+
+def load_hash_index(index_path: Path):
+    try:
+        with np.load(index_path) as data:
+            return {key: data[key] for key in data.files}
+    except (FileNotFoundError, ValueError, OSError):
+        return {}
+
+
+def save_hash_index(index_path: Path, index):
+    # 数据集目录只读时不写索引，与datasetIndex的缓存一致
+    temp_path = index_path.with_name(f'{index_path.name}.{os.getpid()}.tmp.npz')
+    try:
+        np.savez(temp_path, **index)
+        os.replace(temp_path, index_path)
+    except OSError:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def build_hash_index(dataset_dir, workers=None, index_path=None):
+    """
+    为数据集各划分的全部图像计算感知哈希，结果保存在磁盘上的索引中。
+    再次运行时只为新增或变化（大小、修改时间或分片摘要不同）的图像重新计算。
+    :param index_path: 索引文件路径，默认在数据集根目录下
+    :return: 字典，各项为等长数组：paths（相对路径）、splits、stamps、dhash、phash
+    """
+    root = Path(dataset_dir)
+    index_path = Path(index_path) if index_path else root / DEDUP_INDEX_NAME
+    dataset = build_index(root)
+    paths = [f'images/{split}/{name}' for split in SPLITS for name in dataset.images(split)]
+    splits = [path.split('/')[1] for path in paths]
+    stamps = [str(file_stamp(root / path)) for path in paths]
+
+    cached = load_hash_index(index_path)
+    known = {}
+    if cached:
+        known = {(path, stamp): i for i, (path, stamp) in enumerate(zip(cached['paths'].tolist(),
+                                                                        cached['stamps'].tolist()))}
+    dhashes = np.zeros(len(paths), dtype=np.uint64)
+    phashes = np.zeros(len(paths), dtype=np.uint64)
+    valid = np.ones(len(paths), dtype=bool)
+    tasks = []
+    for i, key in enumerate(zip(paths, stamps)):
+        if key in known:
+            dhashes[i], phashes[i] = cached['dhash'][known[key]], cached['phash'][known[key]]
+        else:
+            tasks.append((i, str(root / paths[i])))
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(tasks) <= 1:
+        results = map(_hash_worker, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_hash_worker, tasks, chunksize=max(1, len(tasks) // (workers * 16)))
+    try:
+        for i, dhash_value, phash_value, error in tqdm(results, total=len(tasks), desc='hash'):
+            if error:
+                print(f"跳过 {paths[i]}: {error}")
+                valid[i] = False
+                continue
+            dhashes[i], phashes[i] = dhash_value, phash_value
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    index = {
+        'paths': np.array(paths, dtype=str)[valid],
+        'splits': np.array(splits, dtype=str)[valid],
+        'stamps': np.array(stamps, dtype=str)[valid],
+        'dhash': dhashes[valid],
+        'phash': phashes[valid],
+    }
+    if tasks or len(cached.get('paths', [])) != len(paths):
+        save_hash_index(index_path, index)
+    return index
+
+
+def near_duplicate_pairs(dhashes, phashes, threshold=4, phash_threshold=10, large_group=256, chunk_size=1024):
+    """
+    多索引哈希查找近似重复对：dHash切成threshold+1段，汉明距离不超过threshold的两个哈希
+    至少有一段完全相同（抽屉原理），因此只需比较同一段取值相同的哈希，不做全量两两比较。
+    候选对再同时用dHash与pHash的汉明距离确认。
+    按段值排序后，小的分组对所有分组一起按组内偏移量逐次比较；超过large_group的大分组
+    （如长时间静止的连续帧）单独按行分块做矩阵比较。
+    :return: 形状为(K, 2)的下标对数组，每对i < j
+    """
+    bounds = np.linspace(0, 64, threshold + 2).astype(int)
+    pairs = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        keys = (dhashes >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+        order = np.argsort(keys, kind='stable')
+        starts = np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        sizes = ends - starts
+        sorted_dhashes, sorted_phashes = dhashes[order], phashes[order]
+
+        # 小分组：第k轮比较排序后相距k的两个位置，直到所有分组都比较完；先比dHash，通过的再比pHash
+        group_end = np.repeat(ends, sizes)
+        group_size = np.repeat(sizes, sizes)
+        active = np.flatnonzero((group_size > 1) & (group_size <= large_group))
+        offset = 1
+        while len(active):
+            active = active[active + offset < group_end[active]]
+            close = active[hamming(sorted_dhashes[active], sorted_dhashes[active + offset]) <= threshold]
+            close = close[hamming(sorted_phashes[close], sorted_phashes[close + offset]) <= phash_threshold]
+            a, b = order[close], order[close + offset]
+            pairs.append(np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1))
+            offset += 1
+
+        for start, end in zip(starts[sizes > large_group], ends[sizes > large_group]):
+            members = order[start:end]
+            for row in range(0, len(members) - 1, chunk_size):
+                rows = members[row:row + chunk_size]
+                cols = members[row + 1:]
+                close = ((hamming(dhashes[rows][:, None], dhashes[cols][None, :]) <= threshold)
+                         & (hamming(phashes[rows][:, None], phashes[cols][None, :]) <= phash_threshold))
+                # 只保留列在行之后的对，避免重复与自身比较
+                close &= np.arange(len(cols))[None, :] >= np.arange(len(rows))[:, None]
+                i, j = np.nonzero(close)
+                pairs.append(np.stack([np.minimum(rows[i], cols[j]), np.maximum(rows[i], cols[j])], axis=1))
+    pairs = [p for p in pairs if len(p)]
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def connected_labels(count, pairs):
+    """
+    把近似重复对连成簇：标签沿边取最小值并做指针跳跃，直到不再变化。
+    :return: 每张图像所属簇的标签（簇内最小下标）
+    """
+    labels = np.arange(count)
+    if len(pairs) == 0:
+        return labels
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        smallest = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, smallest)
+        np.minimum.at(updated, b, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def keep_order(path):
+    # 同一划分内优先保留原始图像，其次按文件名
+    name = Path(path).stem
+    return AUGMENTED_PATTERN.search(name) is not None, path
+
+
+def find_duplicates(index, threshold=4, phash_threshold=10):
+    """
+    :return: (划分内重复组列表, 跨划分重复组列表)，每组为(保留的路径, 重复的路径列表)
+    """
+    pairs = near_duplicate_pairs(index['dhash'], index['phash'], threshold, phash_threshold)
+    labels = connected_labels(len(index['paths']), pairs)
+    clusters = {}
+    for i in np.flatnonzero(labels != np.arange(len(labels))):
+        clusters.setdefault(labels[i], [labels[i]]).append(i)
+
+    within, cross = [], []
+    for members in clusters.values():
+        by_split = {}
+        for i in members:
+            by_split.setdefault(str(index['splits'][i]), []).append(str(index['paths'][i]))
+        keepers = {}
+        for split, paths in by_split.items():
+            paths.sort(key=keep_order)
+            keepers[split] = paths[0]
+            if len(paths) > 1:
+                within.append((paths[0], paths[1:]))
+        if len(by_split) > 1:
+            kept_split = min(by_split, key=SPLIT_PRIORITY.get)
+            cross.append((keepers[kept_split], sorted(path for split, paths in by_split.items()
+                                                      if split != kept_split for path in paths)))
+    return sorted(within), sorted(cross)
+
+
+def augmented_leaks(index):
+    """
+    按文件名检查增强副本泄漏：去掉_augmented_{i}后缀后的源图像名出现在多个划分中。
+    :return: 源图像名 -> 各划分中的路径列表
+    """
+    sources = {}
+    for path, split in zip(index['paths'].tolist(), index['splits'].tolist()):
+        source = AUGMENTED_PATTERN.sub('', Path(path).stem)
+        sources.setdefault(source, {}).setdefault(split, []).append(path)
+    return {source: sorted(path for paths in by_split.values() for path in paths)
+            for source, by_split in sorted(sources.items()) if len(by_split) > 1}
+
+
+def remove_images(dataset_dir, paths):
+    """
+    删除图像及其同名标注。分片是只读的，不能删除。
+    """
+    root = Path(dataset_dir)
+    if open_shards(root) is not None:
+        raise ValueError('分片数据集是只读的，请在原始目录上删除后重新打包')
+    for path in paths:
+        _, split, name = path.split('/')
+        for file_path in [root / path, root / 'labels' / split / f"{Path(name).stem}.txt"]:
+            if file_path.exists():
+                file_path.unlink()
+
+
+def format_report(index, within, cross, leaks):
+    lines = [f"共 {len(index['paths'])} 张图像；划分内重复 {sum(len(d) for _, d in within)} 张（{len(within)} 组），"
+             f"跨划分重复 {sum(len(d) for _, d in cross)} 张（{len(cross)} 组），"
+             f"跨划分的增强副本源图像 {len(leaks)} 个"]
+    if within:
+        lines.append('划分内重复（保留 <- 重复）:')
+        lines += [f"  {keep} <- {', '.join(duplicates)}" for keep, duplicates in within]
+    if cross:
+        lines.append('跨划分重复（保留 <- 泄漏到其他划分的重复）:')
+        lines += [f"  {keep} <- {', '.join(duplicates)}" for keep, duplicates in cross]
+    if leaks:
+        lines.append('增强副本跨划分（按文件名）:')
+        lines += [f"  {source}: {', '.join(paths)}" for source, paths in leaks.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用感知哈希查找数据集中划分内与跨划分的近似重复图像')
+    parser.add_argument('dataset_dir', nargs='?', default='EndDataSet', help='数据集根目录，也可以是分片目录')
+    parser.add_argument('--workers', type=int, default=None, help='计算哈希的进程数，默认等于CPU核数')
+    parser.add_argument('--threshold', type=int, default=4, help='dHash汉明距离阈值')
+    parser.add_argument('--phash-threshold', type=int, default=10, help='pHash汉明距离阈值')
+    parser.add_argument('--index', default=None, help='哈希索引文件路径，默认在数据集根目录下')
+    parser.add_argument('--remove', choices=['within', 'cross', 'all'], default=None,
+                        help='删除划分内重复、跨划分重复（保留训练集中的）或两者，默认只报告')
+    parser.add_argument('--report', default=None, help='报告的写入路径')
+    args = parser.parse_args()
+
+    index = build_hash_index(args.dataset_dir, args.workers, args.index)
+    within, cross = find_duplicates(index, args.threshold, args.phash_threshold)
+    report = format_report(index, within, cross, augmented_leaks(index))
+    print(report)
+    if args.report:
+        with open(args.report, 'w') as file:
+            file.write(report)
+
+    if args.remove:
+        groups = (within if args.remove in ('within', 'all') else []) + (cross if args.remove in ('cross', 'all') else [])
+        removed = sorted({path for _, duplicates in groups for path in duplicates})
+        remove_images(args.dataset_dir, removed)
+        print(f"已删除 {len(removed)} 张图像及其标注")
+
+
+if __name__ == '__main__':
+    main()
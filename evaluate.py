@@ -0,0 +1,339 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from datasetShards import exists, image_size, list_images, read_labels
+
+CLASS_NAMES = ['good', 'broke', 'lose', 'uncovered', 'circle']
+# mAP50-95使用的IoU阈值
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# 与Ultralytics一致：混淆矩阵只统计置信度不低于0.25、IoU超过0.45的匹配
+CONFUSION_CONF = 0.25
+CONFUSION_IOU = 0.45
+
+
+def dataset_split(dataset_yaml, split='val', dataset_root=None):
+    """
+    读取数据集配置，返回指定划分的图像路径列表与对应的标注目录（YOLO约定：images -> labels）。
+    :param dataset_root: 覆盖配置文件中的path，配置里是训练平台上的路径时使用
+    """
+    with open(dataset_yaml, 'r') as file:
+        config = yaml.safe_load(file)
+    root = Path(dataset_root or config['path'])
+    image_dir = root / config[split]
+    label_dir = root / Path(*['labels' if part == 'images' else part for part in Path(config[split]).parts])
+    image_paths = [str(p) for p in list_images(image_dir)]
+    return image_paths, label_dir
+
+
+def load_ground_truth(image_path, label_dir):
+    """
+    读取一张图像的YOLO标注，换算为原图像素坐标的xyxy框。
+    """
+    width, height = image_size(image_path)  # 只读取文件头
+    label_path = Path(label_dir) / f"{Path(image_path).stem}.txt"
+    if not exists(label_path):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    labels = read_labels(label_path)
+    cx, cy = labels['x_center'] * width, labels['y_center'] * height
+    w, h = labels['width'] * width, labels['height'] * height
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1).astype(np.float32)
+    return boxes, labels['class_id'].astype(np.int64)
+
+
+def load_results_txt(results_path):
+    """
+    读取temp.save_results写出的results.txt（文件名、类别、置信度、xyxy，制表符分隔）。
+    :return: 文件名 -> (boxes, class_ids, confidences)
+    """
+    rows = {}
+    with open(results_path, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            file_name, class_id, confidence, box = line.rstrip('\n').split('\t')
+            rows.setdefault(file_name, []).append((int(class_id), float(confidence), *map(float, box.split())))
+    predictions = {}
+    for file_name, values in rows.items():
+        values = np.array(values, dtype=np.float64)
+        predictions[file_name] = (values[:, 2:6], values[:, 0].astype(np.int64), values[:, 1])
+    return predictions
+
+
+def load_run_cache(cache_path):
+    """
+    读取运行缓存（JSONL，每行一张图像的 image/boxes/class_ids/confidences）。
+    :return: 文件名 -> (boxes, class_ids, confidences)
+    """
+    predictions = {}
+    with open(cache_path, 'r') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                predictions[record['image']] = (record['boxes'], record['class_ids'], record['confidences'])
+    return predictions
+
+
+def save_run_cache(cache_path, image_paths, predictions):
+    """
+    把ImagePredictor的预测写成运行缓存，之后可以不重新推理直接评估。
+    """
+    with open(cache_path, 'w') as file:
+        for image_path, (boxes, class_ids, confidences) in zip(image_paths, predictions):
+            file.write(json.dumps({'image': Path(image_path).name, 'boxes': boxes, 'class_ids': class_ids,
+                                   'confidences': confidences}) + '\n')
+
+
+def box_iou(boxes1, boxes2):
+    """
+    两组xyxy框的两两IoU矩阵。
+    """
+    lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    return inter / (area1[:, None] + area2[None, :] - inter + 1e-9)
+
+
+def unique_matches(iou, threshold):
+    """
+    IoU不低于阈值的(真实框, 预测框)对按IoU从大到小贪心一一匹配。
+    :return: (真实框下标, 预测框下标)
+    """
+    gt_idx, pred_idx = np.nonzero(iou >= threshold)
+    if len(gt_idx) == 0:
+        return gt_idx, pred_idx
+    order = np.argsort(-iou[gt_idx, pred_idx], kind='stable')
+    gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+    _, first = np.unique(pred_idx, return_index=True)
+    gt_idx, pred_idx = gt_idx[np.sort(first)], pred_idx[np.sort(first)]
+    _, first = np.unique(gt_idx, return_index=True)
+    return gt_idx[first], pred_idx[first]
+
+
+def match_predictions(pred_boxes, pred_classes, gt_boxes, gt_classes):
+    """
+    按各IoU阈值把预测框与同类别的真实框一一匹配，返回(预测数, 阈值数)的TP矩阵。
+    """
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_boxes) == 0 or len(gt_boxes) == 0:
+        return tp
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_classes[:, None] == pred_classes[None, :])
+    for j, threshold in enumerate(IOU_THRESHOLDS):
+        _, pred_idx = unique_matches(iou, threshold)
+        tp[pred_idx, j] = True
+    return tp
+
+
+def average_precision(recall, precision):
+    """
+    COCO式101点插值的AP：每个召回率取值点上取召回率不低于它的最大精确率。
+    """
+    return float(interpolated_precision(recall, precision).mean())
+
+
+def interpolated_precision(recall, precision, points=101):
+    """
+    PR曲线在均匀召回率取值点上的插值精确率（精确率取右侧包络）。
+    """
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    index = np.searchsorted(recall, np.linspace(0, 1, points), side='left')
+    return np.where(index < len(precision), precision[np.minimum(index, len(precision) - 1)], 0.0)
+
+
+def update_confusion_matrix(matrix, pred_boxes, pred_classes, confidences, gt_boxes, gt_classes):
+    """
+    累加一张图像的混淆矩阵，matrix[预测类别, 真实类别]，最后一行/列为背景。
+    """
+    background = matrix.shape[0] - 1
+    keep = confidences >= CONFUSION_CONF
+    pred_boxes, pred_classes = pred_boxes[keep], pred_classes[keep]
+    matched_gt = np.zeros(len(gt_boxes), dtype=bool)
+    matched_pred = np.zeros(len(pred_boxes), dtype=bool)
+    if len(gt_boxes) and len(pred_boxes):
+        gt_idx, pred_idx = unique_matches(box_iou(gt_boxes, pred_boxes), CONFUSION_IOU + 1e-9)
+        np.add.at(matrix, (pred_classes[pred_idx], gt_classes[gt_idx]), 1)
+        matched_gt[gt_idx] = True
+        matched_pred[pred_idx] = True
+    np.add.at(matrix, (background, gt_classes[~matched_gt]), 1)
+    np.add.at(matrix, (pred_classes[~matched_pred], background), 1)
+
+
+def evaluate(predictions, ground_truths, num_classes=len(CLASS_NAMES)):
+    """
+    :param predictions: 每张图像的(boxes, class_ids, confidences)，boxes为原图坐标xyxy
+    :param ground_truths: 每张图像的(boxes, class_ids)
+    :return: 评估结果字典：各类别AP50/AP50-95/精确率/召回率、PR曲线与混淆矩阵
+    """
+    tps, confs, pred_classes, gt_classes = [], [], [], []
+    matrix = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int64)
+    for (boxes, class_ids, confidences), (gt_boxes, gt_ids) in zip(predictions, ground_truths):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        confidences = np.asarray(confidences, dtype=np.float32)
+        tps.append(match_predictions(boxes, class_ids, gt_boxes, gt_ids))
+        confs.append(confidences)
+        pred_classes.append(class_ids)
+        gt_classes.append(gt_ids)
+        update_confusion_matrix(matrix, boxes, class_ids, confidences, gt_boxes, gt_ids)
+    tp = np.concatenate(tps) if tps else np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)
+    conf = np.concatenate(confs) if confs else np.zeros(0, dtype=np.float32)
+    pred_classes = np.concatenate(pred_classes) if pred_classes else np.zeros(0, dtype=np.int64)
+    gt_classes = np.concatenate(gt_classes) if gt_classes else np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(-conf, kind='stable')
+    tp, conf, pred_classes = tp[order], conf[order], pred_classes[order]
+    # 精确率/召回率取所有类别平均F1最大的置信度阈值，与Ultralytics的汇总方式一致
+    conf_grid = np.linspace(0, 1, 1000)
+    p_curve = np.zeros((num_classes, len(conf_grid)))
+    r_curve = np.zeros((num_classes, len(conf_grid)))
+    ap = np.zeros((num_classes, len(IOU_THRESHOLDS)))
+    pr_curves = np.zeros((num_classes, 101))
+    instances = np.bincount(gt_classes, minlength=num_classes)[:num_classes]
+    for c in range(num_classes):
+        if instances[c] == 0:
+            continue
+        mask = pred_classes == c
+        class_tp = tp[mask]
+        if len(class_tp) == 0:
+            continue
+        tpc = np.cumsum(class_tp, axis=0)
+        fpc = np.cumsum(~class_tp, axis=0)
+        recall = tpc / instances[c]
+        precision = tpc / (tpc + fpc)
+        # 置信度从高到低排列，插值时取反使横坐标递增
+        r_curve[c] = np.interp(-conf_grid, -conf[mask], recall[:, 0], left=0)
+        p_curve[c] = np.interp(-conf_grid, -conf[mask], precision[:, 0], left=1)
+        ap[c] = [average_precision(recall[:, j], precision[:, j]) for j in range(len(IOU_THRESHOLDS))]
+        pr_curves[c] = interpolated_precision(recall[:, 0], precision[:, 0])
+
+    present = instances > 0
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + 1e-16)
+    best = int(f1[present].mean(axis=0).argmax()) if present.any() else 0
+    classes = {}
+    for c in range(num_classes):
+        classes[CLASS_NAMES[c] if c < len(CLASS_NAMES) else str(c)] = {
+            'instances': int(instances[c]),
+            'ap50': float(ap[c, 0]),
+            'ap50_95': float(ap[c].mean()),
+            'precision': float(p_curve[c, best]),
+            'recall': float(r_curve[c, best]),
+        }
+    # 只对验证集中出现过的类别取平均
+    return {
+        'images': len(ground_truths),
+        'map50': float(ap[present, 0].mean()) if present.any() else 0.0,
+        'map50_95': float(ap[present].mean()) if present.any() else 0.0,
+        'precision': float(p_curve[present, best].mean()) if present.any() else 0.0,
+        'recall': float(r_curve[present, best].mean()) if present.any() else 0.0,
+        'best_conf': float(conf_grid[best]),
+        'classes': classes,
+        'pr_curve': {name: pr_curves[c].tolist() for c, name in enumerate(classes)},
+        'confusion_matrix': matrix.tolist(),
+    }
+
+
+def compute_map(predictions, ground_truths, num_classes):
+    """
+    :return: (mAP50, mAP50-95)
+    """
+    report = evaluate(predictions, ground_truths, num_classes)
+    return report['map50'], report['map50_95']
+
+
+def align_predictions(image_paths, predictions_by_name):
+    """
+    按图像顺序取出以文件名为键的预测，没有预测的图像视为空结果。
+    """
+    empty = (np.zeros((0, 4)), np.zeros(0, dtype=np.int64), np.zeros(0))
+    return [predictions_by_name.get(Path(p).name, empty) for p in image_paths]
+
+
+def format_report(report):
+    names = list(report['classes'])
+    lines = [f"{'class':>10} {'instances':>9} {'P':>7} {'R':>7} {'AP50':>7} {'AP50-95':>7}",
+             f"{'all':>10} {sum(c['instances'] for c in report['classes'].values()):>9} "
+             f"{report['precision']:>7.4f} {report['recall']:>7.4f} {report['map50']:>7.4f} {report['map50_95']:>7.4f}"]
+    for name, metrics in report['classes'].items():
+        lines.append(f"{name:>10} {metrics['instances']:>9} {metrics['precision']:>7.4f} {metrics['recall']:>7.4f} "
+                     f"{metrics['ap50']:>7.4f} {metrics['ap50_95']:>7.4f}")
+    lines.append('\n混淆矩阵（行: 预测, 列: 真实）')
+    header = names + ['background']
+    lines.append(' ' * 11 + ' '.join(f'{name:>10}' for name in header))
+    for name, row in zip(header, report['confusion_matrix']):
+        lines.append(f'{name:>10} ' + ' '.join(f'{value:>10}' for value in row))
+    return '\n'.join(lines)
+
+
+def check_gate(report, min_map50=None, min_map50_95=None, baseline=None, max_drop=0.0):
+    """
+    模型晋级门槛：返回未通过的条目列表，为空表示通过。
+    :param baseline: 基准评估结果，mAP下降超过max_drop时不通过
+    """
+    failures = []
+    if min_map50 is not None and report['map50'] < min_map50:
+        failures.append(f"mAP50 {report['map50']:.4f} < {min_map50}")
+    if min_map50_95 is not None and report['map50_95'] < min_map50_95:
+        failures.append(f"mAP50-95 {report['map50_95']:.4f} < {min_map50_95}")
+    if baseline is not None:
+        for key in ('map50', 'map50_95'):
+            if report[key] < baseline[key] - max_drop:
+                failures.append(f"{key} {report[key]:.4f} 比基准 {baseline[key]:.4f} 下降超过 {max_drop}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='计算mAP、PR曲线与混淆矩阵，并可作为模型晋级的CI门槛')
+    parser.add_argument('--data', default='manhole_dataset.yaml', help='数据集配置文件')
+    parser.add_argument('--split', default='val')
+    parser.add_argument('--dataset-root', default=None, help='覆盖配置文件中的数据集根目录')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--model', help='用ImagePredictor推理的ONNX模型')
+    source.add_argument('--results', help='temp.py写出的results.txt')
+    source.add_argument('--run-cache', help='运行缓存（JSONL）')
+    parser.add_argument('--variant', default=None, help='模型变体，如 int8-static')
+    parser.add_argument('--conf', type=float, default=0.001, help='推理时的置信度阈值')
+    parser.add_argument('--save-run-cache', default=None, help='把本次推理结果写成运行缓存')
+    parser.add_argument('--output', default=None, help='评估结果JSON的写入路径')
+    parser.add_argument('--min-map50', type=float, default=None)
+    parser.add_argument('--min-map50-95', type=float, default=None)
+    parser.add_argument('--baseline', default=None, help='基准评估结果JSON')
+    parser.add_argument('--max-drop', type=float, default=0.0, help='相对基准允许的mAP下降')
+    args = parser.parse_args(argv)
+
+    image_paths, label_dir = dataset_split(args.data, args.split, args.dataset_root)
+    if args.model:
+        from onnxTest import ImagePredictor
+        predictor = ImagePredictor(args.model, conf_threshold=args.conf, variant=args.variant)
+        predictions = predictor.predict_batch(image_paths, batch_size=8)
+        if args.save_run_cache:
+            save_run_cache(args.save_run_cache, image_paths, predictions)
+    elif args.results:
+        predictions = align_predictions(image_paths, load_results_txt(args.results))
+    else:
+        predictions = align_predictions(image_paths, load_run_cache(args.run_cache))
+
+    ground_truths = [load_ground_truth(p, label_dir) for p in image_paths]
+    report = evaluate(predictions, ground_truths)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    failures = check_gate(report, args.min_map50, args.min_map50_95, baseline, args.max_drop)
+    for failure in failures:
+        print(f'未通过: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
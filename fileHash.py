@@ -0,0 +1,12 @@
+import hashlib
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    计算文件内容的sha256摘要。只依赖标准库，推理后端与缓存都可以导入而不引入onnxruntime等依赖。
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
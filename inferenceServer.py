@@ -0,0 +1,369 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from onnxTest import ImagePredictor, letterbox_into
+
+
+class SharedFramePool:
+    """
+    共享内存中的输入张量槽位池，形状为(槽位数, 3, H, W)。
+    服务进程把预处理后的图像写入空闲槽位，工作进程按槽位号直接读取，不经过pickle。
+    """
+
+    def __init__(self, num_slots, input_size, name=None):
+        shape = (num_slots, 3, input_size, input_size)
+        size = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.frames = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+        self.free_slots = queue.Queue() if self.owner else None
+        if self.owner:
+            for slot in range(num_slots):
+                self.free_slots.put(slot)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self, timeout=None):
+        return self.free_slots.get(timeout=timeout)
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class PendingRequest:
+    def __init__(self, slot, info):
+        self.slot = slot
+        self.info = info
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def worker_main(model_path, predictor_kwargs, shm_name, num_slots, task_queue, result_queue):
+    """
+    工作进程：常驻一个预热好的ImagePredictor，从共享内存取出一批槽位推理。
+    """
+    predictor = ImagePredictor(model_path, **predictor_kwargs)
+    pool = SharedFramePool(num_slots, predictor.input_size, name=shm_name)
+    # 预热一次，避免第一个请求承担图初始化开销
+    predictor.predict_padded(predictor.batch_buffer(predictor.fixed_batch_size or 1), 1)
+    result_queue.put(('ready', os.getpid(), predictor.fixed_batch_size))
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            batch_id, slots, infos = task
+            try:
+                # 固定批量维度的模型按模型批量大小取缓冲区，predict_padded负责补齐
+                batch = predictor.batch_buffer(predictor.fixed_batch_size or len(slots))
+                np.take(pool.frames, slots, axis=0, out=batch[:len(slots)])
+                predictions = predictor.postprocess(predictor.predict_padded(batch, len(slots)), infos)
+                result_queue.put((batch_id, predictions, None))
+            except Exception as e:
+                result_queue.put((batch_id, None, repr(e)))
+    finally:
+        pool.close()
+
+
+class InferenceService:
+    """
+    本地推理服务：N个常驻工作进程 + 动态批处理。
+    请求线程解码并预处理图像写入共享内存槽位，批处理线程在max_batch_size与max_wait_ms之间攒批，
+    把槽位号交给手头批次最少的工作进程，结果线程把输出分发回各个请求。
+    工作进程意外退出时，结果线程让它手上的请求立即失败并归还其槽位，之后的批次只交给存活的工作进程。
+    """
+
+    def __init__(self, model_path, workers=2, max_batch_size=8, max_wait_ms=5, num_slots=None,
+                 input_size=640, **predictor_kwargs):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.input_size = input_size
+        self.class_names = ['good', 'broke', 'lose', 'uncovered', 'circle']
+        # 每个工作进程可能同时持有一批，另留一批给正在攒批的请求
+        num_slots = num_slots or max_batch_size * (workers + 2)
+        self.pool = SharedFramePool(num_slots, input_size)
+        self.local = threading.local()
+        self.requests = queue.Queue()
+        # batch_id -> (工作进程下标, 请求列表)；worker_batches记录每个工作进程手上的批次
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.batch_ids = itertools.count()
+        self.stats = {'requests': 0, 'batches': 0, 'batched_images': 0}
+        self.stats_lock = threading.Lock()
+        self.threads = []
+
+        context = mp.get_context('spawn')
+        # 每个工作进程一个任务队列，工作进程退出时能确定哪些批次随它丢失
+        self.task_queues = [context.Queue() for _ in range(workers)]
+        self.result_queue = context.Queue()
+        predictor_kwargs['input_size'] = input_size
+        self.workers = [
+            context.Process(target=worker_main, daemon=True,
+                            args=(model_path, predictor_kwargs, self.pool.name, num_slots,
+                                  task_queue, self.result_queue))
+            for task_queue in self.task_queues]
+        self.alive = set(range(workers))
+        self.worker_batches = [set() for _ in range(workers)]
+        for process in self.workers:
+            process.start()
+        # 等待所有工作进程加载模型并预热完成；模型固定了批量维度时攒批上限不能超过它
+        for _ in self.workers:
+            while True:
+                try:
+                    tag, _, fixed_batch_size = self.result_queue.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    # 工作进程在加载模型时退出，不再无限等待它的就绪消息
+                    exited = [p for p in self.workers if not p.is_alive()]
+                    if exited:
+                        self.close()
+                        raise RuntimeError(f'工作进程 {exited[0].pid} 启动失败（exitcode={exited[0].exitcode}）')
+            assert tag == 'ready', tag
+            if fixed_batch_size:
+                self.max_batch_size = min(self.max_batch_size, fixed_batch_size)
+
+        self.running = True
+        self.threads = [threading.Thread(target=self._batch_loop, daemon=True),
+                        threading.Thread(target=self._result_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image, timeout=30):
+        """
+        推理一张已解码的BGR图像，阻塞直到得到结果。
+        :return: (boxes, class_ids, confidences)，boxes为原图坐标
+        :raises TimeoutError: timeout秒内没有空闲的共享内存槽位，或没有得到推理结果
+        :raises RuntimeError: 推理出错或处理这批请求的工作进程已退出
+        """
+        try:
+            slot = self.pool.acquire(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('没有空闲的共享内存槽位') from None
+        try:
+            info = letterbox_into(image, self.pool.frames[slot], self.local)
+        except Exception:
+            self.pool.release(slot)
+            raise
+        request = PendingRequest(slot, info)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError('推理超时')
+        if request.error:
+            raise RuntimeError(request.error)
+        return request.result
+
+    def _batch_loop(self):
+        while self.running:
+            try:
+                first = self.requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            batch_id = next(self.batch_ids)
+            with self.in_flight_lock:
+                if not self.alive:
+                    self._fail(batch, '没有存活的工作进程')
+                    continue
+                worker = min(self.alive, key=lambda i: len(self.worker_batches[i]))
+                self.in_flight[batch_id] = (worker, batch)
+                self.worker_batches[worker].add(batch_id)
+            self.task_queues[worker].put((batch_id, [r.slot for r in batch], [r.info for r in batch]))
+            with self.stats_lock:
+                self.stats['batches'] += 1
+                self.stats['batched_images'] += len(batch)
+
+    def _fail(self, batch, error):
+        for request in batch:
+            request.error = error
+            self.pool.release(request.slot)
+            request.done.set()
+
+    def _deliver(self, batch_id, predictions, error):
+        with self.in_flight_lock:
+            entry = self.in_flight.pop(batch_id, None)
+            if entry is not None:
+                self.worker_batches[entry[0]].discard(batch_id)
+        if entry is None:
+            # 所属工作进程已被判定退出，这批请求已经失败返回
+            return
+        batch = entry[1]
+        for i, request in enumerate(batch):
+            if error:
+                request.error = error
+            else:
+                request.result = predictions[i]
+            self.pool.release(request.slot)
+            request.done.set()
+        with self.stats_lock:
+            self.stats['requests'] += len(batch)
+
+    def _reap_workers(self):
+        """
+        检查意外退出的工作进程：先取完结果队列中已有的结果，再让它手上剩余的批次失败并归还槽位。
+        """
+        dead = [i for i in self.alive if not self.workers[i].is_alive()]
+        if not dead:
+            return
+        while True:
+            try:
+                self._deliver(*self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+        for worker in dead:
+            with self.in_flight_lock:
+                self.alive.discard(worker)
+                lost = [self.in_flight.pop(batch_id)[1] for batch_id in self.worker_batches[worker]]
+                self.worker_batches[worker].clear()
+            error = f'工作进程 {self.workers[worker].pid} 已退出（exitcode={self.workers[worker].exitcode}）'
+            for batch in lost:
+                self._fail(batch, error)
+
+    def _result_loop(self):
+        while self.running:
+            self._reap_workers()
+            try:
+                self._deliver(*self.result_queue.get(timeout=0.1))
+            except queue.Empty:
+                continue
+
+    def close(self):
+        self.running = False
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.workers:
+            process.join(timeout=10)
+        for thread in self.threads:
+            thread.join()
+        self.pool.close()
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict：请求体为编码后的图像字节（jpg/png），返回JSON检测结果。
+    GET /health：返回服务统计。
+    """
+    service = None
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = np.frombuffer(self.rfile.read(length), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            self.send_json(400, {'error': '无法解码图像'})
+            return
+        try:
+            boxes, class_ids, confidences = self.service.submit(image)
+        except Exception as e:
+            self.send_json(500, {'error': repr(e)})
+            return
+        self.send_json(200, {
+            'boxes': boxes,
+            'class_ids': class_ids,
+            'class_names': [self.service.class_names[c] for c in class_ids],
+            'confidences': confidences,
+        })
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404)
+            return
+        with self.service.stats_lock:
+            stats = dict(self.service.stats)
+        stats['mean_batch_size'] = stats['batched_images'] / max(stats['batches'], 1)
+        stats['workers'] = len(self.service.alive)
+        self.send_json(200, stats)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix套接字的客户端地址是空字符串
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def serve(service, host='127.0.0.1', port=8080, unix_socket=None):
+    PredictHandler.service = service
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, PredictHandler)
+        print(f'推理服务监听 unix:{unix_socket}')
+    else:
+        server = ThreadingHTTPServer((host, port), PredictHandler)
+        print(f'推理服务监听 http://{host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='多进程ONNX推理服务')
+    parser.add_argument('--model', default='best-sim.onnx')
+    parser.add_argument('--variant', default=None, help='模型变体，如 int8-static')
+    parser.add_argument('--session-profile', default=None, help='ONNX Runtime会话配置文件')
+    parser.add_argument('--workers', type=int, default=2, help='工作进程数')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='攒批的最长等待时间')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--nms', type=float, default=0.45)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix-socket', default=None, help='监听Unix套接字而不是TCP端口')
+    args = parser.parse_args()
+
+    service = InferenceService(args.model, workers=args.workers, max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms, conf_threshold=args.conf, nms_threshold=args.nms,
+                               variant=args.variant, session_profile=args.session_profile)
+    serve(service, args.host, args.port, args.unix_socket)
@@ -0,0 +1,278 @@
+import argparse
+import bisect
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'manhole'
+# 阶段耗时直方图的桶上界（秒），0.5ms到5s按约2倍递增
+STAGE_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+class Histogram:
+    """
+    固定桶的耗时直方图，每次记录只做一次二分查找与两次加法。
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        return list(itertools.accumulate(self.counts))
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullInstrumentation:
+    """
+    关闭时使用的空对象：接口与Instrumentation相同，所有调用都立即返回。
+    """
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def request(self, label=''):
+        return _NULL_CONTEXT
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class _StageTimer:
+    __slots__ = ('instrumentation', 'name', 'start')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SamplingProfiler:
+    """
+    采样分析器：后台线程每隔interval秒抓取正在处理请求的线程的调用栈，
+    只保留耗时最长的slowest个请求的栈样本，可写成flamegraph.pl / speedscope可读的folded格式。
+    """
+
+    def __init__(self, slowest=10, interval=0.002):
+        self.slowest = slowest
+        self.interval = interval
+        self._active = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stacks.append((thread_id, samples, ';'.join(reversed(stack))))
+            # 持锁计数，且只计入仍在进行的请求：end()之后不会再有样本写入
+            with self._lock:
+                for thread_id, samples, stack in stacks:
+                    if self._active.get(thread_id) is samples:
+                        samples[stack] += 1
+
+    def begin(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        samples = Counter()
+        with self._lock:
+            self._active[threading.get_ident()] = samples
+        return samples
+
+    def end(self, samples, label, seconds):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            # 保存样本的快照，folded()读取时不受采样线程影响
+            entry = (seconds, next(self._sequence), label, dict(samples))
+            if len(self._heap) < self.slowest:
+                heapq.heappush(self._heap, entry)
+            elif seconds > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def folded(self):
+        """
+        folded格式的栈："请求;外层函数;...;内层函数 样本数"，每个请求作为最外层的一帧。
+        """
+        with self._lock:
+            requests = sorted(self._heap, reverse=True)
+        lines = []
+        for seconds, _, label, samples in requests:
+            root = f"{label} {seconds * 1000:.1f}ms".replace(';', ',')
+            lines += [f"{root};{stack} {count}" for stack, count in sorted(samples.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write_folded(self, path):
+        with open(path, 'w') as file:
+            file.write(self.folded())
+
+
+class Instrumentation:
+    """
+    推理热点路径的埋点：各阶段耗时直方图、计数器，以及可选的慢请求采样分析。
+    """
+    enabled = True
+
+    def __init__(self, buckets=STAGE_BUCKETS, profile_slowest=0, profile_interval=0.002):
+        """
+        :param profile_slowest: 大于0时启用采样分析，保留最慢的这么多个请求的调用栈
+        :param profile_interval: 采样间隔（秒）
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = Counter()
+        self.profiler = SamplingProfiler(profile_slowest, profile_interval) if profile_slowest > 0 else None
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def request(self, label=''):
+        """
+        一次完整请求：记录到request阶段，启用采样分析时同时采集这次请求的调用栈。
+        """
+        samples = self.profiler.begin() if self.profiler is not None else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('request', seconds)
+            if samples is not None:
+                self.profiler.end(samples, str(label), seconds)
+
+    def prometheus_text(self):
+        """
+        Prometheus文本格式（0.0.4）的全部指标。
+        """
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [f'# HELP {name} 推理各阶段耗时', f'# TYPE {name} histogram']
+        with self._lock:
+            histograms = {stage: (h.cumulative(), h.sum, h.count) for stage, h in sorted(self.histograms.items())}
+            counters = sorted(self.counters.items())
+        for stage, (cumulative, total, count) in histograms.items():
+            for bound, value in zip(self.buckets, cumulative):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {value}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {cumulative[-1]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        for counter, value in counters:
+            lines += [f'# TYPE {METRIC_PREFIX}_{counter}_total counter', f'{METRIC_PREFIX}_{counter}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        原子地写入文件，供node_exporter的textfile collector读取。
+        """
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    def push_prometheus(self, url, timeout=5):
+        """
+        把指标PUT到Pushgateway等接收Prometheus文本格式的地址，如 http://host:9091/metrics/job/manhole。
+        """
+        request = urllib.request.Request(url, data=self.prometheus_text().encode(), method='PUT',
+                                         headers={'Content-Type': 'text/plain; version=0.0.4'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+
+    def summary(self):
+        with self._lock:
+            lines = [f"{stage:>12}: {h.count} 次, 平均 {h.sum / h.count * 1000:.2f} ms"
+                     for stage, h in sorted(self.histograms.items()) if h.count]
+            lines += [f"{name:>12}: {value}" for name, value in sorted(self.counters.items())]
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from onnxTest import ImagePredictor
+    from datasetShards import list_images
+
+    parser = argparse.ArgumentParser(description='带埋点运行单张图像推理，输出各阶段耗时、Prometheus指标与慢请求调用栈')
+    parser.add_argument('images', help='图像目录')
+    parser.add_argument('--model', default='best-sim.onnx')
+    parser.add_argument('--session-profile', default=None, help='ONNX Runtime会话配置文件')
+    parser.add_argument('--results-dir', default=None, help='画好框的图像的保存目录')
+    parser.add_argument('--metrics', default=None, help='Prometheus文本格式指标的写入路径')
+    parser.add_argument('--push', default=None, help='Pushgateway地址')
+    parser.add_argument('--slowest', type=int, default=0, help='采样分析最慢的N个请求，0表示不启用')
+    parser.add_argument('--flamegraph', default='slowest.folded', help='慢请求调用栈（folded格式）的写入路径')
+    args = parser.parse_args()
+
+    metrics = Instrumentation(profile_slowest=args.slowest)
+    predictor = ImagePredictor(args.model, session_profile=args.session_profile, instrumentation=metrics)
+    if args.results_dir:
+        os.makedirs(args.results_dir, exist_ok=True)
+    for image_path in list_images(args.images):
+        save_path = os.path.join(args.results_dir, image_path.name) if args.results_dir else None
+        predictor.predict_single_image(str(image_path), save_path)
+
+    print(metrics.summary())
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    if args.push:
+        metrics.push_prometheus(args.push)
+    if metrics.profiler is not None:
+        metrics.profiler.write_folded(args.flamegraph)
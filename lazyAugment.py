@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from pathlib import Path
+import random
+
+import cv2
+import numpy as np
+
+from createAugmentedDataset import augment_image_and_labels, augmentation_list, derive_seed, read_label_file
+from datasetShards import exists, imread, list_images
+
+
+class LRUImageCache:
+    """
+    按数量限制的解码图像LRU缓存，capacity为0时不缓存。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def get(self, key):
+        image = self.items.get(key)
+        if image is not None:
+            self.items.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if self.capacity <= 0:
+            return
+        self.items[key] = image
+        self.items.move_to_end(key)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+
+class LazyAugmentedDataset:
+    """
+    按需增强的数据集：不把增强副本写到磁盘，取样时才对源图像应用augmentation_list中的增强策略。
+    样本下标按(源图像, 变体号)排列，变体0为原图，变体i对应第i种增强，与createAugmentedDataset.py
+    写出的 *_augmented_{i} 一一对应，每个epoch的有效样本数与磁盘副本相同。
+    """
+
+    def __init__(self, dataset_dir: Path, augmentations=None, split='train', cache_size=0, seed=None):
+        """
+        :param dataset_dir: YOLO结构的数据集目录（images/{split}, labels/{split}），也可以是打包后的分片
+        :param augmentations: 增强策略列表，默认使用createAugmentedDataset.augmentation_list
+        :param cache_size: 解码后源图像的LRU缓存数量
+        :param seed: 不为None时每个(源图像, 变体)的增强结果固定，与createAugmentedDataset同种子的输出一致
+        """
+        self.dataset_dir = Path(dataset_dir)
+        self.augmentations = augmentation_list if augmentations is None else augmentations
+        self.split = split
+        self.seed = seed
+        self.image_paths = list_images(self.dataset_dir / 'images' / split)
+        self.num_variants = 1 + len(self.augmentations)
+        self.cache = LRUImageCache(cache_size)
+
+    def __len__(self):
+        return len(self.image_paths) * self.num_variants
+
+    def index_of(self, source_index, variant):
+        return source_index * self.num_variants + variant
+
+    def locate(self, index):
+        """
+        样本下标 -> (源图像下标, 变体号)。
+        """
+        return divmod(index, self.num_variants)
+
+    def label_path(self, image_path: Path):
+        return self.dataset_dir / 'labels' / self.split / f"{image_path.stem}.txt"
+
+    def load_source(self, source_index):
+        """
+        读取源图像（RGB）及其标注，优先使用缓存。
+        :return: (image, boxes, class_labels)，boxes为YOLO归一化格式
+        """
+        image_path = self.image_paths[source_index]
+        cached = self.cache.get(image_path)
+        if cached is None:
+            image = imread(image_path)
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            label_path = self.label_path(image_path)
+            boxes = read_label_file(label_path) if exists(label_path) else []
+            cached = (image, [box[:4] for box in boxes], [int(box[4]) for box in boxes])
+            self.cache.put(image_path, cached)
+        return cached
+
+    def __getitem__(self, index):
+        """
+        :return: (image, boxes, class_labels)，image为RGB，boxes为YOLO归一化格式
+        """
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        source_index, variant = self.locate(index)
+        image, boxes, class_labels = self.load_source(source_index)
+        if variant == 0:
+            # 缓存中的源图像与标注会被之后的epoch复用，返回副本，调用方就地修改不会污染缓存
+            return image.copy(), [list(box) for box in boxes], list(class_labels)
+        if self.seed is not None:
+            # 与createAugmentedDataset.augment_one相同的种子派生方式
+            augmentation_seed = derive_seed(self.seed, self.image_paths[source_index].name, variant)
+            random.seed(augmentation_seed)
+            np.random.seed(augmentation_seed)
+        return augment_image_and_labels(image, boxes, class_labels, self.augmentations[variant - 1])
+
+
+def install_yolov5_lazy_augmentation(augmentations=None, cache_size=0):
+    """
+    替换YOLOv5数据加载中的LoadImagesAndLabels：训练集（augment=True）的每张源图像扩展为
+    1 + len(augmentations)个样本，在load_image时才生成增强版本并同步更新该样本的标注。
+    验证集不受影响。需要在调用yolov5.train.run之前执行。
+    """
+    from yolov5.utils import dataloaders
+
+    augmentations = augmentation_list if augmentations is None else augmentations
+    base = dataloaders.LoadImagesAndLabels
+    if getattr(base, 'lazy_augmented', False):
+        return
+
+    class LazyAugmentedLoadImagesAndLabels(base):
+        lazy_augmented = True
+
+        def __init__(self, path, img_size=640, batch_size=16, augment=False, *args, **kwargs):
+            if augment:
+                # 增强副本不进RAM缓存，改由源图像LRU缓存
+                kwargs['cache_images'] = False
+            super().__init__(path, img_size, batch_size, augment, *args, **kwargs)
+            self.num_variants = 1 + len(augmentations) if augment else 1
+            if self.num_variants == 1:
+                return
+
+            self.source_cache = LRUImageCache(cache_size)
+            self.source_labels = [labels.copy() for labels in self.labels]
+            v = self.num_variants
+            self.im_files = [f for f in self.im_files for _ in range(v)]
+            self.label_files = [f for f in self.label_files for _ in range(v)]
+            self.labels = [labels.copy() for labels in self.source_labels for _ in range(v)]
+            self.segments = [segments for segments in self.segments for _ in range(v)]
+            self.shapes = np.repeat(self.shapes, v, axis=0)
+            self.n = len(self.im_files)
+            self.indices = np.arange(self.n)
+            self.batch = np.floor(np.arange(self.n) / batch_size).astype(int)
+            self.nb = self.batch[-1] + 1
+            self.ims, self.im_hw0, self.im_hw = [None] * self.n, [None] * self.n, [None] * self.n
+            self.npy_files = [Path(f).with_suffix('.npy') for f in self.im_files]
+
+        def load_image(self, i):
+            if self.num_variants == 1:
+                return super().load_image(i)
+            source_index, variant = divmod(i, self.num_variants)
+            image = self.source_cache.get(source_index)
+            if image is None:
+                image = cv2.imread(self.im_files[i])  # BGR
+                assert image is not None, f'Image Not Found {self.im_files[i]}'
+                self.source_cache.put(source_index, image)
+
+            if variant > 0:
+                labels = self.source_labels[source_index]
+                rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                rgb, boxes, class_labels = augment_image_and_labels(
+                    rgb, labels[:, 1:5].tolist(), labels[:, 0].astype(int).tolist(), augmentations[variant - 1])
+                image = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+                # __getitem__/load_mosaic在load_image之后读取self.labels[i]，这里写入增强后的标注
+                self.labels[i] = np.array([[c, *box] for c, box in zip(class_labels, boxes)],
+                                          dtype=np.float32).reshape(-1, 5)
+                self.segments[i] = []
+
+            h0, w0 = image.shape[:2]
+            r = self.img_size / max(h0, w0)
+            if variant == 0 and r == 1:
+                # 后续的letterbox、HSV增强会就地修改图像，不能直接交出缓存中的源图像
+                image = image.copy()
+            elif r != 1:
+                interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+                image = cv2.resize(image, (int(w0 * r), int(h0 * r)), interpolation=interp)
+            return image, (h0, w0), image.shape[:2]
+
+    dataloaders.LoadImagesAndLabels = LazyAugmentedLoadImagesAndLabels
@@ -0,0 +1,148 @@
+import time
+
+# 尽早记录时间，--timing 据此区分解释器启动与各阶段耗时
+_CLI_START = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import sys
+
+# 子命令 -> (实现模块, 说明)。模块只在执行对应子命令时导入，其他子命令的依赖不会被加载
+COMMANDS = {
+    'convert': ('data_preprocess', '把VOC XML标注批量转换为YOLO格式'),
+    'split': ('createDataSet', '分层划分原始数据集，生成副本数据集'),
+    'augment': ('createAugmentedDataset', '对训练集做离线增强，生成增强后的数据集'),
+    'check': ('checkDataSet', '把标注画到图像上并生成缩略图拼图'),
+    'predict': (None, '用ONNX Runtime或ultralytics推理图像'),
+    'eval': ('evaluate', '计算mAP、PR曲线与混淆矩阵'),
+    'bench': ('benchmark', '推理与数据集构建热点路径的基准测试'),
+    'ingest': ('asyncIngest', '从URL清单异步下载图像并批量推理'),
+}
+BACKENDS = {'onnx': 'onnxTest', 'ultralytics': 'temp'}
+# --timing 报告中检查是否被导入的重量级模块
+HEAVY_MODULES = ('torch', 'ultralytics', 'onnxruntime', 'albumentations', 'cv2', 'matplotlib', 'comet_ml', 'tkinter')
+
+
+def interpreter_seconds():
+    """
+    进程启动到本模块开始执行的耗时（解释器启动与site初始化），只在Linux上可用，精度为一个时钟节拍。
+    """
+    try:
+        with open('/proc/self/stat', 'r') as file:
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    age = uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    return max(0.0, age - (time.perf_counter() - _CLI_START))
+
+
+def predict_parser():
+    parser = argparse.ArgumentParser(prog='manhole predict', description=COMMANDS['predict'][1])
+    parser.add_argument('source', help='图像文件或图像目录，也可以是分片中的图像目录')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='onnx',
+                        help='onnx只依赖onnxruntime；ultralytics需要torch')
+    parser.add_argument('--model', default=None, help='默认onnx为best-sim.onnx，ultralytics为best.pt')
+    parser.add_argument('--conf', type=float, default=None, help='置信度阈值，默认onnx为0.25，ultralytics为0.35')
+    parser.add_argument('--iou', type=float, default=None, help='NMS的IoU阈值，默认onnx为0.45，ultralytics为0.5')
+    parser.add_argument('--batch-size', type=int, default=8, help='onnx后端的批量大小')
+    parser.add_argument('--session-profile', default=None, help='onnx后端的ONNX Runtime会话配置文件')
+    parser.add_argument('--variant', default=None, help='onnx后端的模型变体，如 int8-static')
+    parser.add_argument('--cache', default=None, help='预测缓存（SQLite）路径，修改阈值后重新运行时不再推理')
+    parser.add_argument('--output-dir', default=None, help='画好框的图像的保存目录，ultralytics后端默认test_results')
+    parser.add_argument('--results-txt', default='results.txt', help='检测结果文件，格式与temp.py相同')
+    return parser
+
+
+def run_onnx(backend, args, cache):
+    from datasetShards import list_images
+
+    image_paths = [args.source] if os.path.isfile(args.source) else [str(p) for p in list_images(args.source)]
+    predictor = backend.ImagePredictor(args.model or 'best-sim.onnx',
+                                       conf_threshold=0.25 if args.conf is None else args.conf,
+                                       nms_threshold=0.45 if args.iou is None else args.iou,
+                                       session_profile=args.session_profile, variant=args.variant,
+                                       prediction_cache=cache)
+    predictions = predictor.predict_batch(image_paths, batch_size=args.batch_size, results_dir=args.output_dir)
+    with open(args.results_txt, 'w') as file:
+        for image_path, (boxes, class_ids, confidences) in zip(image_paths, predictions):
+            file_name = os.path.basename(image_path)
+            file.writelines(f"{file_name}\t{class_id}\t{confidence}\t{' '.join(map(str, box))}\n"
+                            for box, class_id, confidence in zip(boxes, class_ids, confidences))
+    print(f"{len(image_paths)} 张图像，{sum(len(p[0]) for p in predictions)} 个目标，结果写入 {args.results_txt}")
+
+
+def run_ultralytics(backend, args, cache):
+    result_dir = args.output_dir or 'test_results'
+    os.makedirs(result_dir, exist_ok=True)
+    if os.path.exists(args.results_txt):
+        os.remove(args.results_txt)
+    results = backend.model_run(args.model or 'best.pt', args.source, conf=0.35 if args.conf is None else args.conf,
+                                iou=0.5 if args.iou is None else args.iou, stream=True, cache=cache)
+    backend.save_results_streaming(results, args.results_txt, result_dir)
+
+
+def load_command(command, argv):
+    """
+    导入子命令的实现模块，返回执行子命令的无参函数。导入耗时计入--timing的import阶段。
+    """
+    module_name = COMMANDS[command][0]
+    if module_name is not None:
+        module = importlib.import_module(module_name)
+        return lambda: module.main(argv)
+
+    args = predict_parser().parse_args(argv)
+    backend = importlib.import_module(BACKENDS[args.backend])
+    cache = None
+    if args.cache:
+        from predictionCache import PredictionCache
+        cache = PredictionCache(args.cache)
+    run = run_onnx if args.backend == 'onnx' else run_ultralytics
+    return lambda: run(backend, args, cache)
+
+
+def format_timing(phases, modules_before):
+    lines = ['启动与运行耗时:']
+    lines += [f"  {name:>12}: {seconds * 1000:9.1f} ms" for name, seconds in phases if seconds is not None]
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    lines.append(f"  {'modules':>12}: 子命令导入了 {len(sys.modules) - modules_before} 个模块，"
+                 f"重量级模块: {', '.join(loaded) or '无'}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(prog='manhole', description='井盖检测的数据集构建、推理、评估与基准测试',
+                                     epilog='\n'.join(f'  {name:<8} {help_text}'
+                                                      for name, (_, help_text) in COMMANDS.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timing', action='store_true', help='在标准错误输出中报告启动与各阶段耗时')
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help='子命令，见下方列表')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='传给子命令的参数，子命令加 -h 查看')
+    args = parser.parse_args(argv)
+    # --timing 写在子命令参数中也生效
+    timing = args.timing or '--timing' in args.args
+    command_argv = [arg for arg in args.args if arg != '--timing']
+
+    interpreter = interpreter_seconds()
+    modules_before = len(sys.modules)
+    # 子命令模块中的argparse以 "manhole 子命令" 作为程序名
+    sys.argv = [f'manhole {args.command}'] + command_argv
+    phases = [('interpreter', interpreter), ('cli', time.perf_counter() - _CLI_START)]
+    phase, start = 'import', time.perf_counter()
+    try:
+        run = load_command(args.command, command_argv)
+        phases.append((phase, time.perf_counter() - start))
+        phase, start = 'run', time.perf_counter()
+        run()
+    finally:
+        if timing:
+            phases.append((phase, time.perf_counter() - start))
+            phases.append(('total', time.perf_counter() - _CLI_START + (interpreter or 0.0)))
+            print(format_timing(phases, modules_before), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import platform
+from pathlib import Path
+
+import onnxruntime as ort
+import yaml
+
+from fileHash import file_hash
+
+# 图优化级别与执行模式的配置名称
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def variants_manifest_path(model_path):
+    """
+    模型变体清单的路径：与原始模型同目录的 <模型名>.variants.json。
+    """
+    model_path = Path(model_path)
+    return model_path.with_name(f"{model_path.stem}.variants.json")
+
+
+def resolve_model_variant(model_path, variant):
+    """
+    根据quantizeModel.py生成的清单，把原始模型路径解析为指定变体（如 int8-static）的模型文件。
+    """
+    manifest_path = variants_manifest_path(model_path)
+    if not manifest_path.exists():
+        raise FileNotFoundError(f'找不到模型变体清单: {manifest_path}')
+    with open(manifest_path, 'r') as file:
+        variants = json.load(file)['variants']
+    if variant not in variants:
+        raise KeyError(f"模型变体 {variant} 不存在，可选: {', '.join(variants)}")
+    return manifest_path.parent / variants[variant]['path']
+
+
+def load_session_profile(profile_path):
+    """
+    读取会话配置文件，按后缀区分YAML与JSON，返回可直接传给create_session的参数字典。
+    """
+    with open(profile_path, 'r') as file:
+        if Path(profile_path).suffix.lower() == '.json':
+            profile = json.load(file)
+        else:
+            profile = yaml.safe_load(file)
+    return profile or {}
+
+
+def optimized_model_path(model_path, cache_dir, level):
+    """
+    优化后模型的缓存路径，由模型内容、优化级别、onnxruntime版本与CPU架构共同决定，
+    任何一项变化都会生成新的缓存文件。
+    """
+    key = f"{file_hash(model_path)}-{level}-{ort.__version__}-{platform.machine()}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{Path(model_path).stem}.{digest}.opt.onnx"
+
+
+def create_session(model_path, intra_op_num_threads=0, inter_op_num_threads=0, graph_optimization_level='all',
+                   execution_mode='sequential', enable_cpu_mem_arena=True, enable_mem_pattern=True,
+                   intra_op_spinning=True, optimized_model_dir=None, providers=None):
+    """
+    按给定参数创建onnxruntime推理会话。
+    :param model_path: ONNX模型路径
+    :param intra_op_num_threads: 单个算子内部的线程数，0表示由onnxruntime按核数决定
+    :param inter_op_num_threads: 并行执行模式下算子之间的线程数，0表示默认
+    :param graph_optimization_level: 'disable' / 'basic' / 'extended' / 'all'
+    :param execution_mode: 'sequential' / 'parallel'
+    :param enable_cpu_mem_arena: 是否启用CPU内存池
+    :param enable_mem_pattern: 是否按首次运行的内存模式预分配
+    :param intra_op_spinning: 线程空闲时是否自旋等待；同一主机运行多个预测器时关闭可避免空转抢占CPU
+    :param optimized_model_dir: 优化后模型的缓存目录；命中缓存时直接加载并跳过图优化
+    :param providers: 执行提供者列表，默认只用CPU
+    :return: ort.InferenceSession
+    """
+    if graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f'未知的图优化级别: {graph_optimization_level}')
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f'未知的执行模式: {execution_mode}')
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    options.execution_mode = EXECUTION_MODES[execution_mode]
+    options.enable_cpu_mem_arena = enable_cpu_mem_arena
+    options.enable_mem_pattern = enable_mem_pattern
+    options.add_session_config_entry('session.intra_op.allow_spinning', '1' if intra_op_spinning else '0')
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level]
+
+    load_path = model_path
+    cache_path = temp_path = None
+    if optimized_model_dir and graph_optimization_level != 'disable':
+        cache_path = optimized_model_path(model_path, optimized_model_dir, graph_optimization_level)
+        if cache_path.exists():
+            # 缓存的模型已经优化过，关闭图优化直接加载
+            load_path = cache_path
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            # 先写临时文件再改名，多个进程同时启动时不会读到写了一半的缓存
+            os.makedirs(optimized_model_dir, exist_ok=True)
+            temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            options.optimized_model_filepath = str(temp_path)
+
+    session = ort.InferenceSession(str(load_path), sess_options=options,
+                                   providers=providers or ['CPUExecutionProvider'])
+    if temp_path is not None and temp_path.exists():
+        os.replace(temp_path, cache_path)
+    return session
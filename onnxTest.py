@@ -1,135 +1,725 @@
 import cv2
 import os
+import queue
+import threading
+import time
 import numpy as np
-import onnxruntime as ort
+from collections import namedtuple
 from pathlib import Path
+from datasetShards import imread, list_images
+from instrumentation import NULL_INSTRUMENTATION
+from predictionCache import DEFAULT_FLOOR, PredictionCache, to_candidates
+from onnxSession import create_session, load_session_profile, resolve_model_variant
 
 
 # 可视化ONNX模型
 # netron.start("best-sim.onnx")
 
 
+# letterbox的缩放比例、左/上填充量以及原始图像宽高，用于把检测框映射回原图坐标
+LetterboxInfo = namedtuple('LetterboxInfo', ['ratio', 'pad_x', 'pad_y', 'width', 'height'])
+
+# YOLOv5 letterbox的填充灰度值114，归一化后的值
+PAD_VALUE = np.float32(114) / np.float32(255)
+
+
+def letterbox_into(image, out, scratch):
+    """
+    与YOLOv5训练一致的letterbox预处理：等比例缩放后居中填充灰边。
+    BGR转RGB、HWC转CHW与归一化在一次写入中完成，结果直接写进out，不产生中间数组。
+    :param image: cv2读取的BGR原始图像
+    :param out: 形状为(3, H, W)的float32数组，H与W即模型输入尺寸
+    :param scratch: 存放复用缩放缓冲区的对象（通常是threading.local），各线程需各自一个
+    :return: LetterboxInfo
+    """
+    size = out.shape[1]
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_x = int(round((size - new_width) / 2 - 0.1))
+    pad_y = int(round((size - new_height) / 2 - 0.1))
+
+    if (new_width, new_height) != (width, height):
+        # 缩放结果写入复用的缓冲区，图像尺寸不变时不再重新分配
+        resized = getattr(scratch, 'resized', None)
+        if resized is None or resized.shape[:2] != (new_height, new_width):
+            resized = np.empty((new_height, new_width, 3), dtype=np.uint8)
+            scratch.resized = resized
+        image = cv2.resize(image, (new_width, new_height), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+    # 四周的填充区域
+    out[:, :pad_y, :] = PAD_VALUE
+    out[:, pad_y + new_height:, :] = PAD_VALUE
+    out[:, pad_y:pad_y + new_height, :pad_x] = PAD_VALUE
+    out[:, pad_y:pad_y + new_height, pad_x + new_width:] = PAD_VALUE
+    # 通道逆序(BGR->RGB)与转置都是视图，除法结果直接写入目标区域
+    np.divide(image[:, :, ::-1].transpose(2, 0, 1), np.float32(255),
+              out=out[:, pad_y:pad_y + new_height, pad_x:pad_x + new_width], dtype=np.float32)
+    return LetterboxInfo(ratio, pad_x, pad_y, width, height)
+
+
+def tile_origins(length, tile_size, overlap):
+    """
+    一个方向上各切片的起点：步长为tile_size*(1-overlap)，最后一片与图像边缘对齐。
+    """
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+
+class StageStats:
+    """
+    流水线中单个阶段的统计：处理数量与各工作线程累计的忙碌时间。
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count, seconds):
+        with self._lock:
+            self.count += count
+            self.busy += seconds
+
+    def throughput(self):
+        # 按并行线程数折算的阶段吞吐量（张/秒）
+        return self.count * self.workers / self.busy if self.busy > 0 else float('inf')
+
+    def __str__(self):
+        return (f"{self.name}: {self.count} 张, 忙碌 {self.busy:.2f}s, "
+                f"{self.workers} 线程, 吞吐 {self.throughput():.1f} 张/秒")
+
+
 class ImagePredictor:
-    def __init__(self, model_path, input_size=640, conf_threshold=0.25, nms_threshold=0.45):
+    # 未启用埋点时各阶段计时与计数都是空操作
+    metrics = NULL_INSTRUMENTATION
+
+    def __init__(self, model_path, input_size=640, conf_threshold=0.25, nms_threshold=0.45, agnostic_nms=False,
+                 session_profile=None, io_binding=True, variant=None, instrumentation=None, prediction_cache=None,
+                 cache_floor=DEFAULT_FLOOR, **session_options):
+        """
+        :param session_profile: YAML/JSON会话配置文件路径，内容为create_session的参数
+        :param io_binding: 是否用IO binding把输入输出绑定到预分配的缓冲区
+        :param variant: 模型变体名称（如 int8-dynamic、int8-static），按quantizeModel.py生成的清单加载对应文件
+        :param instrumentation: instrumentation.Instrumentation，记录各阶段耗时与计数；None时不记录
+        :param prediction_cache: predictionCache.PredictionCache或缓存文件路径。predict_batch、predict_single_image
+                                 与predict_pipelined按图像内容从缓存取NMS之前的候选框，只修改阈值时不再重新推理；
+                                 缓存的是整图推理的结果，predict_tiled不使用缓存
+        :param cache_floor: 写入缓存的候选框的置信度下限；conf_threshold低于它时不使用缓存
+        :param session_options: create_session的参数（线程数、图优化级别等），覆盖配置文件中的同名项
+        """
+        if variant is not None:
+            model_path = str(resolve_model_variant(model_path, variant))
         self.model_path = model_path
+        self.variant = variant
         self.input_size = input_size
         self.conf_threshold = conf_threshold
         self.nms_threshold = nms_threshold
+        self.agnostic_nms = agnostic_nms  # True时不区分类别做NMS
         self.class_names = ['good', 'broke', 'lose', 'uncovered', 'circle']
-        self.ort_session = ort.InferenceSession(model_path)
+        options = load_session_profile(session_profile) if session_profile else {}
+        options.update(session_options)
+        self.ort_session = create_session(model_path, **options)
         self.input_name = self.ort_session.get_inputs()[0].name
         self.output_name = self.ort_session.get_outputs()[0].name
+        # 导出时固定了批量维度则为该整数，动态批量维度（字符串或None）则为None
+        batch_dim = self.ort_session.get_inputs()[0].shape[0]
+        self.fixed_batch_size = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+        # 每张图像的输出行数（候选框数），动态维度时在第一次解码时确定
+        output_rows = self.ort_session.get_outputs()[0].shape[1]
+        self.output_rows = output_rows if isinstance(output_rows, int) and output_rows > 0 else None
+        # 按批量大小缓存的输入张量，以及每个线程各自的缩放缓冲区，稳态下预处理不再分配内存
+        self._batch_buffers = {}
+        self._local = threading.local()
+        # IO binding：按批量大小缓存输出缓冲区，输入缓冲区地址不变时不重复绑定
+        self.io_binding = self.ort_session.io_binding() if io_binding else None
+        self._output_buffers = {}
+        self._bound_input = None
+        self.metrics = instrumentation or NULL_INSTRUMENTATION
+        if isinstance(prediction_cache, (str, os.PathLike)):
+            prediction_cache = PredictionCache(prediction_cache)
+        self.prediction_cache = prediction_cache
+        self.cache_floor = cache_floor
+        if prediction_cache is not None:
+            self.cache_namespace = prediction_cache.namespace(model_path, 'model-input', input_size=input_size,
+                                                              preprocess='letterbox-114', floor=cache_floor)
 
-    def preprocess(self, img_path):
-        # 使用相同的预处理方法，YOLOv5在训练时使用的
-        image = cv2.imread(img_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = cv2.resize(image, (self.input_size, self.input_size))
-        image = image.astype(np.float32) / 255.0  # 归一化到[0,1]
-        image = np.transpose(image, (2, 0, 1))  # 调整通道顺序为CHW
-        image = np.expand_dims(image, axis=0)  # 添加批量维度BCHW
+    @staticmethod
+    def load_image(img_path):
+        # 图像路径也可以指向打包后的分片（分片路径/images/划分/文件名）
+        image = imread(img_path)
+        if image is None:
+            raise FileNotFoundError(f'无法读取图像: {img_path}')
         return image
 
+    def batch_buffer(self, batch_size):
+        """
+        返回复用的(batch_size, 3, H, W)输入张量。同一批量大小的调用共用同一块内存。
+        """
+        buffer = self._batch_buffers.get(batch_size)
+        if buffer is None:
+            buffer = np.empty((batch_size, 3, self.input_size, self.input_size), dtype=np.float32)
+            self._batch_buffers[batch_size] = buffer
+        return buffer
+
+    def preprocess_image(self, image, out=None):
+        """
+        letterbox预处理，结果直接写进out。
+        :param image: cv2读取的BGR原始图像
+        :param out: 形状为(3, H, W)的float32数组；为None时写入复用的单张输入张量
+        :return: (写好的out, LetterboxInfo)
+        """
+        if out is None:
+            out = self.batch_buffer(1)[0]
+        return out, letterbox_into(image, out, self._local)
+
+    def preprocess(self, img_path):
+        image = self.load_image(img_path)
+        tensor, info = self.preprocess_image(image)
+        return tensor[None], info  # 添加批量维度BCHW
+
     def predict(self, image):
-        outputs = self.ort_session.run([self.output_name], {self.input_name: image})
-        return outputs[0]
-
-    def postprocess(self, outputs):
-        batch_results = []
-        for output in outputs:
-            boxes = []
-            confidences = []
-            class_ids = []
-
-            for detection in output[0]:
-                objectness_score = detection[4]  # 对象存在概率
-                scores = detection[5:]  # 类别得分
-                class_id = np.argmax(scores)
-                confidence = scores[class_id] * objectness_score
-
-                if confidence > self.conf_threshold:
-                    center_x, center_y, width, height = detection[0:4]
-                    x_min = int(center_x - (width / 2))
-                    y_min = int(center_y - (height / 2))
-                    x_max = int(center_x + (width / 2))
-                    y_max = int(center_y + (height / 2))
-
-                    boxes.append([x_min, y_min, x_max, y_max])
-                    confidences.append(float(confidence))
-                    class_ids.append(class_id)
-
-            indices = cv2.dnn.NMSBoxes(boxes, confidences, self.conf_threshold, self.nms_threshold)
-
-            # 根据返回的indices类型来适当处理
-            if len(indices) == 0:
-                final_indices = []  # 没有边界框被选中
-            else:
-                if isinstance(indices, np.ndarray):
-                    final_indices = indices.flatten().tolist()  # 转换为Python列表
-                elif isinstance(indices[0], tuple):
-                    final_indices = [i[0] for i in indices]  # 解包元组
-                else:
-                    final_indices = indices  # 直接使用indices
+        """
+        运行一次推理。启用IO binding时返回的是复用的输出缓冲区，下一次调用前需要用完。
+        """
+        if self.io_binding is None:
+            outputs = self.ort_session.run([self.output_name], {self.input_name: image})
+            return outputs[0]
 
-            final_boxes = [boxes[i] for i in final_indices]
-            final_class_ids = [class_ids[i] for i in final_indices]
-            final_confidences = [confidences[i] for i in final_indices]
-            batch_results.append((final_boxes, final_class_ids, final_confidences))
+        image = np.ascontiguousarray(image)
+        output = self._output_buffers.get(image.shape[0])
+        if output is None:
+            # 输出形状可能是动态的，首次遇到该批量大小时正常运行一次以确定形状
+            output = self.ort_session.run([self.output_name], {self.input_name: image})[0]
+            self._output_buffers[image.shape[0]] = output
+            self._bound_input = None
+            return output
 
-        return batch_results
+        input_key = (image.ctypes.data, image.shape)
+        if input_key != self._bound_input:
+            self.io_binding.bind_cpu_input(self.input_name, image)
+            self.io_binding.bind_output(self.output_name, 'cpu', 0, output.dtype, output.shape,
+                                        output.ctypes.data)
+            self._bound_input = input_key
+        self.ort_session.run_with_iobinding(self.io_binding)
+        return output
 
-    def draw_boxes_and_save(self, img_path, predictions, save_path):
-        # 加载原始图像
-        image = cv2.imread(img_path)
+    def predict_padded(self, batch, count):
+        """
+        推理批次张量中的前count张图像。
+        固定批量维度的模型必须喂满，不足一批时用0补齐，补齐部分的输出丢弃。
+        """
+        if self.fixed_batch_size is not None:
+            batch[count:] = 0
+            return self.predict(batch)[:count]
+        return self.predict(batch[:count])
 
-        orig_height, orig_width = image.shape[:2]  # 使用cv2.imread加载的原始图像尺寸
-        model_height, model_width = self.input_size, self.input_size
+    def decode(self, output, conf_threshold=None):
+        """
+        向量化解码单张图像的YOLOv5输出，整表计算 对象概率×类别得分 并按置信度阈值筛选。
+        :param output: 形状为(N, 5 + 类别数)的输出，每行为 cx, cy, w, h, obj, cls...
+        :param conf_threshold: 筛选用的置信度阈值，默认为self.conf_threshold
+        :return: 候选框boxes(N', 4, xyxy, float32)、class_ids(N',)、confidences(N', float32)
+        """
+        conf_threshold = self.conf_threshold if conf_threshold is None else conf_threshold
+        if self.output_rows is None:
+            self.output_rows = len(output)
+        # 类别得分经过sigmoid不超过1，置信度不会大于对象概率，先按对象概率粗筛
+        output = output[output[:, 4] > conf_threshold]
+        scores = output[:, 5:]
+        confidences = scores.max(axis=1) * output[:, 4]
+        mask = confidences > conf_threshold
 
-        # 计算缩放因子
-        scale_x = orig_width / model_width
-        scale_y = orig_height / model_height
+        detections = output[mask]
+        class_ids = np.argmax(detections[:, 5:], axis=1)
+        confidences = confidences[mask]
 
-        final_boxes, final_class_ids, final_confidences = predictions[0]
+        # xywh -> xyxy，保留小数，取整留到映射回原图之后
+        half_wh = detections[:, 2:4] / 2
+        boxes = np.empty((len(detections), 4), dtype=np.float32)
+        boxes[:, 0:2] = detections[:, 0:2] - half_wh
+        boxes[:, 2:4] = detections[:, 0:2] + half_wh
+        return boxes, class_ids, confidences
 
-        # 对final_boxes中的每个边界框坐标进行反缩放
-        scaled_final_boxes = []
-        for box in final_boxes:
-            x_min, y_min, x_max, y_max = box
-            x_min = int(x_min * scale_x)
-            y_min = int(y_min * scale_y)
-            x_max = int(x_max * scale_x)
-            y_max = int(y_max * scale_y)
-            scaled_final_boxes.append([x_min, y_min, x_max, y_max])
-
-        # 使用反缩放后的边界框进行绘制
-        for box, class_id, confidence in zip(scaled_final_boxes, final_class_ids, final_confidences):
+    def nms(self, boxes, class_ids, confidences):
+        """
+        对候选框做非极大值抑制，默认按类别分别抑制（class-aware），返回保留下来的下标。
+        """
+        if len(boxes) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # cv2.dnn的NMS要求(x, y, w, h)格式的矩形
+        rects = boxes.copy()
+        rects[:, 2:4] -= boxes[:, 0:2]
+        if self.agnostic_nms:
+            indices = cv2.dnn.NMSBoxes(rects, confidences, self.conf_threshold, self.nms_threshold)
+        else:
+            indices = cv2.dnn.NMSBoxesBatched(rects, confidences, class_ids,
+                                              self.conf_threshold, self.nms_threshold)
+        # 不同OpenCV版本可能返回空元组、一维或(N, 1)数组
+        return np.asarray(indices, dtype=np.int64).reshape(-1)
+
+    @staticmethod
+    def scale_boxes(boxes, info):
+        """
+        把模型输入尺寸下的xyxy框按letterbox参数映射回原图坐标，并裁剪到图像范围内。
+        """
+        boxes = boxes.copy()
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - info.pad_x) / info.ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - info.pad_y) / info.ratio
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, info.width)
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, info.height)
+        return boxes
+
+    def postprocess(self, outputs, infos=None):
+        """
+        解码一个批次的模型输出。
+        :param outputs: 形状为(B, N, 5 + 类别数)的输出
+        :param infos: 每张图像预处理时的LetterboxInfo；给出时框坐标映射回原图，否则保留模型输入尺寸下的坐标
+        :return: 每张图像一个(boxes, class_ids, confidences)元组组成的列表，boxes为整数xyxy
+        """
+        return [self.select(*self.decode(output), infos[i] if infos is not None else None)
+                for i, output in enumerate(outputs)]
+
+    def select(self, boxes, class_ids, confidences, info=None):
+        """
+        对解码出的候选框按当前置信度阈值筛选并做NMS，给出info时映射回原图坐标。
+        低置信度丢弃的行数按conf_threshold相对模型输出的全部行计数，与候选框是否来自缓存（按cache_floor解码）无关。
+        """
+        mask = confidences > self.conf_threshold
+        self.count_dropped_rows(int(mask.sum()))
+        if not mask.all():
+            boxes, class_ids, confidences = boxes[mask], class_ids[mask], confidences[mask]
+        keep = self.nms(boxes, class_ids, confidences)
+        boxes = boxes[keep]
+        if info is not None:
+            boxes = self.scale_boxes(boxes, info)
+
+        self.metrics.count('detections', len(keep))
+        return boxes.astype(np.int32).tolist(), class_ids[keep].tolist(), confidences[keep].tolist()
+
+    def count_dropped_rows(self, kept):
+        # kept为一张图像中置信度高于conf_threshold的行数；输出行数未知（动态维度且尚未推理）时不计数
+        if self.metrics.enabled and self.output_rows is not None:
+            self.metrics.count('low_confidence_rows_dropped', self.output_rows - kept)
+
+    def predict_cached(self, img_paths, batch):
+        """
+        通过预测缓存推理一组图像：命中的图像不解码也不推理，只按当前阈值重做后处理；
+        未命中的图像推理后把置信度高于cache_floor的候选框写入缓存。
+        :param batch: 批次张量，批量大小不小于len(img_paths)
+        :return: (预测列表, 本次解码的原始图像列表，命中的位置为None)
+        """
+        keys = [self.prediction_cache.image_key(self.cache_namespace, img_path) for img_path in img_paths]
+        cached = self.prediction_cache.get_many(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        self.metrics.count('cache_hits', len(keys) - len(misses))
+        self.metrics.count('cache_misses', len(misses))
+
+        images = [None] * len(img_paths)
+        if misses:
+            with self.metrics.stage('image_decode'):
+                for i in misses:
+                    images[i] = self.load_image(img_paths[i])
+            with self.metrics.stage('preprocess'):
+                infos = [self.preprocess_image(images[i], out=batch[j])[1] for j, i in enumerate(misses)]
+            with self.metrics.stage('inference'):
+                outputs = self.predict_padded(batch, len(misses))
+            cached.update(self.store_candidates([keys[i] for i in misses], outputs, infos))
+
+        with self.metrics.stage('postprocess'):
+            predictions = [self.select_cached(cached[key]) for key in keys]
+        return predictions, images
+
+    @property
+    def cache_enabled(self):
+        # 阈值低于缓存下限时缓存中的候选框不完整，不能使用缓存
+        return self.prediction_cache is not None and self.conf_threshold >= self.cache_floor
+
+    def store_candidates(self, keys, outputs, infos):
+        """
+        把一批模型输出中置信度高于cache_floor的候选框写入缓存。
+        :return: 键 -> (候选框数组, 元数据)，与PredictionCache.get_many的返回值格式相同
+        """
+        entries = [(key, to_candidates(*self.decode(output, self.cache_floor)), list(info))
+                   for key, output, info in zip(keys, outputs, infos)]
+        self.prediction_cache.put_many(entries)
+        return {key: (candidates, meta) for key, candidates, meta in entries}
+
+    def select_cached(self, entry):
+        candidates, info = entry
+        return self.select(candidates['box'], candidates['class_id'], candidates['confidence'], LetterboxInfo(*info))
+
+    def merge_tile_boxes(self, boxes, class_ids, confidences, ios_threshold=0.5):
+        """
+        合并被切片边缘截断的框：同类别（agnostic时不区分类别）且交集占较小框面积超过ios_threshold的框，
+        并入置信度更高的框，坐标取两者外接矩形。被截断的半个框与完整框IoU很低，普通NMS去不掉。
+        """
+        if len(boxes) < 2:
+            return boxes, class_ids, confidences
+        order = np.argsort(-confidences, kind='stable')
+        boxes, class_ids, confidences = boxes[order], class_ids[order], confidences[order]
+        lt = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+        rb = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+        inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+        area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+        overlaps = inter / (np.minimum(area[:, None], area[None, :]) + 1e-9) > ios_threshold
+        if not self.agnostic_nms:
+            overlaps &= class_ids[:, None] == class_ids[None, :]
+        overlaps = np.triu(overlaps, k=1)
+
+        absorbed = np.zeros(len(boxes), dtype=bool)
+        keep = []
+        merged = boxes.copy()
+        for i in range(len(boxes)):
+            if absorbed[i]:
+                continue
+            group = overlaps[i] & ~absorbed
+            if group.any():
+                merged[i, :2] = np.minimum(boxes[i, :2], boxes[group, :2].min(axis=0))
+                merged[i, 2:] = np.maximum(boxes[i, 2:], boxes[group, 2:].max(axis=0))
+                absorbed |= group
+            keep.append(i)
+        return merged[keep], class_ids[keep], confidences[keep]
+
+    def predict_tiled(self, image, tile_size=None, overlap=0.2, include_full=True, batch_size=None, timings=None):
+        """
+        切片推理：把原图切成相互重叠的tile_size方块，连同整图缩放版本一起作为一个批次推理，
+        检测框映射回原图坐标后做全局NMS，并合并跨切片边缘的框。
+        切片是原图上的NumPy视图，预处理直接从视图写入批次张量，不复制像素。不使用预测缓存。
+        :param image: cv2读取的BGR原始图像
+        :param tile_size: 切片边长，默认等于模型输入尺寸（切片不需要缩放）
+        :param overlap: 相邻切片的重叠比例
+        :param include_full: 是否同时推理整图缩放版本，保证大目标不被切碎
+        :param batch_size: 每次推理的切片数，默认全部切片一次推理；模型导出时固定了批量维度则以模型为准
+        :param timings: 不为None时把各阶段耗时（秒）累加到这个字典
+        :return: (boxes, class_ids, confidences)，boxes为原图坐标的整数xyxy
+        """
+        tile_size = tile_size or self.input_size
+        timings = {} if timings is None else timings
+
+        def record(stage, start):
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+        start = time.perf_counter()
+        height, width = image.shape[:2]
+        views = [((x, y), image[y:y + tile_size, x:x + tile_size])
+                 for y in tile_origins(height, tile_size, overlap) for x in tile_origins(width, tile_size, overlap)]
+        if include_full and len(views) > 1:
+            views.append(((0, 0), image))
+        if self.fixed_batch_size is not None:
+            batch_size = self.fixed_batch_size
+        batch_size = batch_size or len(views)
+        record('tile', start)
+
+        batch = self.batch_buffer(batch_size)
+        all_boxes, all_class_ids, all_confidences = [], [], []
+        for chunk_start in range(0, len(views), batch_size):
+            chunk = views[chunk_start:chunk_start + batch_size]
+            start = time.perf_counter()
+            infos = [self.preprocess_image(view, out=batch[i])[1] for i, (_, view) in enumerate(chunk)]
+            record('preprocess', start)
+
+            start = time.perf_counter()
+            outputs = self.predict_padded(batch, len(chunk))
+            record('inference', start)
+
+            start = time.perf_counter()
+            for ((x, y), _), info, output in zip(chunk, infos, outputs):
+                boxes, class_ids, confidences = self.decode(output)
+                self.count_dropped_rows(len(boxes))
+                keep = self.nms(boxes, class_ids, confidences)
+                boxes = self.scale_boxes(boxes[keep], info)
+                boxes[:, [0, 2]] += x
+                boxes[:, [1, 3]] += y
+                all_boxes.append(boxes)
+                all_class_ids.append(class_ids[keep])
+                all_confidences.append(confidences[keep])
+            record('postprocess', start)
+
+        start = time.perf_counter()
+        boxes = np.concatenate(all_boxes)
+        class_ids = np.concatenate(all_class_ids)
+        confidences = np.concatenate(all_confidences)
+        if len(views) > 1:
+            # 只有一个切片时结果与普通推理相同，不需要再做全局合并
+            keep = self.nms(boxes, class_ids, confidences)
+            boxes, class_ids, confidences = self.merge_tile_boxes(boxes[keep], class_ids[keep], confidences[keep])
+        record('merge', start)
+        timings['tiles'] = timings.get('tiles', 0) + len(views)
+        return boxes.astype(np.int32).tolist(), class_ids.tolist(), confidences.tolist()
+
+    def draw_boxes(self, image, prediction):
+        """
+        在原始图像上就地绘制一张图像的预测结果。
+        :param image: cv2读取的BGR原始图像
+        :param prediction: (boxes, class_ids, confidences)，boxes为原图坐标
+        """
+        for box, class_id, confidence in zip(*prediction):
             x_min, y_min, x_max, y_max = box
             cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
             label = f"{self.class_names[class_id]}: {confidence:.2f}"
             cv2.putText(image, label, (x_min, y_min - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        return image
 
-        cv2.imwrite(save_path, image)
+    def draw_boxes_and_save(self, img_path, predictions, save_path, image=None):
+        # 已经解码过的原始图像直接复用，否则从磁盘加载
+        if image is None:
+            with self.metrics.stage('image_decode'):
+                image = self.load_image(img_path)
+        with self.metrics.stage('draw'):
+            self.draw_boxes(image, predictions[0])
+        with self.metrics.stage('encode'):
+            cv2.imwrite(save_path, image)
 
     def predict_single_image(self, img_path, save_path=None):
-        image = self.preprocess(img_path)
-        outputs = self.predict(image)
-        predictions = self.postprocess([outputs])
-        if save_path:
-            self.draw_boxes_and_save(img_path, predictions, save_path)
+        # 走批量路径，固定批量维度的模型也能处理单张图像
+        with self.metrics.request(img_path):
+            predictions = self.predict_batch([img_path], batch_size=1)
+            if save_path:
+                self.draw_boxes_and_save(img_path, predictions, save_path)
+        return predictions
+
+    def predict_batch(self, img_paths, batch_size=8, results_dir=None):
+        """
+        按批次推理多张图像，每个批次只调用一次ort_session.run。
+        :param img_paths: 图像路径列表
+        :param batch_size: 批量大小；模型导出时固定了批量维度则以模型为准
+        :param results_dir: 不为None时把画好框的图像保存到该目录
+        :return: 与img_paths一一对应的(boxes, class_ids, confidences)列表
+        """
+        if self.fixed_batch_size is not None:
+            batch_size = self.fixed_batch_size
+        if results_dir and not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+
+        # 连续的NCHW批次张量，预处理直接写入其中，跨批次、跨调用复用
+        batch = self.batch_buffer(batch_size)
+        predictions = []
+        for start in range(0, len(img_paths), batch_size):
+            chunk = img_paths[start:start + batch_size]
+            if self.cache_enabled:
+                chunk_predictions, images = self.predict_cached(chunk, batch)
+                self.metrics.count('images', len(chunk))
+                predictions.extend(chunk_predictions)
+                if results_dir:
+                    for img_path, image, prediction in zip(chunk, images, chunk_predictions):
+                        save_path = os.path.join(results_dir, os.path.basename(img_path))
+                        self.draw_boxes_and_save(img_path, [prediction], save_path, image=image)
+                continue
+            with self.metrics.stage('image_decode'):
+                images = [self.load_image(img_path) for img_path in chunk]
+            with self.metrics.stage('preprocess'):
+                infos = [self.preprocess_image(image, out=batch[i])[1] for i, image in enumerate(images)]
+            with self.metrics.stage('inference'):
+                outputs = self.predict_padded(batch, len(chunk))
+            with self.metrics.stage('postprocess'):
+                chunk_predictions = self.postprocess(outputs, infos)
+            self.metrics.count('images', len(chunk))
+            predictions.extend(chunk_predictions)
+            if results_dir:
+                for img_path, image, prediction in zip(chunk, images, chunk_predictions):
+                    save_path = os.path.join(results_dir, os.path.basename(img_path))
+                    self.draw_boxes_and_save(img_path, [prediction], save_path, image=image)
+
         return predictions
 
-    def predict_multiple_images(self, img_paths, results_dir):
-        if not os.path.exists(results_dir):
+    def predict_pipelined(self, img_paths, results_dir=None, batch_size=8, decode_workers=4, write_workers=2,
+                          queue_size=32):
+        """
+        流式流水线推理：解码线程池 -> 单个推理阶段 -> 绘制/编码线程池，阶段之间使用有界队列。
+        推理在调用线程中执行，绘制复用解码阶段读入的原始图像，不再重复读盘。
+        启用预测缓存时，命中的图像不进入解码与推理阶段，只按当前阈值重做后处理。
+        :param img_paths: 图像路径列表
+        :param results_dir: 不为None时把画好框的图像保存到该目录
+        :param batch_size: 推理批量大小；模型导出时固定了批量维度则以模型为准
+        :param decode_workers: 读图与预处理的线程数
+        :param write_workers: 绘制与编码写盘的线程数
+        :param queue_size: 每个阶段间队列的最大长度
+        :return: (与img_paths一一对应的预测列表, 各阶段及total的StageStats组成的字典)
+        """
+        if self.fixed_batch_size is not None:
+            batch_size = self.fixed_batch_size
+        if results_dir and not os.path.exists(results_dir):
             os.makedirs(results_dir)
-        for img_path in img_paths:
-            save_path = os.path.join(results_dir, os.path.basename(img_path))
-            self.predict_single_image(img_path, save_path)
+        if not results_dir:
+            write_workers = 0
+
+        stats = {
+            'decode': StageStats('decode', decode_workers),
+            'infer': StageStats('infer', 1),
+            'write': StageStats('write', write_workers),
+        }
+        ready_queue = queue.Queue(maxsize=queue_size)
+        write_queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        errors = []
+        predictions = [None] * len(img_paths)
+        keys = None
+        if self.cache_enabled:
+            keys = [self.prediction_cache.image_key(self.cache_namespace, img_path) for img_path in img_paths]
+            cached = self.prediction_cache.get_many(keys)
+            self.metrics.count('cache_hits', len(cached))
+            self.metrics.count('cache_misses', len(keys) - len(cached))
+            for index, key in enumerate(keys):
+                if key in cached:
+                    predictions[index] = self.select_cached(cached[key])
+            pending = iter([(index, img_path) for index, (img_path, key) in enumerate(zip(img_paths, keys))
+                            if key not in cached])
+        else:
+            pending = iter(enumerate(img_paths))
+        pending_lock = threading.Lock()
+        remaining_decoders = [decode_workers]
+        # 预处理结果写入预先分配的槽位，推理阶段取走后归还；槽位数覆盖队列、解码中与凑批中的全部张量
+        slots = np.empty((queue_size + decode_workers + batch_size, 3, self.input_size, self.input_size),
+                         dtype=np.float32)
+        free_slots = queue.Queue()
+        for slot in range(len(slots)):
+            free_slots.put(slot)
+
+        def put(q, item):
+            # 下游出错停止时放弃等待，避免阻塞在已满的队列上
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def decode_worker():
+            try:
+                while not stop.is_set():
+                    with pending_lock:
+                        index, img_path = next(pending, (None, None))
+                    if img_path is None:
+                        break
+                    slot = get(free_slots)
+                    if slot is None:
+                        break
+                    start = time.perf_counter()
+                    image = self.load_image(img_path)
+                    _, info = self.preprocess_image(image, out=slots[slot])
+                    stats['decode'].add(1, time.perf_counter() - start)
+                    put(ready_queue, (index, img_path, image if results_dir else None, slot, info))
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                with pending_lock:
+                    remaining_decoders[0] -= 1
+                    last = remaining_decoders[0] == 0
+                if last:
+                    put(ready_queue, None)
+
+        def write_worker():
+            try:
+                while True:
+                    try:
+                        item = write_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        if stop.is_set():
+                            break
+                        continue
+                    if item is None:
+                        break
+                    img_path, image, prediction = item
+                    start = time.perf_counter()
+                    save_path = os.path.join(results_dir, os.path.basename(img_path))
+                    self.draw_boxes_and_save(img_path, [prediction], save_path, image=image)
+                    stats['write'].add(1, time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=decode_worker, daemon=True) for _ in range(decode_workers)]
+        writers = [threading.Thread(target=write_worker, daemon=True) for _ in range(write_workers)]
+        for thread in threads + writers:
+            thread.start()
+
+        wall_start = time.perf_counter()
+        batch = self.batch_buffer(batch_size)
+        finished = False
+        try:
+            if results_dir and keys is not None:
+                # 命中缓存的图像没有经过解码阶段，由绘制线程自己读图
+                for index, img_path in enumerate(img_paths):
+                    if predictions[index] is not None:
+                        put(write_queue, (img_path, None, predictions[index]))
+            while not finished and not stop.is_set():
+                # 第一项阻塞等待，其余项有多少取多少，不为凑满一批而空等
+                items = []
+                try:
+                    item = ready_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                while item is not None:
+                    items.append(item)
+                    if len(items) == batch_size:
+                        break
+                    try:
+                        item = ready_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                finished = item is None
+                if not items:
+                    continue
+
+                start = time.perf_counter()
+                for i, (_, _, _, slot, _) in enumerate(items):
+                    batch[i] = slots[slot]
+                    free_slots.put(slot)
+                infos = [info for *_, info in items]
+                outputs = self.predict_padded(batch, len(items))
+                if keys is None:
+                    batch_predictions = self.postprocess(outputs, infos)
+                else:
+                    batch_keys = [keys[index] for index, *_ in items]
+                    entries = self.store_candidates(batch_keys, outputs, infos)
+                    batch_predictions = [self.select_cached(entries[key]) for key in batch_keys]
+                stats['infer'].add(len(items), time.perf_counter() - start)
+
+                for (index, img_path, image, _, _), prediction in zip(items, batch_predictions):
+                    predictions[index] = prediction
+                    if results_dir:
+                        put(write_queue, (img_path, image, prediction))
+        finally:
+            for _ in writers:
+                put(write_queue, None)
+            for thread in writers:
+                thread.join()
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        # total阶段记录整体墙钟时间，其吞吐即端到端吞吐
+        stats['total'] = StageStats('total', 1)
+        stats['total'].add(len(img_paths), time.perf_counter() - wall_start)
+        return predictions, stats
+
+    def predict_multiple_images(self, img_paths, results_dir, batch_size=1):
+        return self.predict_batch(img_paths, batch_size=batch_size, results_dir=results_dir)
 
 
 # 以ONNX模型路径和图像路径为参数运行推理
 if __name__ == '__main__':
     model_path = 'best-sim.onnx'
-    predictor = ImagePredictor(model_path)
+    predictor = ImagePredictor(model_path, session_profile='onnx_session.yaml')
 
     # 预测单张图像并保存结果
     single_image_path = 'NewYolovDataSet/images/train/well1_0002.jpg'
@@ -137,5 +727,10 @@ if __name__ == '__main__':
 
     # 预测多张图像并保存结果
     image_dir = 'NewYolovDataSet/images/train'
-    image_paths = [str(p) for p in Path(image_dir).glob('*.jpg')]
-    predictor.predict_multiple_images(image_paths, 'detectResults')
+    image_paths = [str(p) for p in list_images(image_dir) if p.suffix == '.jpg']
+    predictor.predict_multiple_images(image_paths, 'detectResults', batch_size=8)
+
+    # 流水线模式预测整个目录，并打印各阶段吞吐量
+    _, pipeline_stats = predictor.predict_pipelined(image_paths, 'detectResults', batch_size=8)
+    for stage in pipeline_stats.values():
+        print(stage)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from datasetShards import file_digest
+from fileHash import file_hash
+
+DEFAULT_CACHE_PATH = '.prediction_cache.sqlite'
+# 缓存中保存的是NMS之前、置信度高于下限的全部候选框，框为xyxy。坐标系取决于后端：
+# onnx后端为模型输入尺寸（letterbox之后），ultralytics后端为原图。坐标系是命名空间的一部分，两者不会混用
+CANDIDATE_DTYPE = np.dtype([('box', '<f4', (4,)), ('confidence', '<f4'), ('class_id', '<i4')])
+# 缓存的候选框置信度下限：推理时的置信度阈值不低于它时可以直接从缓存得到结果
+DEFAULT_FLOOR = 0.01
+
+
+def to_candidates(boxes, class_ids, confidences):
+    candidates = np.empty(len(boxes), dtype=CANDIDATE_DTYPE)
+    candidates['box'] = boxes
+    candidates['confidence'] = confidences
+    candidates['class_id'] = class_ids
+    return candidates
+
+
+class PredictionCache:
+    """
+    磁盘上的预测缓存（SQLite），键为 图像内容摘要 + 模型文件摘要 + 预处理配置。
+    值为NMS之前的原始候选框，只修改置信度/NMS阈值时不需要重新推理，只重做后处理。
+    总大小超过max_bytes时按最近使用时间淘汰。多个进程可以共用同一个缓存文件。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=1 << 30):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data BLOB, '
+                                     'meta TEXT, size INTEGER, last_used REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            # 模型文件摘要按(路径, 大小, 修改时间)缓存，大模型不必每次启动都重新计算
+            self._connection.execute('CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, size INTEGER, '
+                                     'mtime INTEGER, hash TEXT)')
+
+    def model_hash(self, model_path):
+        stat = os.stat(model_path)
+        path = os.path.abspath(model_path)
+        with self._lock:
+            row = self._connection.execute('SELECT size, mtime, hash FROM models WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+        digest = file_hash(model_path)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)',
+                                     (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def namespace(self, model_path, coordinates, **config):
+        """
+        模型与预处理配置对应的键前缀，配置中任一项不同都不会命中其他配置的缓存。
+        :param coordinates: 缓存的框坐标所在的坐标系，如 'model-input'、'original'
+        """
+        payload = json.dumps({'model': self.model_hash(model_path), 'coordinates': coordinates, **config},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def image_key(namespace, image_path):
+        # 分片中的图像直接使用打包时记录的摘要，不读取图像字节
+        return f"{namespace}/{file_digest(image_path)}"
+
+    def get_many(self, keys):
+        """
+        :return: 键 -> (候选框数组, 元数据)，只包含命中的键
+        """
+        if not keys:
+            return {}
+        placeholders = ','.join('?' * len(keys))
+        now = time.time()
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                f'SELECT key, data, meta FROM entries WHERE key IN ({placeholders})', list(keys)).fetchall()
+            self._connection.executemany('UPDATE entries SET last_used = ? WHERE key = ?',
+                                         [(now, key) for key, _, _ in rows])
+        found = {key: (np.frombuffer(data, dtype=CANDIDATE_DTYPE), json.loads(meta)) for key, data, meta in rows}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        :param items: (键, 候选框数组, 可JSON序列化的元数据) 的列表
+        """
+        now = time.time()
+        rows = [(key, candidates.astype(CANDIDATE_DTYPE, copy=False).tobytes(), json.dumps(meta))
+                for key, candidates, meta in items]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                         [(key, data, meta, len(data) + len(meta), now) for key, data, meta in rows])
+            # 写入后本事务持有写锁，此时统计的总大小包含其他进程已提交的写入
+            total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(total)
+
+    def put(self, key, candidates, meta=None):
+        self.put_many([(key, candidates, meta)])
+
+    def _evict(self, total):
+        # 淘汰到上限的90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        while total > target:
+            rows = self._connection.execute('SELECT key, size FROM entries ORDER BY last_used LIMIT 256').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= target:
+                    break
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
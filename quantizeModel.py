@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_dynamic, quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from evaluate import compute_map, dataset_split, load_ground_truth
+from onnxSession import variants_manifest_path
+from onnxTest import ImagePredictor
+
+
+class ValCalibrationReader(CalibrationDataReader):
+    """
+    静态量化的校准数据：验证集图像经过与推理相同的letterbox预处理。
+    """
+
+    def __init__(self, predictor, image_paths):
+        self.predictor = predictor
+        self.image_paths = iter(image_paths)
+
+    def get_next(self):
+        img_path = next(self.image_paths, None)
+        if img_path is None:
+            return None
+        tensor, _ = self.predictor.preprocess(img_path)
+        return {self.predictor.input_name: tensor.copy()}
+
+
+def quantize_model(model_path, output_dir, calibration_paths, per_channel=True, nodes_to_exclude=None):
+    """
+    生成动态与静态INT8量化模型，返回 变体名 -> 模型路径。
+    """
+    model_path = Path(model_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # 量化前做形状推断与图优化，onnxruntime推荐的预处理步骤
+    prepared_path = output_dir / f"{model_path.stem}.prep.onnx"
+    quant_pre_process(str(model_path), str(prepared_path))
+
+    dynamic_path = output_dir / f"{model_path.stem}.int8-dynamic.onnx"
+    quantize_dynamic(str(prepared_path), str(dynamic_path), weight_type=QuantType.QUInt8,
+                     per_channel=per_channel, nodes_to_exclude=nodes_to_exclude)
+
+    static_path = output_dir / f"{model_path.stem}.int8-static.onnx"
+    predictor = ImagePredictor(str(model_path), io_binding=False)
+    quantize_static(str(prepared_path), str(static_path), ValCalibrationReader(predictor, calibration_paths),
+                    quant_format=QuantFormat.QDQ, per_channel=per_channel, activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8, calibrate_method=CalibrationMethod.MinMax,
+                    nodes_to_exclude=nodes_to_exclude)
+    prepared_path.unlink()
+    return {'fp32': model_path, 'int8-dynamic': dynamic_path, 'int8-static': static_path}
+
+
+def benchmark_variant(model_path, image_paths, label_dir, runs=50, conf_threshold=0.001, batch_size=8):
+    """
+    测量单张推理延迟，并在验证集上计算mAP。
+    """
+    predictor = ImagePredictor(str(model_path), conf_threshold=conf_threshold)
+    tensor, _ = predictor.preprocess(image_paths[0])
+    for _ in range(5):
+        predictor.predict(tensor)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predictor.predict(tensor)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    predictions = predictor.predict_batch(image_paths, batch_size=batch_size)
+    ground_truths = [load_ground_truth(p, label_dir) for p in image_paths]
+    map50, map50_95 = compute_map(predictions, ground_truths, len(predictor.class_names))
+    return {
+        'latency_ms': {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95))},
+        'map50': map50,
+        'map50_95': map50_95,
+        'size_mb': Path(model_path).stat().st_size / 2 ** 20,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ONNX模型INT8量化，并对比各变体的延迟与精度')
+    parser.add_argument('--model', default='best-sim.onnx', help='fp32 ONNX模型')
+    parser.add_argument('--data', default='manhole_dataset.yaml', help='数据集配置文件')
+    parser.add_argument('--dataset-root', default=None, help='覆盖配置文件中的数据集根目录')
+    parser.add_argument('--output-dir', default=None, help='量化模型输出目录，默认与模型同目录')
+    parser.add_argument('--calibration-images', type=int, default=200, help='静态量化使用的校准图像数')
+    parser.add_argument('--runs', type=int, default=50, help='测延迟的推理次数')
+    parser.add_argument('--no-per-channel', action='store_true', help='权重按张量而非按通道量化')
+    parser.add_argument('--exclude-nodes', nargs='*', default=None, help='保持fp32、不量化的节点名')
+    args = parser.parse_args()
+
+    val_paths, val_label_dir = dataset_split(args.data, 'val', args.dataset_root)
+    output_dir = args.output_dir or Path(args.model).parent
+    variants = quantize_model(args.model, output_dir, val_paths[:args.calibration_images],
+                              per_channel=not args.no_per_channel, nodes_to_exclude=args.exclude_nodes)
+
+    manifest_path = variants_manifest_path(args.model)
+    manifest = {'source': Path(args.model).name, 'dataset': args.data, 'variants': {}}
+    for name, path in variants.items():
+        metrics = benchmark_variant(path, val_paths, val_label_dir, runs=args.runs)
+        manifest['variants'][name] = {
+            'path': os.path.relpath(path, manifest_path.parent), **metrics}
+        print(f"{name}: p50 {metrics['latency_ms']['p50']:.2f} ms, mAP50 {metrics['map50']:.4f}, "
+              f"mAP50-95 {metrics['map50_95']:.4f}, {metrics['size_mb']:.1f} MB")
+
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    print(f'变体清单已写入 {manifest_path}')
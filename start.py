@@ -1,10 +1,8 @@
 import sys
 
-from yolov5.train import run  # 导入YOLOv5的训练函数
-
-from comet_ml import Experiment
-from comet_ml.integration.pytorch import log_model
+import yaml
 
+from yolov5.train import run  # 导入YOLOv5的训练函数
 
 
 if __name__ == '__main__':
@@ -18,5 +16,13 @@ if __name__ == '__main__':
         'cache': True  # 缓存图像以加速训练
     }
 
+    # 按需增强：训练集只保留原图，增强版本在取样时生成，不再把增强副本写盘和缓存进内存
+    with open(train_params['data'], 'r') as file:
+        data_config = yaml.safe_load(file)
+    if data_config.get('lazy_augment', False):
+        from lazyAugment import install_yolov5_lazy_augmentation
+        install_yolov5_lazy_augmentation(cache_size=data_config.get('augment_cache_size', 0))
+        train_params['cache'] = False
+
     # 启动训练
     run(**train_params)
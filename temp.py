@@ -1,22 +1,115 @@
+import heapq
 import os
 import re
-import torch
+import tempfile
+import threading
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from PIL import Image
-from ultralytics import YOLO
 
+from datasetShards import imread, list_images, resolve
+from predictionCache import DEFAULT_FLOOR, to_candidates
+
+# 每张图像保留的检测数上限（ultralytics的默认值），缓存与不使用缓存的推理共用
+MAX_DET = 300
 
-def model_run(model_path, data_path, conf=0.35, iou=0.5):
+
+def model_run(model_path, data_path, conf=0.35, iou=0.5, stream=False, cache=None):
     """
     对给定的模型和数据集运行YOLO对象检测。
     :param iou:
     :param conf:
     :param model_path: 模型路径
-    :param data_path: 数据集路径
+    :param data_path: 数据集路径，也可以是分片中的图像目录（分片路径/images/划分）
+    :param stream: 为True时返回逐张产出结果的生成器，不在内存中保留整个目录的结果
+    :param cache: predictionCache.PredictionCache；给出时按图像内容缓存NMS之前的候选框，
+                  只修改conf/iou重新运行时不再推理
     :return:
     """
+    # ultralytics（及torch）只在真正推理时导入，只格式化、排序结果时不需要
+    from ultralytics import YOLO
+
     model = YOLO(model_path)
-    return model(data_path, conf=conf, iou=iou, half=True, augment=True, agnostic_nms=True)
+    if cache is not None and conf >= DEFAULT_FLOOR:
+        image_paths = [data_path] if os.path.isfile(data_path) else list_images(data_path)
+        namespace = cache.namespace(model_path, 'original', half=True, augment=True, floor=DEFAULT_FLOOR)
+        results = (cached_predict(model, cache, namespace, image_path, conf, iou) for image_path in image_paths)
+        return results if stream else list(results)
+    if resolve(data_path) is not None:
+        # 分片中的图像逐张解码后交给模型，结果的path改回分片内的路径，保存时文件名不变
+        results = (shard_predict(model, image_path, conf, iou) for image_path in list_images(data_path))
+        return results if stream else list(results)
+    return model(data_path, conf=conf, iou=iou, max_det=MAX_DET, half=True, augment=True, agnostic_nms=True,
+                 stream=stream)
+
+
+def shard_predict(model, image_path, conf, iou):
+    r = model(imread(image_path), conf=conf, iou=iou, max_det=MAX_DET, half=True, augment=True,
+              agnostic_nms=True)[0]
+    r.path = str(image_path)
+    return r
+
+
+def cached_predict(model, cache, namespace, image_path, conf, iou):
+    """
+    从缓存取一张图像的候选框，未命中时以置信度下限推理并写入缓存，再按conf/iou做与不使用缓存时相同的NMS。
+    """
+    from ultralytics.engine.results import Results
+
+    image = imread(image_path)
+    key = cache.image_key(namespace, image_path)
+    entry = cache.get(key)
+    if entry is None:
+        # iou=1时模型内部的NMS不抑制任何框（只抑制IoU大于阈值的框），缓存的就是NMS之前的全部候选框
+        r = model(image, conf=DEFAULT_FLOOR, iou=1.0, max_det=30000, half=True, augment=True, agnostic_nms=True)[0]
+        boxes = r.boxes.cpu().numpy()
+        candidates = to_candidates(boxes.xyxy, boxes.cls.astype(np.int32), boxes.conf)
+        cache.put(key, candidates)
+    else:
+        candidates = entry[0]
+
+    candidates = agnostic_nms(candidates, conf, iou)
+    data = np.column_stack([candidates['box'], candidates['confidence'], candidates['class_id']]).astype(np.float32)
+    return Results(image, path=str(image_path), names=model.names, boxes=data)
+
+
+def agnostic_nms(candidates, conf, iou, max_det=MAX_DET):
+    """
+    与ultralytics推理时agnostic_nms=True的NMS一致：保留置信度大于conf的候选框，
+    用torchvision的NMS做类别无关的抑制，按置信度从高到低最多保留max_det个。
+    """
+    import torch
+    import torchvision
+
+    candidates = candidates[candidates['confidence'] > conf]
+    keep = torchvision.ops.nms(torch.from_numpy(candidates['box'].astype(np.float32)),
+                               torch.from_numpy(candidates['confidence'].astype(np.float32)), iou)
+    return candidates[keep[:max_det].numpy()]
+
+
+def result_sort_key(file_name):
+    # 按文件名中的数字排序，与save_results一致
+    return int(re.search(r'\d+', file_name).group())
+
+
+def format_result_lines(r, file_name):
+    """
+    把一张图像的检测结果格式化为results.txt中的若干行。
+    """
+    data = [
+        {
+            'cls': int(box.cls.item()),
+            'conf': box.conf.item(),
+            'xyxy': [round(coordinate) for coordinate in box.xyxy.tolist()[0]],
+            'filename': file_name
+        }
+        for box in r.boxes
+    ]
+    # 格式化每行的数据，并以空格分隔
+    return [f"{item['filename']}\t{item['cls']}\t{item['conf']}\t{' '.join(map(str, item['xyxy']))}\n"
+            for item in data]
 
 
 def save_results(results, result_txt_path, result_image_path):
@@ -28,7 +121,7 @@ def save_results(results, result_txt_path, result_image_path):
     :return:
     """
     # 通过提取文件名中的数字来排序结果
-    results = sorted(results, key=lambda x: int(re.search(r'\d+', x.path.split('/')[-1]).group()))
+    results = sorted(results, key=lambda x: result_sort_key(x.path.split('/')[-1]))
 
     with open(result_txt_path, 'a') as file:
         for i, r in enumerate(results):
@@ -41,33 +134,103 @@ def save_results(results, result_txt_path, result_image_path):
             save_path = os.path.join(result_image_path, f'{file_name}')
             im_rgb.save(save_path)
 
-            data = [
-                {
-                    'cls': int(box.cls.item()),
-                    'conf': box.conf.item(),
-                    'xyxy': [round(coordinate) for coordinate in box.xyxy.tolist()[0]],
-                    'filename': file_name
-                }
-                for box in r.boxes
-            ]
-
-            for item in data:
-                # 格式化每行的数据，并以空格分隔
-                line = f"{item['filename']}\t{item['cls']}\t{item['conf']}\t{' '.join(map(str, item['xyxy']))}\n"
-                # 写入文件
-                file.write(line)
+            # 写入文件
+            file.writelines(format_result_lines(r, file_name))
 
             print(f'{i + 1}: {save_path}')
             # r.show()
 
 
+def plot_and_save(r, save_path):
+    im_bgr = r.plot()
+    Image.fromarray(im_bgr[..., ::-1]).save(save_path)
+
+
+def external_sort_lines(unsorted_path, output_path, chunk_lines=100000):
+    """
+    按文件名中的数字对结果行做外部归并排序：分块排序写成临时有序段，再用heapq.merge归并。
+    排序与归并都是稳定的，同一图像的多行保持写入时的先后顺序。
+    """
+    def line_key(line):
+        return result_sort_key(line.split('\t', 1)[0])
+
+    run_paths = []
+    runs = []
+    try:
+        with open(unsorted_path, 'r') as file:
+            while True:
+                chunk = [line for _, line in zip(range(chunk_lines), file)]
+                if not chunk:
+                    break
+                chunk.sort(key=line_key)
+                run_dir = os.path.dirname(output_path) or '.'
+                with tempfile.NamedTemporaryFile('w', delete=False, suffix='.run', dir=run_dir) as run:
+                    run_paths.append(run.name)
+                    run.writelines(chunk)
+
+        runs = [open(path, 'r') for path in run_paths]
+        with open(output_path, 'a') as output:
+            output.writelines(heapq.merge(*runs, key=line_key))
+    finally:
+        for run in runs:
+            run.close()
+        for path in run_paths:
+            os.remove(path)
+
+
+def save_results_streaming(results, result_txt_path, result_image_path, plot_workers=4, max_pending=16,
+                           chunk_lines=100000):
+    """
+    流式保存检测结果：每张图像推理完就把结果行追加到临时文件，绘图交给后台线程池，
+    全部结束后按文件名数字做外部归并排序写入result_txt_path。内存占用与图像总数无关。
+    :param results: model_run(..., stream=True)返回的生成器
+    :param result_txt_path: 保存结果的txt文件路径
+    :param result_image_path: 保存结果的图片文件夹路径
+    :param plot_workers: 绘图线程数
+    :param max_pending: 等待绘图的结果数上限，超过时推理暂停等待
+    :param chunk_lines: 外部排序每个有序段的行数
+    """
+    unsorted_path = f'{result_txt_path}.unsorted'
+    pending = threading.BoundedSemaphore(max_pending)
+    errors = []
+
+    def plot_task(r, save_path):
+        try:
+            plot_and_save(r, save_path)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pending.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=plot_workers) as executor, open(unsorted_path, 'w') as file:
+            for i, r in enumerate(results):
+                # 取完整路径的文件名
+                file_name = r.path.split('/')[-1]
+                file.writelines(format_result_lines(r, file_name))
+
+                save_path = os.path.join(result_image_path, f'{file_name}')
+                pending.acquire()
+                executor.submit(plot_task, r, save_path)
+                del r
+                print(f'{i + 1}: {save_path}')
+
+        if errors:
+            raise errors[0]
+        external_sort_lines(unsorted_path, result_txt_path, chunk_lines)
+    finally:
+        # 绘图或排序失败时也不在磁盘上留下未排序的临时文件
+        if os.path.exists(unsorted_path):
+            os.remove(unsorted_path)
+
+
 if __name__ == '__main__':
     # model_path = '井盖测试集/best.pt'
     model_path = '/home/angxue/Downloads/the-end2.pt'
     data_path = '井盖测试集/测试集图片'
     # data_path = '井盖测试集/测试集图片/test10.jpg'
 
-    results = model_run(model_path, data_path)
+    results = model_run(model_path, data_path, stream=True)
 
     result_dir = 'test_results'
     if os.path.exists(result_dir):
@@ -80,4 +243,4 @@ if __name__ == '__main__':
     if os.path.exists(results_txt):
         os.remove(results_txt)
 
-    save_results(results, results_txt, result_dir)
+    save_results_streaming(results, results_txt, result_dir)
@@ -4,7 +4,6 @@ import os
 import sys
 import subprocess
 import torch
-import tkinter as tk
 
 # 导入YOLOv5模块
 from models.common import DetectMultiBackend
@@ -13,7 +12,6 @@ from utils.general import (check_img_size, non_max_suppression, scale_boxes, xyx
 from utils.plots import Annotator, colors
 from utils.torch_utils import select_device
 from pathlib import Path
-from tkinter import filedialog
 
 
 def select_file():
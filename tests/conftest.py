@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# 仓库中的模块是顶层脚本，测试直接按模块名导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark import build_model  # noqa: E402
+from onnxTest import ImagePredictor  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def onnx_model(tmp_path_factory):
+    """
+    benchmark.build_model生成的随机权重模型（动态批量维度），调高objectness_bias使每张图像都有检测框。
+    """
+    model_path = tmp_path_factory.mktemp('model') / 'model.onnx'
+    build_model(str(model_path), objectness_bias=2.0)
+    return str(model_path)
+
+
+@pytest.fixture(scope='session')
+def predictor(onnx_model):
+    return ImagePredictor(onnx_model)
+
+
+@pytest.fixture
+def random_images():
+    """
+    返回写随机噪声图像的函数：write(目录, 数量, 形状)，文件名为test{i}.jpg，返回路径列表。
+    """
+    def write(directory: Path, count=3, shape=(480, 640, 3)):
+        rng = np.random.default_rng(0)
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for i in range(count):
+            path = directory / f'test{i}.jpg'
+            cv2.imwrite(str(path), rng.integers(0, 255, shape, np.uint8))
+            paths.append(str(path))
+        return paths
+
+    return write
@@ -0,0 +1,43 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from asyncIngest import format_overlap, run_ingest, start_image_server
+
+
+@pytest.fixture
+def image_server(tmp_path, random_images):
+    names = [Path(path).name for path in random_images(tmp_path, count=12, shape=(120, 160, 3))]
+    # 30%的请求返回503，且每个请求都有固定延迟，并发下载的忙碌时间会相互重叠
+    server, base_url = start_image_server(tmp_path, latency=0.05, failure_rate=0.3)
+    yield base_url, names
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_failures_and_overlap(predictor, image_server, tmp_path):
+    base_url, names = image_server
+    good = [f'{base_url}/{name}' for name in names]
+    missing = f'{base_url}/missing.jpg'
+    refused = 'http://127.0.0.1:1/refused.jpg'
+    output_path = tmp_path / 'results.jsonl'
+
+    failures, stats = run_ingest(predictor, good + [missing, refused], str(output_path), batch_size=4,
+                                 concurrency=8, retries=6, timeout=5.0, backoff=0.01)
+
+    # 503重试后成功；404不重试直接失败；拒绝连接重试用尽后失败
+    assert sorted(url for url, _ in failures) == sorted([missing, refused])
+    assert '404' in dict(failures)[missing]
+    assert stats['fetch'].retries > 0
+    assert stats['fetch'].failed == 2
+    assert stats['infer'].count == len(good)
+    results = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert sorted(result['image'] for result in results) == sorted(names)
+
+    # 并发下载的忙碌时间之和超过墙钟时间，各阶段活跃时间（忙碌区间的并集）不会
+    wall = stats['total'].busy
+    assert stats['fetch'].busy > wall
+    for name in ('fetch', 'decode', 'infer'):
+        assert 0 < stats[name].active <= wall
+    assert '阶段重叠效率' in format_overlap(stats)
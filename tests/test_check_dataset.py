@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from checkDataSet import THUMBNAIL_DIR, visualize_dataset
+
+
+def build_dataset(root: Path, names):
+    rng = np.random.default_rng(0)
+    (root / 'images' / 'train').mkdir(parents=True)
+    (root / 'labels' / 'train').mkdir(parents=True)
+    for i, name in enumerate(names):
+        cv2.imwrite(str(root / 'images' / 'train' / f'{name}.jpg'), rng.integers(0, 255, (48, 64, 3), np.uint8))
+        (root / 'labels' / 'train' / f'{name}.txt').write_text(f'{i % 5} 0.5 0.5 0.25 0.25\n')
+
+
+def test_prunes_only_its_own_outputs(tmp_path):
+    dataset, output = tmp_path / 'dataset', tmp_path / 'output'
+    build_dataset(dataset, ['a', 'b', 'c'])
+    output.mkdir()
+    # 输出目录中与本工具无关的文件
+    (output / 'notes.txt').write_text('keep')
+    cv2.imwrite(str(output / 'reference.jpg'), np.zeros((8, 8, 3), np.uint8))
+
+    rendered, skipped, failed = visualize_dataset(str(dataset), output, workers=1)
+    assert (rendered, skipped, failed) == (3, 0, [])
+    assert (output / 'notes.txt').read_text() == 'keep'
+    assert (output / 'reference.jpg').exists()
+
+    (dataset / 'images' / 'train' / 'b.jpg').unlink()
+    rendered, skipped, failed = visualize_dataset(str(dataset), output, workers=1)
+    assert (rendered, skipped, failed) == (0, 2, [])
+    assert not (output / 'b.jpg').exists()
+    assert not (output / THUMBNAIL_DIR / 'b.jpg').exists()
+    assert (output / 'a.jpg').exists() and (output / 'c.jpg').exists()
+    assert (output / 'notes.txt').read_text() == 'keep'
+    assert (output / 'reference.jpg').exists()
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import albumentations as A
+import cv2
+import numpy as np
+
+from createAugmentedDataset import create_augmented_dataset
+from createDataSet import create_replica_dataset
+from data_preprocess import batch_convert_xmls
+
+VOC_XML = """<annotation><filename>{name}.jpg</filename>
+<size><width>64</width><height>48</height><depth>3</depth></size>
+<object><name>broke</name><bndbox><xmin>4</xmin><ymin>4</ymin><xmax>40</xmax><ymax>30</ymax></bndbox></object>
+</annotation>"""
+
+
+def build_source(root: Path, count=6):
+    rng = np.random.default_rng(0)
+    for kind in ('images', 'labels'):
+        for split in ('train', 'val', 'test'):
+            (root / kind / split).mkdir(parents=True, exist_ok=True)
+    names = [f'well{i % 5}_{i:04d}' for i in range(count)]
+    for i, name in enumerate(names):
+        cv2.imwrite(str(root / 'images' / 'train' / f'{name}.jpg'), rng.integers(0, 255, (48, 64, 3), np.uint8))
+        (root / 'labels' / 'train' / f'{name}.txt').write_text(f'{i % 5} 0.5 0.5 0.25 0.25\n')
+    return names
+
+
+def label_texts(root: Path):
+    return {path.relative_to(root).as_posix(): path.read_text() for path in sorted(root.glob('labels/*/*.txt'))}
+
+
+def test_label_rewrites_do_not_propagate(tmp_path):
+    original, replica, augmented = tmp_path / 'EndDataSet', tmp_path / 'ReplicaSet', tmp_path / 'DataSet'
+    names = build_source(original)
+    create_replica_dataset(original, replica, val_ratio=0.3, seed=0)
+    flip = A.Compose([A.HorizontalFlip(p=1.0)], bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels']))
+    create_augmented_dataset(original_dir=replica, augmented_dir=augmented, augmentation_list=[flip], workers=1,
+                             seed=0, incremental=True)
+    original_labels, replica_labels = label_texts(original), label_texts(replica)
+
+    # 在派生数据集上重新转换XML标注（就地重写labels/train），源数据集不能跟着改变
+    xml_dir = tmp_path / 'xml'
+    xml_dir.mkdir()
+    replica_train = [path.stem for path in (replica / 'labels' / 'train').glob('*.txt')]
+    for name in replica_train:
+        (xml_dir / f'{name}.xml').write_text(VOC_XML.format(name=name))
+    batch_convert_xmls(str(xml_dir), str(replica / 'images' / 'train'), str(replica / 'labels' / 'train'),
+                       workers=1, force=True)
+    assert label_texts(original) == original_labels
+    assert label_texts(replica) != replica_labels
+
+    # 直接改写源标注文件，已经生成的派生数据集也不能跟着改变
+    augmented_labels = label_texts(augmented)
+    for name in names:
+        with open(original / 'labels' / 'train' / f'{name}.txt', 'w') as file:
+            file.write('4 0.1 0.1 0.1 0.1\n')
+    with open(replica / 'labels' / 'train' / f'{replica_train[0]}.txt', 'w') as file:
+        file.write('3 0.2 0.2 0.2 0.2\n')
+    assert label_texts(augmented) == augmented_labels
+    assert all('4 0.1 0.1' not in text for text in label_texts(replica).values())
+
+
+def test_images_stay_hardlinked(tmp_path):
+    original, replica = tmp_path / 'EndDataSet', tmp_path / 'ReplicaSet'
+    build_source(original)
+    create_replica_dataset(original, replica, val_ratio=0.3, seed=0)
+    for image_path in replica.glob('images/*/*.jpg'):
+        source = original / 'images' / 'train' / image_path.name
+        assert image_path.stat().st_ino == source.stat().st_ino
+    for label_path in replica.glob('labels/*/*.txt'):
+        source = original / 'labels' / 'train' / label_path.name
+        assert label_path.stat().st_ino != source.stat().st_ino
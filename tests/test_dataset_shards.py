@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+import pytest
+
+from datasetShards import imread, list_images, open_shards, pack_dataset
+
+
+def build_dataset(root, random_images, shape=(48, 64, 3)):
+    paths = random_images(root / 'images' / 'train', count=2, shape=shape)
+    (root / 'labels' / 'train').mkdir(parents=True, exist_ok=True)
+    for i in range(2):
+        (root / 'labels' / 'train' / f'test{i}.txt').write_text(f'{i} 0.5 0.5 0.25 0.25\n')
+    return paths
+
+
+def test_repacking_in_the_same_process_is_visible(random_images, tmp_path):
+    dataset, shards = tmp_path / 'dataset', tmp_path / 'shards'
+    build_dataset(dataset, random_images)
+    # 打包之前访问过的路径缓存为“不是分片”
+    assert open_shards(shards) is None
+    pack_dataset(dataset, shards)
+    assert [p.name for p in list_images(shards / 'images' / 'train')] == ['test0.jpg', 'test1.jpg']
+    assert imread(shards / 'images' / 'train' / 'test0.jpg').shape == (48, 64, 3)
+
+    # 同一进程中重新打包，读到的是新内容
+    for path in (dataset / 'images' / 'train').iterdir():
+        cv2.imwrite(str(path), np.zeros((24, 32, 3), np.uint8))
+    pack_dataset(dataset, shards)
+    assert imread(shards / 'images' / 'train' / 'test0.jpg').shape == (24, 32, 3)
+
+
+def test_duplicate_stems_are_rejected(random_images, tmp_path):
+    dataset = tmp_path / 'dataset'
+    paths = build_dataset(dataset, random_images)
+    cv2.imwrite(paths[0].replace('.jpg', '.png'), np.zeros((8, 8, 3), np.uint8))
+    with pytest.raises(ValueError, match='test0'):
+        pack_dataset(dataset, tmp_path / 'shards')
@@ -0,0 +1,92 @@
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from inferenceServer import InferenceService
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def service(onnx_model):
+    service = InferenceService(onnx_model, workers=2, max_batch_size=4, max_wait_ms=50)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def images(random_images, tmp_path):
+    paths = random_images(tmp_path, count=8)
+    return paths, [cv2.imread(path) for path in paths]
+
+
+def test_batches_and_routes_results_to_each_caller(service, predictor, images):
+    paths, frames = images
+    expected = predictor.predict_batch(paths, batch_size=1)
+    with ThreadPoolExecutor(len(frames)) as executor:
+        results = list(executor.map(service.submit, frames))
+
+    for (boxes, class_ids, confidences), (expected_boxes, expected_ids, expected_confidences) in zip(results,
+                                                                                                     expected):
+        assert (boxes, class_ids) == (expected_boxes, expected_ids)
+        np.testing.assert_allclose(confidences, expected_confidences, rtol=1e-5)
+    assert service.stats['requests'] == service.stats['batched_images'] == len(frames)
+    # 并发的请求被攒成了批
+    assert service.stats['batches'] < len(frames)
+    assert service.pool.free_slots.qsize() == len(service.pool.frames)
+
+
+def test_submit_times_out_without_free_slots(service, images):
+    _, frames = images
+    slots = [service.pool.acquire() for _ in range(len(service.pool.frames))]
+    try:
+        with pytest.raises(TimeoutError):
+            service.submit(frames[0], timeout=0.1)
+    finally:
+        for slot in slots:
+            service.pool.release(slot)
+    assert len(service.submit(frames[0])) == 3
+
+
+def test_dead_worker_fails_its_requests_and_frees_slots(service, images):
+    _, frames = images
+    victim = service.workers[0]
+    # 先暂停工作进程，使发给它的批次停留在处理中，再杀死它
+    os.kill(victim.pid, signal.SIGSTOP)
+    outcomes = []
+
+    def submit(frame):
+        try:
+            service.submit(frame, timeout=10)
+            outcomes.append('ok')
+        except RuntimeError as e:
+            outcomes.append(str(e))
+
+    threads = [threading.Thread(target=submit, args=(frame,)) for frame in frames]
+    for thread in threads:
+        thread.start()
+    assert wait_until(lambda: service.worker_batches[0])
+    os.kill(victim.pid, signal.SIGKILL)
+    for thread in threads:
+        thread.join()
+
+    failed = [outcome for outcome in outcomes if outcome != 'ok']
+    assert len(outcomes) == len(frames)
+    assert failed and all('已退出' in outcome for outcome in failed)
+    assert service.alive == {1}
+    assert service.pool.free_slots.qsize() == len(service.pool.frames)
+    # 之后的请求都交给存活的工作进程
+    assert len(service.submit(frames[0])) == 3
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from instrumentation import Instrumentation, SamplingProfiler
+from onnxTest import ImagePredictor
+from predictionCache import PredictionCache
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_samples_are_frozen_after_end_and_folded_is_safe():
+    profiler = SamplingProfiler(slowest=50, interval=0.0005)
+    errors = []
+    stop = threading.Event()
+
+    def request(index):
+        for _ in range(5):
+            samples = profiler.begin()
+            busy(0.01)
+            profiler.end(samples, f'request-{index}', 0.01)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                profiler.folded()
+            except RuntimeError as e:
+                errors.append(e)
+
+    reading = threading.Thread(target=reader)
+    reading.start()
+    workers = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    before = profiler.folded()
+    time.sleep(0.05)
+    stop.set()
+    reading.join()
+
+    assert errors == []
+    assert before.strip()
+    # 请求结束后采样线程不再改动它的样本
+    assert profiler.folded() == before
+
+
+def test_dropped_rows_do_not_depend_on_the_cache(onnx_model, random_images, tmp_path):
+    image_path, = random_images(tmp_path, count=1)
+
+    counts = []
+    cache = PredictionCache(tmp_path / 'cache.sqlite')
+    # 不使用缓存、缓存未命中、缓存命中三种情况下丢弃的行数相同
+    for prediction_cache in (None, cache, cache):
+        metrics = Instrumentation()
+        predictor = ImagePredictor(onnx_model, instrumentation=metrics, prediction_cache=prediction_cache)
+        predictor.predict_batch([image_path])
+        counts.append(metrics.counters['low_confidence_rows_dropped'])
+    cache.close()
+    assert counts[0] > 0
+    assert counts == [counts[0]] * 3
@@ -0,0 +1,28 @@
+import albumentations as A
+
+from lazyAugment import LazyAugmentedDataset
+
+
+def test_original_variant_does_not_alias_the_cache(random_images, tmp_path):
+    random_images(tmp_path / 'images' / 'train', count=2, shape=(48, 64, 3))
+    (tmp_path / 'labels' / 'train').mkdir(parents=True)
+    for i in range(2):
+        (tmp_path / 'labels' / 'train' / f'test{i}.txt').write_text('1 0.5 0.5 0.25 0.25\n')
+    augmentations = [A.Compose([A.HorizontalFlip(p=1.0)],
+                               bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels']))]
+    dataset = LazyAugmentedDataset(tmp_path, augmentations, cache_size=4, seed=0)
+
+    image, boxes, class_labels = dataset[0]
+    original = image.copy()
+    # 模拟下游就地修改（letterbox、HSV增强）
+    image[:] = 0
+    boxes[0][0] = 0.9
+    class_labels[0] = 4
+
+    image, boxes, class_labels = dataset[0]
+    assert (image == original).all()
+    assert boxes == [[0.5, 0.5, 0.25, 0.25]]
+    assert class_labels == [1]
+    # 增强变体基于未被修改的源图像
+    flipped, _, _ = dataset[1]
+    assert (flipped == original[:, ::-1]).all()
@@ -0,0 +1,93 @@
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from onnxTest import ImagePredictor
+from predictionCache import PredictionCache, to_candidates
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def test_cache_does_not_import_inference_backends():
+    code = ("import sys, predictionCache; "
+            "print(','.join(m for m in ('onnxruntime', 'yaml', 'torch') if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, '-c', code], cwd=REPO, capture_output=True, text=True, check=True)
+    assert loaded.stdout.strip() == ''
+
+
+def test_size_limit_is_shared_between_instances(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    candidates = to_candidates(np.zeros((100, 4), np.float32), np.zeros(100, np.int32), np.ones(100, np.float32))
+    entry_size = len(candidates.tobytes()) + len('null')
+    max_bytes = entry_size * 10
+    # 两个实例（相当于两个进程）交替写入同一个缓存文件
+    caches = [PredictionCache(path, max_bytes=max_bytes) for _ in range(2)]
+    for i in range(30):
+        caches[i % 2].put(f'key{i}', candidates)
+    with sqlite3.connect(path) as connection:
+        total = connection.execute('SELECT SUM(size) FROM entries').fetchone()[0]
+    assert total <= max_bytes
+    for cache in caches:
+        cache.close()
+
+
+def test_onnx_cached_predictions_match_uncached(onnx_model, random_images, tmp_path):
+    image_paths = random_images(tmp_path / 'images')
+    cache = PredictionCache(tmp_path / 'cache.sqlite')
+    for conf, iou in ((0.25, 0.45), (0.5, 0.3), (0.05, 0.6)):
+        expected = ImagePredictor(onnx_model, conf_threshold=conf, nms_threshold=iou).predict_batch(image_paths)
+        cached = ImagePredictor(onnx_model, conf_threshold=conf, nms_threshold=iou, prediction_cache=cache)
+        assert cached.predict_batch(image_paths) == expected
+    assert cache.misses == len(image_paths)
+    assert cache.hits == 2 * len(image_paths)
+    cache.close()
+
+
+def test_pipelined_predictions_use_the_cache(onnx_model, random_images, tmp_path):
+    image_paths = random_images(tmp_path / 'images', count=5)
+    expected = ImagePredictor(onnx_model).predict_batch(image_paths)
+    cache = PredictionCache(tmp_path / 'cache.sqlite')
+    # 先缓存一部分图像，流水线只推理其余的图像
+    ImagePredictor(onnx_model, prediction_cache=cache).predict_batch(image_paths[:2])
+    predictor = ImagePredictor(onnx_model, prediction_cache=cache)
+    predictions, stats = predictor.predict_pipelined(image_paths, str(tmp_path / 'results'), batch_size=2)
+    assert predictions == expected
+    assert stats['infer'].count == 3
+    assert sorted(p.name for p in (tmp_path / 'results').iterdir()) == [Path(p).name for p in image_paths]
+    predictions, stats = predictor.predict_pipelined(image_paths)
+    assert predictions == expected
+    assert stats['infer'].count == 0
+    cache.close()
+
+
+def test_ultralytics_cached_predictions_match_uncached(random_images, tmp_path):
+    pytest.importorskip('ultralytics')
+    from ultralytics import YOLO
+
+    import temp
+
+    model_path = str(tmp_path / 'model.pt')
+    YOLO('yolov8n.yaml').save(model_path)
+    random_images(tmp_path / 'images')
+    cache = PredictionCache(tmp_path / 'cache.sqlite')
+    for conf, iou in ((0.02, 0.5), (0.05, 0.3)):
+        expected = temp.model_run(model_path, str(tmp_path / 'images'), conf=conf, iou=iou)
+        cached = temp.model_run(model_path, str(tmp_path / 'images'), conf=conf, iou=iou, cache=cache)
+        by_path = lambda r: r.path
+        for r_expected, r_cached in zip(sorted(expected, key=by_path), sorted(cached, key=by_path)):
+            assert len(r_cached.boxes) == len(r_expected.boxes) <= temp.MAX_DET
+            np.testing.assert_allclose(r_cached.boxes.data.cpu().numpy(), r_expected.boxes.data.cpu().numpy(),
+                                       atol=1e-3)
+    cache.close()
+
+
+def test_coordinate_spaces_use_separate_namespaces(tmp_path):
+    model_path = tmp_path / 'model.bin'
+    model_path.write_bytes(b'model')
+    cache = PredictionCache(tmp_path / 'cache.sqlite')
+    assert cache.namespace(model_path, 'model-input') != cache.namespace(model_path, 'original')
+    cache.close()
@@ -0,0 +1,38 @@
+import pytest
+
+from temp import save_results_streaming
+
+
+class FakeResult:
+    """
+    只提供save_results_streaming用到的属性：没有检测框的结果，plot()可以指定抛出的异常。
+    """
+
+    def __init__(self, path, plot_error=None):
+        self.path = path
+        self.boxes = []
+        self.plot_error = plot_error
+
+    def plot(self):
+        raise self.plot_error
+
+
+def leftovers(directory):
+    return sorted(path.name for path in directory.iterdir() if path.suffix in ('.unsorted', '.run'))
+
+
+def test_plot_failure_removes_unsorted_file(tmp_path):
+    results = [FakeResult('images/test1.jpg', OSError('disk full'))]
+    with pytest.raises(OSError, match='disk full'):
+        save_results_streaming(results, str(tmp_path / 'results.txt'), str(tmp_path), plot_workers=1)
+    assert leftovers(tmp_path) == []
+
+
+def test_sort_failure_removes_temporary_files(tmp_path, monkeypatch):
+    monkeypatch.setattr('temp.plot_and_save', lambda r, save_path: None)
+    results = [FakeResult('images/test1.jpg'), FakeResult('images/test2.jpg')]
+    # 结果行按文件名中的数字排序，文件名没有数字时排序失败
+    monkeypatch.setattr('temp.format_result_lines', lambda r, file_name: [f"{file_name[:4]}\t0\t0.5\t0 0 1 1\n"])
+    with pytest.raises(AttributeError):
+        save_results_streaming(results, str(tmp_path / 'results.txt'), str(tmp_path), chunk_lines=1)
+    assert leftovers(tmp_path) == []
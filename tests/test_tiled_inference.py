@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def test_all_tiles_run_as_one_batch(predictor, monkeypatch):
+    image = np.random.default_rng(0).integers(0, 255, (1200, 1600, 3), np.uint8)
+    chunked = predictor.predict_tiled(image, batch_size=3)
+
+    batch_sizes = []
+    predict_padded = predictor.predict_padded
+
+    def record(batch, count):
+        batch_sizes.append(count)
+        return predict_padded(batch, count)
+
+    monkeypatch.setattr(predictor, 'predict_padded', record)
+    timings = {}
+    assert predictor.predict_tiled(image, timings=timings) == chunked
+    # 全部切片（含整图缩放版本）一次推理
+    assert timings['tiles'] > 3
+    assert batch_sizes == [timings['tiles']]
@@ -0,0 +1,104 @@
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from videoInference import IoUTracker, predict_video
+
+FPS = 20
+FRAMES = 40
+
+
+def write_video(path, frames=FRAMES, fps=FPS):
+    """
+    生成一段有移动矩形的测试视频，MJPG编码不依赖额外的编解码器。
+    """
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, (160, 120))
+    assert writer.isOpened()
+    for i in range(frames):
+        frame = np.full((120, 160, 3), 40, np.uint8)
+        cv2.rectangle(frame, (10 + 2 * i, 30), (50 + 2 * i, 70), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return str(path)
+
+
+def count_frames(path):
+    capture = cv2.VideoCapture(str(path))
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    count = 0
+    while capture.grab():
+        count += 1
+    capture.release()
+    return count, fps
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_frame_counts_and_output_timing(predictor, tmp_path, frame_step):
+    source = write_video(tmp_path / 'source.avi')
+    output = tmp_path / 'out.mp4'
+    manholes, stats = predict_video(predictor, source, batch_size=4, frame_step=frame_step,
+                                    output_path=str(output))
+
+    processed = math.ceil(FRAMES / frame_step)
+    assert stats['frames_read'] == FRAMES
+    assert stats['frames_processed'] == processed
+    assert stats['frames_skipped'] == FRAMES - processed
+    assert stats['frames_dropped'] == 0
+    assert stats['frames_written'] == FRAMES
+    # 抽帧后写出的视频仍与源视频同帧率、同帧数
+    written, fps = count_frames(output)
+    assert written == FRAMES
+    assert fps == pytest.approx(FPS)
+
+    tracker = IoUTracker()
+    first_frames = [manhole['first_frame'] for manhole in manholes]
+    assert first_frames == sorted(first_frames)
+    for manhole in manholes:
+        assert manhole['first_frame'] <= manhole['best_frame'] <= manhole['last_frame']
+        assert manhole['hits'] >= tracker.min_hits
+        # 只有被推理的帧才会进入轨迹
+        assert manhole['best_frame'] % frame_step == 0
+
+
+def test_realtime_writes_every_source_frame(predictor, tmp_path):
+    source = write_video(tmp_path / 'source.avi')
+    output = tmp_path / 'out.mp4'
+    _, stats = predict_video(predictor, source, batch_size=4, realtime=True, output_path=str(output))
+    assert stats['frames_read'] == FRAMES
+    assert stats['frames_processed'] + stats['frames_skipped'] + stats['frames_dropped'] == FRAMES
+    assert stats['frames_written'] == FRAMES
+    assert count_frames(output)[0] == FRAMES
+
+
+def test_tracker_reports_each_object_once():
+    tracker = IoUTracker(iou_threshold=0.3, max_missed=2, min_hits=2)
+    reports = []
+    for frame_index in range(8):
+        boxes, class_ids, confidences = [], [], []
+        # 缓慢右移的目标，中间漏检一帧，类别在帧间跳变
+        if frame_index != 3:
+            boxes.append([10 + 2 * frame_index, 10, 50 + 2 * frame_index, 50])
+            class_ids.append(frame_index % 2)
+            confidences.append(0.9 if frame_index == 4 else 0.5)
+        # 只出现一帧的误检不上报
+        if frame_index == 2:
+            boxes.append([100, 100, 120, 120])
+            class_ids.append(3)
+            confidences.append(0.99)
+        # 后半段出现的第二个目标
+        if frame_index >= 5:
+            boxes.append([200, 10, 240, 50])
+            class_ids.append(2)
+            confidences.append(0.6)
+        _, finished = tracker.update(frame_index, boxes, class_ids, confidences)
+        reports.extend(finished)
+    reports.extend(tracker.finish())
+
+    assert len(reports) == 2
+    moving, second = sorted(reports, key=lambda report: report['first_frame'])
+    assert (moving['first_frame'], moving['last_frame'], moving['hits']) == (0, 7, 7)
+    assert (moving['best_frame'], moving['class_id'], moving['confidence']) == (4, 0, pytest.approx(0.9))
+    assert moving['best_box'] == [18, 10, 58, 50]
+    assert (second['first_frame'], second['last_frame'], second['hits'], second['class_id']) == (5, 7, 3, 2)
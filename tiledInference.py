@@ -0,0 +1,136 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from evaluate import box_iou, dataset_split, evaluate, load_ground_truth, unique_matches
+from onnxTest import ImagePredictor
+
+# COCO的目标尺寸划分（像素面积）
+SIZE_BUCKETS = {'small': (0, 32 ** 2), 'medium': (32 ** 2, 96 ** 2), 'large': (96 ** 2, float('inf'))}
+
+
+def predict_standard(predictor, image, timings):
+    """
+    普通推理（整图letterbox到模型输入尺寸），按与predict_tiled相同的阶段记录耗时。
+    """
+    batch = predictor.batch_buffer(predictor.fixed_batch_size or 1)
+    start = time.perf_counter()
+    _, info = predictor.preprocess_image(image, out=batch[0])
+    timings['preprocess'] = timings.get('preprocess', 0.0) + time.perf_counter() - start
+    start = time.perf_counter()
+    output = predictor.predict_padded(batch, 1)
+    timings['inference'] = timings.get('inference', 0.0) + time.perf_counter() - start
+    start = time.perf_counter()
+    prediction = predictor.postprocess(output, [info])[0]
+    timings['postprocess'] = timings.get('postprocess', 0.0) + time.perf_counter() - start
+    return prediction
+
+
+def matched_ground_truth(prediction, ground_truth, iou_threshold=0.5):
+    """
+    每个真实框是否被同类别的预测框以IoU不低于阈值匹配到。
+    """
+    boxes, class_ids, _ = prediction
+    gt_boxes, gt_classes = ground_truth
+    matched = np.zeros(len(gt_boxes), dtype=bool)
+    if len(boxes) == 0 or len(gt_boxes) == 0:
+        return matched
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    iou = box_iou(gt_boxes, boxes) * (gt_classes[:, None] == np.asarray(class_ids)[None, :])
+    gt_idx, _ = unique_matches(iou, iou_threshold)
+    matched[gt_idx] = True
+    return matched
+
+
+def recall_by_size(predictions, ground_truths):
+    """
+    IoU 0.5下的召回率，总体及按目标尺寸分组。
+    """
+    matched = np.concatenate([matched_ground_truth(p, g) for p, g in zip(predictions, ground_truths)])
+    areas = np.concatenate([np.prod(g[0][:, 2:] - g[0][:, :2], axis=1) for g in ground_truths])
+    recall = {'all': float(matched.mean()) if len(matched) else 0.0}
+    for name, (low, high) in SIZE_BUCKETS.items():
+        bucket = (areas >= low) & (areas < high)
+        recall[name] = float(matched[bucket].mean()) if bucket.any() else None
+    return recall
+
+
+def run_mode(predictor, image_paths, ground_truths, tiled, tile_size, overlap, include_full):
+    timings = {}
+    predictions = []
+    load_time = 0.0
+    for image_path in image_paths:
+        start = time.perf_counter()
+        image = predictor.load_image(image_path)
+        load_time += time.perf_counter() - start
+        if tiled:
+            predictions.append(predictor.predict_tiled(image, tile_size, overlap, include_full, timings=timings))
+        else:
+            predictions.append(predict_standard(predictor, image, timings))
+    report = evaluate(predictions, ground_truths)
+    count = max(len(image_paths), 1)
+    tiles = timings.pop('tiles', count)
+    latency = {stage: seconds * 1000 / count for stage, seconds in timings.items()}
+    latency['total'] = sum(latency.values())
+    return {
+        'recall': recall_by_size(predictions, ground_truths),
+        'map50': report['map50'],
+        'map50_95': report['map50_95'],
+        'latency_ms': latency,
+        'load_ms': load_time * 1000 / count,
+        'tiles_per_image': tiles / count,
+    }
+
+
+def format_comparison(results):
+    lines = [f"{'mode':>9} {'recall':>7} {'small':>7} {'medium':>7} {'large':>7} {'mAP50':>7} {'mAP50-95':>8} "
+             f"{'ms/img':>8} {'tiles':>6}"]
+    for mode, result in results.items():
+        recall = result['recall']
+        buckets = ' '.join(f"{recall[name]:>7.4f}" if recall[name] is not None else f"{'-':>7}"
+                           for name in SIZE_BUCKETS)
+        lines.append(f"{mode:>9} {recall['all']:>7.4f} {buckets} {result['map50']:>7.4f} "
+                     f"{result['map50_95']:>8.4f} {result['latency_ms']['total']:>8.1f} "
+                     f"{result['tiles_per_image']:>6.1f}")
+    for mode, result in results.items():
+        breakdown = ', '.join(f"{stage} {ms:.1f}" for stage, ms in result['latency_ms'].items() if stage != 'total')
+        lines.append(f"{mode} 各阶段耗时(ms/张): {breakdown}")
+    standard, tiled = results['standard']['recall'], results['tiled']['recall']
+    gains = ', '.join(f"{name} {tiled[name] - standard[name]:+.4f}"
+                      for name in ['all', *SIZE_BUCKETS] if tiled[name] is not None)
+    lines.append(f"切片推理召回率变化: {gains}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='对比普通推理与切片推理在测试集上的召回率与延迟')
+    parser.add_argument('--model', default='best-sim.onnx')
+    parser.add_argument('--variant', default=None, help='模型变体，如 int8-static')
+    parser.add_argument('--data', default='manhole_dataset.yaml', help='数据集配置文件')
+    parser.add_argument('--split', default='test', help='对比所用的数据集划分')
+    parser.add_argument('--dataset-root', default=None, help='覆盖配置文件中的数据集根目录')
+    parser.add_argument('--tile-size', type=int, default=None, help='切片边长，默认等于模型输入尺寸')
+    parser.add_argument('--overlap', type=float, default=0.2, help='相邻切片的重叠比例')
+    parser.add_argument('--no-full', action='store_true', help='不额外推理整图缩放版本')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--limit', type=int, default=None, help='只评估前N张图像')
+    parser.add_argument('--output', default=None, help='对比结果JSON的写入路径')
+    args = parser.parse_args()
+
+    image_paths, label_dir = dataset_split(args.data, args.split, args.dataset_root)
+    image_paths = image_paths[:args.limit]
+    ground_truths = [load_ground_truth(p, label_dir) for p in image_paths]
+    predictor = ImagePredictor(args.model, conf_threshold=args.conf, variant=args.variant)
+
+    results = {
+        'standard': run_mode(predictor, image_paths, ground_truths, False, args.tile_size, args.overlap,
+                             not args.no_full),
+        'tiled': run_mode(predictor, image_paths, ground_truths, True, args.tile_size, args.overlap,
+                          not args.no_full),
+    }
+    print(format_comparison(results))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
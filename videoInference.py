@@ -0,0 +1,362 @@
+import argparse
+import json
+import math
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from evaluate import box_iou, unique_matches
+from onnxTest import ImagePredictor
+
+
+class FrameRingBuffer:
+    """
+    解码线程与推理线程之间的有界环形缓冲区。
+    帧数组按槽位预先分配并循环复用（cap.retrieve直接写入槽位），稳态下解码不再分配内存。
+    槽位有三种状态：空闲、已写入待推理、被推理线程取走；取走的槽位用完后由release归还。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = [None] * capacity
+        self.frame_indices = [None] * capacity
+        self._free = deque(range(capacity))
+        self._filled = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def reserve(self, drop_oldest=False):
+        """
+        取一个空闲槽位用于写入下一帧。
+        没有空闲槽位时：drop_oldest为True则丢弃最早一帧待推理的帧腾出槽位，否则阻塞等待推理线程归还。
+        :return: 槽位下标；缓冲区已关闭时返回None
+        """
+        with self._cond:
+            while not self._free and not self.closed:
+                if drop_oldest and self._filled:
+                    self._free.append(self._filled.popleft())
+                    self.dropped += 1
+                    break
+                self._cond.wait()
+            if self.closed:
+                return None
+            return self._free.popleft()
+
+    def commit(self, slot, frame, frame_index):
+        with self._cond:
+            self.frames[slot] = frame
+            self.frame_indices[slot] = frame_index
+            self._filled.append(slot)
+            self._cond.notify_all()
+
+    def cancel(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def take(self, max_count, timeout=None):
+        """
+        按帧序取出最多max_count个已写入的槽位。第一个阻塞等待，其余有多少取多少，不为凑满一批而空等。
+        :return: 槽位下标列表；缓冲区已关闭且为空时返回空列表
+        """
+        with self._cond:
+            while not self._filled and not self.closed:
+                if not self._cond.wait(timeout):
+                    return []
+            slots = []
+            while self._filled and len(slots) < max_count:
+                slots.append(self._filled.popleft())
+            return slots
+
+    def release(self, slots):
+        with self._cond:
+            self._free.extend(slots)
+            self._cond.notify_all()
+
+    def close(self):
+        # 生产者读完或出错后调用：推理线程取完剩余帧后take返回空列表
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def exhausted(self):
+        with self._cond:
+            return self.closed and not self._filled
+
+
+class FrameReader(threading.Thread):
+    """
+    后台解码线程：从视频文件或流中按帧读入环形缓冲区。
+    不需要推理的帧只grab不retrieve，省去像素格式转换与拷贝。
+    realtime模式下按源帧率播放：领先于播放时钟时等待，缓冲区满时丢弃最早的待推理帧；
+    并根据推理吞吐自动调整抽帧间隔，使推理跟得上源帧率。
+    """
+
+    def __init__(self, source, buffer, frame_step=1, realtime=False):
+        super().__init__(daemon=True)
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise FileNotFoundError(f"无法打开视频源: {source}")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.buffer = buffer
+        self.frame_step = max(1, frame_step)
+        self.step = self.frame_step
+        self.realtime = realtime
+        self.frames_read = 0
+        self.frames_skipped = 0
+        self.error = None
+
+    def update_throughput(self, frames_per_second):
+        """
+        推理线程报告当前的推理吞吐（帧/秒），realtime模式据此调整抽帧间隔。
+        """
+        if self.realtime and frames_per_second > 0:
+            self.step = max(self.frame_step, math.ceil(self.fps / frames_per_second))
+
+    def run(self):
+        try:
+            start = time.perf_counter()
+            next_index = 0
+            while True:
+                if self.realtime:
+                    delay = self.frames_read / self.fps - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                if not self.capture.grab():
+                    break
+                frame_index = self.frames_read
+                self.frames_read += 1
+                if frame_index < next_index:
+                    self.frames_skipped += 1
+                    continue
+                next_index = frame_index + self.step
+
+                slot = self.buffer.reserve(drop_oldest=self.realtime)
+                if slot is None:
+                    break
+                ok, frame = self.capture.retrieve(self.buffer.frames[slot])
+                if not ok:
+                    self.buffer.cancel(slot)
+                    break
+                self.buffer.commit(slot, frame, frame_index)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.capture.release()
+            self.buffer.close()
+
+
+class IoUTracker:
+    """
+    轻量IoU跟踪器：相邻推理帧之间按IoU贪心匹配检测框（不区分类别，类别在帧间可能跳变），
+    每条轨迹记录置信度最高的一次检测。轨迹结束后作为一个井盖上报一次，类别取置信度最高的那次检测。
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=5, min_hits=2):
+        """
+        :param iou_threshold: 检测框与轨迹当前框匹配所需的最小IoU
+        :param max_missed: 轨迹连续多少次推理未匹配后结束
+        :param min_hits: 轨迹至少匹配多少次才上报，过滤偶发的误检
+        """
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.tracks = []
+        self.next_id = 0
+
+    def update(self, frame_index, boxes, class_ids, confidences):
+        """
+        用一帧的检测结果更新轨迹。
+        :return: (本帧各检测框所属的轨迹id列表, 本帧结束且需要上报的轨迹列表)
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        track_ids = [None] * len(boxes)
+        matched_tracks = set()
+        if self.tracks and len(boxes):
+            iou = box_iou(np.array([track['box'] for track in self.tracks], dtype=np.float32), boxes)
+            for track_idx, det_idx in zip(*unique_matches(iou, self.iou_threshold)):
+                self._extend(self.tracks[track_idx], frame_index, boxes[det_idx], class_ids[det_idx],
+                             confidences[det_idx])
+                track_ids[det_idx] = self.tracks[track_idx]['id']
+                matched_tracks.add(int(track_idx))
+
+        finished = []
+        alive = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track['missed'] += 1
+            if track['missed'] > self.max_missed:
+                finished.append(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+
+        for det_idx, track_id in enumerate(track_ids):
+            if track_id is None:
+                track = {'id': self.next_id, 'first_frame': frame_index, 'hits': 0, 'missed': 0,
+                         'confidence': -1.0}
+                self.next_id += 1
+                self._extend(track, frame_index, boxes[det_idx], class_ids[det_idx], confidences[det_idx])
+                self.tracks.append(track)
+                track_ids[det_idx] = track['id']
+        return track_ids, [self.report(track) for track in finished if track['hits'] >= self.min_hits]
+
+    @staticmethod
+    def _extend(track, frame_index, box, class_id, confidence):
+        track['box'] = box
+        track['last_frame'] = frame_index
+        track['hits'] += 1
+        track['missed'] = 0
+        if confidence > track['confidence']:
+            track.update(confidence=float(confidence), class_id=int(class_id), best_frame=frame_index,
+                         best_box=[int(v) for v in box])
+
+    def finish(self):
+        """
+        视频结束：结束全部轨迹并返回需要上报的轨迹。
+        """
+        finished = [self.report(track) for track in self.tracks if track['hits'] >= self.min_hits]
+        self.tracks = []
+        return finished
+
+    @staticmethod
+    def report(track):
+        return {key: track[key] for key in
+                ('id', 'class_id', 'confidence', 'first_frame', 'last_frame', 'best_frame', 'best_box', 'hits')}
+
+
+def predict_video(predictor, source, batch_size=8, frame_step=1, realtime=False, buffer_size=32,
+                  tracker=None, output_path=None):
+    """
+    视频/流推理：后台线程解码到环形缓冲区，推理线程把连续的帧凑成批次推理，结果按帧序送入IoU跟踪器。
+    :param predictor: ImagePredictor
+    :param source: 视频文件路径或流地址（如rtsp://...）
+    :param batch_size: 推理批量大小；模型导出时固定了批量维度则以模型为准
+    :param frame_step: 每隔多少帧推理一帧
+    :param realtime: 是否按源帧率实时处理，推理跟不上时自动加大抽帧间隔并丢弃积压的帧
+    :param buffer_size: 环形缓冲区的槽位数
+    :param tracker: IoUTracker，None时使用默认参数
+    :param output_path: 不为None时把画好框与轨迹id的推理帧写成与源视频同帧率、同帧数的视频，
+                        未推理的帧（抽帧跳过或丢弃）重复前一个推理帧，抽帧间隔自动变化时时间轴也不会错位
+    :return: (按首次出现排序的井盖列表, 统计字典)
+    """
+    if predictor.fixed_batch_size is not None:
+        batch_size = predictor.fixed_batch_size
+    tracker = tracker or IoUTracker()
+    ring = FrameRingBuffer(max(buffer_size, batch_size))
+    reader = FrameReader(source, ring, frame_step, realtime)
+    writer = None
+    # 最近一个写出的推理帧，用来填补其后未推理的源帧；written为已写出的帧数，即下一帧的源帧号
+    held_frame = None
+    written = 0
+    batch = predictor.batch_buffer(batch_size)
+    manholes = []
+    processed = 0
+    infer_time = 0.0
+
+    wall_start = time.perf_counter()
+    reader.start()
+    try:
+        while not ring.exhausted():
+            slots = ring.take(batch_size, timeout=0.1)
+            if not slots:
+                continue
+            try:
+                start = time.perf_counter()
+                frames = [ring.frames[slot] for slot in slots]
+                infos = [predictor.preprocess_image(frame, out=batch[i])[1] for i, frame in enumerate(frames)]
+                predictions = predictor.postprocess(predictor.predict_padded(batch, len(slots)), infos)
+                elapsed = time.perf_counter() - start
+                infer_time += elapsed
+                processed += len(slots)
+                reader.update_throughput(len(slots) / elapsed)
+
+                for slot, frame, prediction in zip(slots, frames, predictions):
+                    frame_index = ring.frame_indices[slot]
+                    track_ids, finished = tracker.update(frame_index, *prediction)
+                    manholes.extend(finished)
+                    if output_path:
+                        if writer is None:
+                            height, width = frame.shape[:2]
+                            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                                     reader.fps, (width, height))
+                            held_frame = np.empty_like(frame)
+                        predictor.draw_boxes(frame, prediction)
+                        for box, track_id in zip(prediction[0], track_ids):
+                            cv2.putText(frame, f"#{track_id}", (box[0], box[3] + 25), cv2.FONT_HERSHEY_SIMPLEX,
+                                        0.9, (0, 255, 255), 2)
+                        for _ in range(written, frame_index):
+                            writer.write(held_frame)
+                        writer.write(frame)
+                        written = frame_index + 1
+                        # 槽位归还后会被覆盖，留一份副本
+                        np.copyto(held_frame, frame)
+            finally:
+                ring.release(slots)
+    finally:
+        # 推理线程出错时让解码线程从阻塞中退出
+        ring.close()
+        reader.join()
+        if writer is not None:
+            # 最后一个推理帧之后的源帧同样用它补齐
+            for _ in range(written, reader.frames_read):
+                writer.write(held_frame)
+            written = max(written, reader.frames_read)
+            writer.release()
+
+    if reader.error is not None:
+        raise reader.error
+    manholes.extend(tracker.finish())
+    manholes.sort(key=lambda manhole: manhole['first_frame'])
+    wall = time.perf_counter() - wall_start
+    stats = {
+        'frames_read': reader.frames_read,
+        'frames_processed': processed,
+        'frames_skipped': reader.frames_skipped,
+        'frames_dropped': ring.dropped,
+        'frames_written': written,
+        'source_fps': reader.fps,
+        'final_step': reader.step,
+        'infer_fps': processed / infer_time if infer_time > 0 else 0.0,
+        'wall_seconds': wall,
+        'realtime_factor': reader.frames_read / reader.fps / wall if wall > 0 else 0.0,
+    }
+    return manholes, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='视频/流推理：抽帧、批量推理并用IoU跟踪器把每个井盖只上报一次')
+    parser.add_argument('source', help='视频文件路径或流地址')
+    parser.add_argument('--model', default='best-sim.onnx')
+    parser.add_argument('--variant', default=None, help='模型变体，如 int8-static')
+    parser.add_argument('--session-profile', default=None, help='ONNX Runtime会话配置文件')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--frame-step', type=int, default=1, help='每隔多少帧推理一帧')
+    parser.add_argument('--realtime', action='store_true', help='按源帧率实时处理，跟不上时自动抽帧与丢帧')
+    parser.add_argument('--buffer-size', type=int, default=32, help='解码环形缓冲区的帧数')
+    parser.add_argument('--track-iou', type=float, default=0.3, help='跟踪匹配的最小IoU')
+    parser.add_argument('--max-missed', type=int, default=5, help='轨迹连续未匹配多少次后结束')
+    parser.add_argument('--min-hits', type=int, default=2, help='轨迹至少匹配多少次才上报')
+    parser.add_argument('--output', default=None, help='画好框的视频的保存路径')
+    parser.add_argument('--report', default=None, help='井盖列表JSON的保存路径')
+    args = parser.parse_args()
+
+    predictor = ImagePredictor(args.model, conf_threshold=args.conf, session_profile=args.session_profile,
+                               variant=args.variant)
+    manholes, video_stats = predict_video(predictor, args.source, args.batch_size, args.frame_step, args.realtime,
+                                          args.buffer_size, IoUTracker(args.track_iou, args.max_missed,
+                                                                       args.min_hits), args.output)
+    for manhole in manholes:
+        print(f"#{manhole['id']} {predictor.class_names[manhole['class_id']]} {manhole['confidence']:.2f} "
+              f"帧 {manhole['first_frame']}-{manhole['last_frame']}（最佳 {manhole['best_frame']}）")
+    print(f"共 {len(manholes)} 个井盖；" + ', '.join(
+        f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}" for key, value in video_stats.items()))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({'manholes': manholes, 'stats': video_stats}, file, indent=2, ensure_ascii=False)